@@ -0,0 +1,969 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the PIPER ML service hot paths
+Run from the repo root: python bench_api.py [benchmark ...]
+"""
+
+import csv
+import io
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import numpy as np
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "ml_service")
+)
+
+import app  # noqa: E402
+from piper_core import cache, candidates, export, model, service  # noqa: E402
+
+# The benchmarks time the recommendation pipeline itself; bench_cache turns
+# the response cache back on.
+cache.recommendations_cache.ttl_s = 0
+
+
+def _fake_audio_features(n: int, *, seed: int = 0) -> tuple[list[str], dict[str, dict]]:
+    """Build n Spotify-shaped audio-features payloads (with the usual extra keys)."""
+    rng = np.random.default_rng(seed)
+    track_ids = [f"track{i:018d}" for i in range(n)]
+    features_by_id = {}
+    for tid in track_ids:
+        features_by_id[tid] = {
+            "id": tid,
+            "type": "audio_features",
+            "uri": f"spotify:track:{tid}",
+            "danceability": float(rng.random()),
+            "energy": float(rng.random()),
+            "valence": float(rng.random()),
+            "tempo": float(rng.uniform(60, 200)),
+            "loudness": float(rng.uniform(-30, 0)),
+            "key": int(rng.integers(0, 12)),
+            "mode": int(rng.integers(0, 2)),
+            "duration_ms": int(rng.integers(120_000, 300_000)),
+        }
+    return track_ids, features_by_id
+
+
+def _best_of(fn, repeat: int = 7) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_feature_matrix(n: int = 10_000):
+    """Per-dict float() loop (previous code) vs. model.feature_matrix"""
+    print(f"Feature-matrix assembly, {n} tracks")
+    track_ids, features_by_id = _fake_audio_features(n)
+
+    def legacy():
+        rows = []
+        ordered_ids = []
+        for tid in track_ids:
+            f = features_by_id.get(tid)
+            if not f:
+                continue
+            try:
+                rows.append(
+                    [
+                        float(f["danceability"]),
+                        float(f["energy"]),
+                        float(f["valence"]),
+                        float(f["tempo"]),
+                        float(f["loudness"]),
+                    ]
+                )
+                ordered_ids.append(tid)
+            except Exception:
+                continue
+        return np.array(rows, dtype=np.float32), ordered_ids
+
+    X_old, ids_old = legacy()
+    X_new, ids_new = model.feature_matrix(track_ids, features_by_id)
+    assert ids_old == ids_new
+    assert np.array_equal(X_old, X_new)
+
+    t_old = _best_of(legacy)
+    t_new = _best_of(lambda: model.feature_matrix(track_ids, features_by_id))
+    print(f"  legacy loop      : {t_old * 1e3:8.2f} ms")
+    print(f"  feature_matrix   : {t_new * 1e3:8.2f} ms  ({t_old / t_new:.1f}x)\n")
+
+
+def bench_export_formats(n: int = 10_000):
+    """Top-tracks export size and load-into-NumPy time per format"""
+    print(f"Export formats, {n} tracks")
+    track_ids, features_by_id = _fake_audio_features(n)
+    catalog = candidates.TrackCatalog(
+        {"id": tid, "name": f"Song {i}", "artists": [{"name": "Artist"}]}
+        for i, tid in enumerate(track_ids)
+    )
+    features = candidates.FeatureRows.from_chunks([features_by_id])
+    columns, X, _ = export.top_track_table(track_ids, catalog, features)
+    rows, _ = export.top_track_rows(track_ids, catalog, features)
+
+    tmpdir = tempfile.mkdtemp(prefix="piper-bench-")
+    paths = {}
+
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=export.TOP_TRACKS_CSV_FIELDS)
+    writer.writeheader()
+    writer.writerows(rows)
+    paths["csv"] = os.path.join(tmpdir, "top.csv")
+    with open(paths["csv"], "w", newline="", encoding="utf-8") as f:
+        f.write(buf.getvalue())
+
+    formats = ["npz", "arrow", "parquet"]
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        print("  (pyarrow not installed; skipping arrow/parquet)")
+        formats = ["npz"]
+    for fmt in formats:
+        paths[fmt] = os.path.join(tmpdir, f"top.{fmt}")
+        with open(paths[fmt], "wb") as f:
+            f.write(export.encode_top_tracks(fmt, columns, X))
+
+    def load_csv():
+        with open(paths["csv"], newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            return np.array(
+                [[float(r[c]) for c in model.FEATURE_COLUMNS] for r in reader],
+                dtype=np.float32,
+            )
+
+    def load_npz():
+        with np.load(paths["npz"]) as data:
+            return data["features"]
+
+    def load_arrow():
+        import pyarrow as pa
+
+        with pa.memory_map(paths["arrow"]) as source:
+            table = pa.ipc.open_file(source).read_all()
+            return np.column_stack(
+                [table.column(c).to_numpy() for c in model.FEATURE_COLUMNS]
+            )
+
+    def load_parquet():
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(paths["parquet"], columns=list(model.FEATURE_COLUMNS))
+        return np.column_stack(
+            [table.column(c).to_numpy() for c in model.FEATURE_COLUMNS]
+        )
+
+    loaders = {
+        "csv": load_csv,
+        "npz": load_npz,
+        "arrow": load_arrow,
+        "parquet": load_parquet,
+    }
+    t_csv = None
+    for fmt, path in paths.items():
+        loaded = loaders[fmt]()
+        assert np.allclose(loaded, X)
+        elapsed = _best_of(loaders[fmt])
+        t_csv = t_csv or elapsed
+        size_kb = os.path.getsize(path) / 1024
+        print(
+            f"  {fmt:8s}: {size_kb:8.1f} KiB  load {elapsed * 1e3:7.2f} ms"
+            f"  ({t_csv / elapsed:.1f}x vs csv)"
+        )
+    print()
+
+
+def _child_pids(pid: int) -> list[int]:
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(p) for p in f.read().split()]
+
+
+def _smaps_kib(pid: int) -> dict[str, int]:
+    """Rss/Pss/private KiB for a process (Linux smaps_rollup)."""
+    out = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("Rss", "Pss", "Private_Clean", "Private_Dirty"):
+                out[key] = int(rest.split()[0])
+    out["Private"] = out.pop("Private_Clean") + out.pop("Private_Dirty")
+    return out
+
+
+def _measure_server(cmd: list[str], port: int, n_workers: int, leaf: bool):
+    env = dict(os.environ, PIPER_MOOD_INDEX_PATH="")
+    cwd = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ml_service")
+    proc = subprocess.Popen(
+        cmd, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        deadline = time.time() + 120
+        while True:
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1)
+                workers = _child_pids(proc.pid)
+                if leaf:
+                    # uvicorn --workers: supervisor -> (resource tracker, workers)
+                    workers = [w for w in workers if _child_pids(w) == []]
+                if len(workers) >= n_workers:
+                    break
+            except OSError:
+                pass
+            if time.time() > deadline:
+                raise RuntimeError(f"server did not start: {' '.join(cmd)}")
+            time.sleep(0.5)
+        time.sleep(2)
+        samples = [_smaps_kib(pid) for pid in workers]
+        total_pss = sum(s["Pss"] for s in samples) + _smaps_kib(proc.pid)["Pss"]
+        return samples, total_pss
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(timeout=30)
+
+
+def bench_worker_memory(n_workers: int = 4):
+    """Per-worker memory: uvicorn --workers vs. pre-fork serve.py (Linux only)"""
+    print(f"Worker memory, {n_workers} workers (KiB, averaged per worker)")
+    runs = {
+        "uvicorn --workers": (
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "app:app",
+                "--port",
+                "8765",
+                "--workers",
+                str(n_workers),
+                "--log-level",
+                "warning",
+            ],
+            8765,
+            True,
+        ),
+        "serve.py (pre-fork)": (
+            [
+                sys.executable,
+                "serve.py",
+                "--port",
+                "8766",
+                "--workers",
+                str(n_workers),
+                "--log-level",
+                "warning",
+            ],
+            8766,
+            False,
+        ),
+    }
+    for label, (cmd, port, leaf) in runs.items():
+        samples, total_pss = _measure_server(cmd, port, n_workers, leaf)
+        avg = {k: sum(s[k] for s in samples) // len(samples) for k in samples[0]}
+        print(
+            f"  {label:20s}: Rss {avg['Rss']:7d}  Pss {avg['Pss']:7d}  "
+            f"Private {avg['Private']:7d}  | total Pss {total_pss:8d}"
+        )
+    print()
+
+
+def _precision_dataset(n: int) -> tuple[np.ndarray, str]:
+    """Features from PIPER_BENCH_FEATURES (an export file) or a synthetic set."""
+    path = os.environ.get("PIPER_BENCH_FEATURES")
+    if path:
+        import batch_score
+
+        chunks = [X for _, X in batch_score.iter_feature_chunks(path, 65536)]
+        return np.concatenate(chunks), path
+    # Draw around the scaler's training statistics so inputs look realistic.
+    scaler = model.read_artifacts(app.MODEL_PATH, app.SCALER_PATH).scaler
+    rng = np.random.default_rng(0)
+    X = rng.normal(scaler.mean_, scaler.scale_, size=(n, len(model.FEATURE_COLUMNS)))
+    return X.astype(np.float32), f"synthetic ({n} rows around scaler mean/std)"
+
+
+def bench_precision(n: int = 10_000):
+    """float32 vs int8 vs float16 MoodClassifier: parity, latency, size"""
+    import torch
+
+    X, source = _precision_dataset(n)
+    print(f"Inference precision, dataset: {source}")
+    variants = {
+        p: model.read_artifacts(app.MODEL_PATH, app.SCALER_PATH, precision=p)
+        for p in ("float32", "int8", "float16")
+    }
+    reference = model.predict_moods(X, variants["float32"])
+    ref_moods = reference.argmax(axis=1)
+
+    for precision, art in variants.items():
+        probs = model.predict_moods(X, art)
+        agree = (probs.argmax(axis=1) == ref_moods).mean() * 100
+        max_diff = np.abs(probs - reference).max()
+        buf = io.BytesIO()
+        torch.save(art.model.state_dict(), buf)
+        t_req = _best_of(lambda: model.predict_moods(X[:50], art), repeat=50)
+        t_bulk = _best_of(lambda: model.predict_moods(X, art))
+        print(
+            f"  {precision:8s}: agree {agree:6.2f}%  max|dp| {max_diff:.2e}  "
+            f"weights {len(buf.getvalue()) / 1024:5.1f} KiB  "
+            f"50 rows {t_req * 1e3:6.3f} ms  {len(X)} rows {t_bulk * 1e3:7.2f} ms"
+        )
+    print()
+
+
+def bench_concurrency(n_requests: int = 2000, concurrency: int = 32):
+    """/recommendations tail latency under concurrent load per torch threading setup"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    import torch
+    from fastapi.responses import Response
+
+    cores = os.cpu_count() or 1
+    print(
+        f"Concurrent /recommendations, {n_requests} requests x {concurrency} "
+        f"threads, {cores} cores (Spotify stubbed, mood index off)"
+    )
+    track_ids, features_by_id = _fake_audio_features(50)
+    service.top_track_ids = lambda access_token: track_ids
+
+    def fake_audio_features(access_token, ids, counts, **kwargs):
+        counts.update(batch_ok=len(ids))
+        yield {tid: features_by_id[tid] for tid in ids}
+
+    app.spotify_iter_audio_features = fake_audio_features
+    app.mood_index = None
+    app._load_artifacts()
+    req = service.RecommendationsRequest(mood="Happy", access_token="x", limit=20)
+
+    def one(_):
+        start = time.perf_counter()
+        service.recommendations(app.runtime, req, Response())
+        return time.perf_counter() - start
+
+    setups = {
+        f"torch default ({cores} threads)": (cores, 0),
+        "4 threads per core": (4 * cores, 0),
+        "auto (1 thread)": (1, 0),
+        "auto + 1 inference thread": (1, 1),
+    }
+    for label, (intra, pool_size) in setups.items():
+        torch.set_num_threads(intra)
+        app._inference_pool = (
+            ThreadPoolExecutor(max_workers=pool_size) if pool_size else None
+        )
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(100)))
+            start = time.perf_counter()
+            latencies = np.array(list(pool.map(one, range(n_requests))))
+            elapsed = time.perf_counter() - start
+        p50, p99, p999 = np.percentile(latencies, [50, 99, 99.9]) * 1e3
+        print(
+            f"  {label:28s}: p50 {p50:7.2f} ms  p99 {p99:7.2f} ms  "
+            f"p99.9 {p999:7.2f} ms  {n_requests / elapsed:7.0f} req/s"
+        )
+        if app._inference_pool is not None:
+            app._inference_pool.shutdown()
+            app._inference_pool = None
+    print()
+
+
+def bench_hedging(n_requests: int = 1000, concurrency: int = 8):
+    """spotify_get tail latency with and without hedging, simulated Spotify"""
+    import random
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    import requests
+    from fastapi import HTTPException
+
+    from piper_core import spotify
+
+    # 96% of calls take ~20 ms, 4% stall for 1 s, like the occasional slow
+    # Spotify call. Each attempt draws independently.
+    rng = random.Random(0)
+    rng_lock = threading.Lock()
+
+    class _Response:
+        ok = True
+        status_code = 200
+        headers: dict = {}
+
+        def json(self):
+            return {}
+
+    def fake_get(url, **kwargs):
+        with rng_lock:
+            slow = rng.random() < 0.04
+            jitter = rng.uniform(0.8, 1.2)
+        time.sleep((1.0 if slow else 0.02) * jitter)
+        return _Response()
+
+    real_get, real_hedger = requests.get, spotify.hedger
+    requests.get = fake_get
+    print(
+        f"Hedged Spotify GETs, {n_requests} calls x {concurrency} threads "
+        f"(simulated: 96% ~20 ms, 4% ~1 s)"
+    )
+
+    def one(_):
+        start = time.perf_counter()
+        try:
+            spotify.spotify_get("token", "/me/top/tracks", hedge=True)
+        except HTTPException:
+            pass
+        return time.perf_counter() - start
+
+    try:
+        for label, hedger in {
+            "no hedging": None,
+            "hedge at p95, 10% cap": spotify.RequestHedger(95, 0.1),
+            "hedge at p90, 5% cap": spotify.RequestHedger(90, 0.05),
+        }.items():
+            spotify.hedger = hedger
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                latencies = np.array(list(pool.map(one, range(n_requests))))
+            p50, p99, p999 = np.percentile(latencies, [50, 99, 99.9]) * 1e3
+            line = (
+                f"  {label:22s}: p50 {p50:7.1f} ms  p99 {p99:7.1f} ms  "
+                f"p99.9 {p999:7.1f} ms"
+            )
+            if hedger is not None:
+                stats = hedger.stats()
+                line += (
+                    f"  extra {stats['hedged'] / stats['requests']:5.1%}  "
+                    f"wins {stats['hedgeWins']}/{stats['hedged']}"
+                )
+            print(line)
+    finally:
+        requests.get, spotify.hedger = real_get, real_hedger
+    print()
+
+
+def bench_circuit_breaker(n_requests: int = 20):
+    """/recommendations latency while /audio-features returns 403"""
+    import requests
+    from fastapi.responses import Response
+
+    from piper_core import spotify
+
+    class _Forbidden:
+        ok = False
+        status_code = 403
+        headers: dict = {}
+        text = reason = "Forbidden"
+
+        def json(self):
+            return {"error": {"status": 403, "message": "Forbidden"}}
+
+    def fake_get(url, **kwargs):
+        time.sleep(0.03)  # ~30 ms per Spotify round trip
+        return _Forbidden()
+
+    track_ids, _ = _fake_audio_features(50)
+    real_get, real_breaker = requests.get, spotify.audio_features_breaker
+    real_top_track_ids = service.top_track_ids
+    requests.get = fake_get
+    service.top_track_ids = lambda access_token: track_ids
+    app.mood_index = None
+    app._load_artifacts()
+    req = service.RecommendationsRequest(mood="Happy", access_token="x", limit=20)
+    print(
+        f"/recommendations during an /audio-features 403 outage, {n_requests} "
+        f"requests, 50 candidates, 30 ms per Spotify call"
+    )
+    try:
+        for label, breaker in {
+            "no breaker": spotify.CircuitBreaker(failure_threshold=10**9),
+            "breaker (5 failures)": spotify.CircuitBreaker(failure_threshold=5),
+        }.items():
+            spotify.audio_features_breaker = breaker
+            latencies = []
+            for _ in range(n_requests):
+                start = time.perf_counter()
+                service.recommendations(app.runtime, req, Response())
+                latencies.append(time.perf_counter() - start)
+            latencies = np.array(latencies) * 1e3
+            print(
+                f"  {label:20s}: first {latencies[0]:7.1f} ms  "
+                f"median {np.median(latencies):7.1f} ms  "
+                f"total {latencies.sum() / 1e3:6.2f} s"
+            )
+    finally:
+        requests.get, spotify.audio_features_breaker = real_get, real_breaker
+        service.top_track_ids = real_top_track_ids
+    print()
+
+
+def _fake_track(tid: str, markets: list[str]) -> dict:
+    """A /me/top/tracks item with the fields (and market lists) Spotify sends."""
+    artist = {
+        "id": f"artist{tid[-6:]}",
+        "name": "Some Artist",
+        "type": "artist",
+        "uri": f"spotify:artist:artist{tid[-6:]}",
+        "href": f"https://api.spotify.com/v1/artists/artist{tid[-6:]}",
+        "external_urls": {"spotify": "https://open.spotify.com/artist/x"},
+    }
+    return {
+        "id": tid,
+        "name": f"Track {tid}",
+        "type": "track",
+        "uri": f"spotify:track:{tid}",
+        "href": f"https://api.spotify.com/v1/tracks/{tid}",
+        "popularity": 57,
+        "duration_ms": 201_000,
+        "explicit": False,
+        "is_local": False,
+        "track_number": 3,
+        "disc_number": 1,
+        "preview_url": None,
+        "external_ids": {"isrc": "USUM71234567"},
+        "external_urls": {"spotify": f"https://open.spotify.com/track/{tid}"},
+        "available_markets": markets,
+        "artists": [artist],
+        "album": {
+            "id": f"album{tid[-6:]}",
+            "name": "Some Album",
+            "album_type": "album",
+            "release_date": "2021-06-04",
+            "release_date_precision": "day",
+            "total_tracks": 12,
+            "available_markets": markets,
+            "artists": [artist],
+            "images": [
+                {"url": f"https://i.scdn.co/image/{tid}{size}", "height": size}
+                for size in (640, 300, 64)
+            ],
+        },
+    }
+
+
+def bench_candidates(n: int = 10_000):
+    """Candidate pool memory: Spotify dicts vs TrackCatalog + FeatureRows"""
+    import gc
+    import json
+    import tracemalloc
+
+    markets = [f"{a}{b}" for a in "ABCDEFGHIJKLMN" for b in "ABCDEFGHIJKLM"][:185]
+    track_ids, features_by_id = _fake_audio_features(n)
+    tracks = []
+    for i, tid in enumerate(track_ids):
+        track = _fake_track(tid, markets)
+        # ~1500 distinct artists, as in a pool merged from many users.
+        track["artists"][0]["name"] = f"Artist {i % 1500}"
+        tracks.append(track)
+    # Spotify-shaped response bodies: top-tracks pages of 50, audio-features
+    # batches of 100. Each is parsed when "received", as in the client.
+    track_pages = [
+        json.dumps({"items": tracks[i : i + 50]}).encode() for i in range(0, n, 50)
+    ]
+    feature_pages = [
+        json.dumps(
+            {"audio_features": [features_by_id[t] for t in track_ids[i : i + 100]]}
+        ).encode()
+        for i in range(0, n, 100)
+    ]
+    del tracks, features_by_id
+
+    def dicts():
+        meta_by_id, features_by_id = {}, {}
+        for body in track_pages:
+            for t in json.loads(body)["items"]:
+                meta_by_id.setdefault(t["id"], t)
+        for body in feature_pages:
+            for f in json.loads(body)["audio_features"]:
+                features_by_id[f["id"]] = f
+        return meta_by_id, features_by_id
+
+    def compact():
+        catalog, features = candidates.TrackCatalog(), candidates.FeatureRows()
+        for body in track_pages:
+            catalog.add(json.loads(body)["items"])
+        for body in feature_pages:
+            features.add({f["id"]: f for f in json.loads(body)["audio_features"]})
+        features.X  # consolidate the per-batch blocks
+        return catalog, features
+
+    print(f"Candidate pool of {n} tracks (185 markets per track, 1500 artists)")
+    for label, build in (
+        ("dicts (previous)", dicts),
+        ("TrackCatalog + FeatureRows", compact),
+    ):
+        elapsed = _best_of(build, repeat=3)
+        gc.collect()
+        tracemalloc.start()
+        pool = build()
+        gc.collect()
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del pool
+        print(
+            f"  {label:28s}: retained {retained / 2**20:7.2f} MiB "
+            f"({retained / n:6.0f} B/track)  peak {peak / 2**20:7.2f} MiB  "
+            f"build {elapsed * 1e3:7.1f} ms"
+        )
+    print()
+
+
+def bench_payloads(n_pages: int = 200):
+    """Spotify track-list pages: bytes and parse time per projection"""
+    import json
+
+    from piper_core import jsonio, spotify
+
+    markets = [f"{a}{b}" for a in "ABCDEFGHIJKLMN" for b in "ABCDEFGHIJKLM"][:185]
+    tracks = [_fake_track(f"{i:022d}", markets) for i in range(50)]
+    next_url = "https://api.spotify.com/v1/me/tracks?offset=50&limit=50"
+
+    def with_market(track: dict) -> dict:
+        # What Spotify sends when the request carries ``market``.
+        track = {k: v for k, v in track.items() if k != "available_markets"}
+        track["is_playable"] = True
+        track["album"] = {
+            k: v for k, v in track["album"].items() if k != "available_markets"
+        }
+        return track
+
+    def project(track: dict, fields: tuple[str, ...]) -> dict:
+        out = {k: track[k] for k in fields if k != "artists"}
+        if "artists" in fields:
+            out["artists"] = [{"name": a["name"]} for a in track["artists"]]
+        return out
+
+    def page(items: list[dict], *, projected: bool = False) -> bytes:
+        # A ``fields`` projection also drops the item and page metadata.
+        meta = {} if projected else {"added_at": "2024-01-01T00:00:00Z"}
+        body = {"items": [meta | {"track": t} for t in items], "next": next_url}
+        if not projected:
+            body |= {"href": next_url, "limit": 50, "offset": 0, "total": 1200}
+        return json.dumps(body).encode()
+
+    variants = (
+        ("full (no market)", page(tracks)),
+        ("market=from_token", page([with_market(t) for t in tracks])),
+        (
+            "fields=id,name,artists",
+            page(
+                [project(t, ("id", "name", "artists")) for t in tracks],
+                projected=True,
+            ),
+        ),
+        ("fields=id", page([project(t, ("id",)) for t in tracks], projected=True)),
+    )
+
+    def parse(body: bytes):
+        for _ in range(n_pages):
+            payload = jsonio.loads(body)
+            spotify._slim_tracks([item["track"] for item in payload["items"]])
+
+    full_bytes = len(variants[0][1])
+    print("Track-list page of 50 tracks (185 markets per track), parse + slim")
+    for label, body in variants:
+        elapsed = _best_of(lambda: parse(body), repeat=5) / n_pages
+        print(
+            f"  {label:24s}: {len(body) / 1024:7.1f} KiB/page "
+            f"({len(body) / full_bytes:6.1%})  {elapsed * 1e3:6.3f} ms/page"
+        )
+    print()
+
+
+def bench_serialization(n_requests: int = 300):
+    """stdlib json vs the PIPER_JSON_BACKEND=orjson path, per-request CPU"""
+    import json
+    import warnings
+
+    import requests
+    from fastapi.testclient import TestClient
+
+    from piper_core import jsonio
+
+    if jsonio.orjson is None:
+        print("  (orjson not installed; skipping serialization)\n")
+        return
+
+    markets = [f"{a}{b}" for a in "ABCDEFGHIJKLM" for b in "ABCDEFGHIJKLMN"]
+
+    def spotify_response(payload: dict) -> requests.Response:
+        res = requests.Response()
+        res.status_code = 200
+        res._content = json.dumps(payload).encode()
+        res.encoding = "utf-8"
+        res.headers["content-type"] = "application/json; charset=utf-8"
+        return res
+
+    def payloads(n: int) -> list[requests.Response]:
+        """Top-tracks pages plus audio-features batches for n candidates."""
+        track_ids, features_by_id = _fake_audio_features(n)
+        pages = [
+            {"items": [_fake_track(tid, markets) for tid in track_ids[i : i + 50]]}
+            for i in range(0, n, 50)
+        ]
+        batches = [
+            {"audio_features": [features_by_id[t] for t in track_ids[i : i + 100]]}
+            for i in range(0, n, 100)
+        ]
+        return [spotify_response(p) for p in pages + batches]
+
+    real_fast, real_get = jsonio.FAST_JSON, requests.get
+    print(
+        "Spotify payload parsing per candidate pool (top-tracks pages + audio features)"
+    )
+    try:
+        for n in (50, 500, 2000):
+            responses = payloads(n)
+            size_mib = sum(len(r.content) for r in responses) / 2**20
+            line = f"  {n:5d} tracks ({size_mib:5.2f} MiB):"
+            for label, enabled in (("stdlib", False), ("orjson", True)):
+                jsonio.FAST_JSON = enabled
+                t = _best_of(lambda: [jsonio.response_json(r) for r in responses])
+                line += f"  {label} {t * 1e3:7.2f} ms"
+            print(line)
+
+        # End to end through the app, Spotify stubbed with the 50-track payloads.
+        track_ids, features_by_id = _fake_audio_features(50)
+        top_body = spotify_response(
+            {"items": [_fake_track(tid, markets) for tid in track_ids]}
+        )._content
+
+        def fake_get(url, params=None, **kwargs):
+            if url.endswith("/audio-features"):
+                ids = params["ids"].split(",")
+                res = spotify_response(
+                    {"audio_features": [features_by_id[t] for t in ids]}
+                )
+            else:
+                res = spotify_response({})
+                res._content = top_body
+            return res
+
+        requests.get = fake_get
+        app.mood_index = None
+        app._load_artifacts()
+        client = TestClient(app.app)
+        # The scaler was fitted on a DataFrame; sklearn warns on every request.
+        warnings.filterwarnings("ignore", message="X does not have valid feature names")
+        body = {"mood": "Happy", "access_token": "x", "limit": 50}
+        print(f"CPU per request, 50 candidates, {n_requests} requests")
+        for path in ("/recommendations", "/recommendations/stream"):
+            line = f"  {path:24s}:"
+            for label, enabled in (("stdlib", False), ("orjson", True)):
+                jsonio.FAST_JSON = enabled
+                for _ in range(20):
+                    client.post(path, json=body)
+                start = time.process_time()
+                for _ in range(n_requests):
+                    client.post(path, json=body)
+                cpu = (time.process_time() - start) / n_requests
+                line += f"  {label} {cpu * 1e3:6.2f} ms"
+            print(line)
+    finally:
+        jsonio.FAST_JSON, requests.get = real_fast, real_get
+    print()
+
+
+def bench_batch(n_users: int = 50):
+    """Per-user /recommendations vs /recommendations/batch, simulated Spotify"""
+    import json
+    from concurrent.futures import ThreadPoolExecutor
+
+    import requests
+    from fastapi.responses import Response
+
+    pool_ids, features_by_id = _fake_audio_features(1000)
+    rng = np.random.default_rng(0)
+    top_by_token = {
+        f"user{u}": [pool_ids[i] for i in rng.choice(len(pool_ids), 50, replace=False)]
+        for u in range(n_users)
+    }
+
+    class _Response:
+        ok = True
+        status_code = 200
+        headers: dict = {}
+
+        def __init__(self, payload):
+            self.content = json.dumps(payload).encode()
+
+        def json(self):
+            return json.loads(self.content)
+
+    def fake_get(url, params=None, headers=None, **kwargs):
+        time.sleep(0.02)  # ~20 ms per Spotify round trip
+        if url.endswith("/audio-features"):
+            ids = params["ids"].split(",")
+            return _Response({"audio_features": [features_by_id[t] for t in ids]})
+        token = headers["Authorization"].split()[1]
+        return _Response({"items": [{"id": t} for t in top_by_token[token]]})
+
+    real_get = requests.get
+    requests.get = fake_get
+    app.mood_index = None
+    app._load_artifacts()
+    moods = list(model.MOOD_TO_ID)
+    entries = [
+        service.RecommendationsRequest(
+            mood=moods[u % len(moods)], access_token=f"user{u}", limit=20
+        )
+        for u in range(n_users)
+    ]
+    predicted_rows = []
+    real_run_inference = app._run_inference
+
+    def counting_run_inference(X, art):
+        predicted_rows.append(len(X))
+        return real_run_inference(X, art)
+
+    app._run_inference = counting_run_inference
+    print(
+        f"{n_users} users x 50 candidates from a 1000-track pool, "
+        f"20 ms per Spotify call (mood index off)"
+    )
+
+    def one(entry):
+        return service.recommendations(app.runtime, entry, Response()).trackIds
+
+    def concurrent():
+        with ThreadPoolExecutor(
+            max_workers=service.BATCH_RECOMMENDATIONS_CONCURRENCY
+        ) as pool:
+            return list(pool.map(one, entries))
+
+    def batch():
+        res = service.batch_recommendations(
+            app.runtime,
+            service.BatchRecommendationsRequest(requests=entries),
+            Response(),
+        )
+        return [r.trackIds for r in res.results]
+
+    try:
+        expected = [one(entry) for entry in entries]
+        setups = {
+            "sequential /recommendations": lambda: [one(e) for e in entries],
+            f"{service.BATCH_RECOMMENDATIONS_CONCURRENCY} concurrent /recommendations": (
+                concurrent
+            ),
+            "/recommendations/batch": batch,
+        }
+        for label, fn in setups.items():
+            predicted_rows.clear()
+            wall, cpu = time.perf_counter(), time.process_time()
+            assert fn() == expected
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            print(
+                f"  {label:32s}: wall {wall * 1e3:7.1f} ms  cpu {cpu * 1e3:6.1f} ms  "
+                f"{len(predicted_rows):3d} inference calls, "
+                f"{sum(predicted_rows)} rows"
+            )
+    finally:
+        requests.get = real_get
+        app._run_inference = real_run_inference
+    print()
+
+
+def bench_cache(n_requests: int = 200):
+    """/recommendations response cache: miss vs hit, simulated Spotify"""
+    import json
+    import warnings
+
+    import requests
+    from fastapi.responses import Response
+
+    pool_ids, features_by_id = _fake_audio_features(50)
+
+    class _Response:
+        ok = True
+        status_code = 200
+        headers: dict = {}
+
+        def __init__(self, payload):
+            self.content = json.dumps(payload).encode()
+
+        def json(self):
+            return json.loads(self.content)
+
+    calls = []
+
+    def fake_get(url, params=None, **kwargs):
+        calls.append(url)
+        time.sleep(0.02)  # ~20 ms per Spotify round trip
+        if url.endswith("/audio-features"):
+            ids = params["ids"].split(",")
+            return _Response({"audio_features": [features_by_id[t] for t in ids]})
+        return _Response({"items": [{"id": t} for t in pool_ids]})
+
+    real_get = requests.get
+    requests.get = fake_get
+    app.mood_index = None
+    app._load_artifacts()
+    cache.recommendations_cache.ttl_s = 120
+    # The scaler was fitted on a DataFrame; sklearn warns on every request.
+    warnings.filterwarnings("ignore", message="X does not have valid feature names")
+    req = service.RecommendationsRequest(mood="Happy", access_token="x", limit=20)
+    print(
+        f"/recommendations x {n_requests}, 50 candidates, 20 ms per Spotify call "
+        f"(mood index off)"
+    )
+    try:
+        for label, use_cache in (
+            ("miss (Cache-Control: no-cache)", False),
+            ("hit", True),
+        ):
+            service.recommendations(app.runtime, req, Response())
+            calls.clear()
+            latencies = []
+            for _ in range(n_requests):
+                start = time.perf_counter()
+                response = Response()
+                service.recommendations(app.runtime, req, response, use_cache=use_cache)
+                latencies.append(time.perf_counter() - start)
+            p50, p99 = np.percentile(latencies, [50, 99]) * 1e3
+            print(
+                f"  {label:30s}: p50 {p50:8.3f} ms  p99 {p99:8.3f} ms  "
+                f"{len(calls) / n_requests:.0f} Spotify calls/request  "
+                f"X-Cache: {response.headers['X-Cache']}"
+            )
+    finally:
+        requests.get = real_get
+        cache.recommendations_cache.ttl_s = 0
+        cache.recommendations_cache.clear()
+    print()
+
+
+BENCHMARKS = {
+    "feature_matrix": bench_feature_matrix,
+    "export_formats": bench_export_formats,
+    "worker_memory": bench_worker_memory,
+    "precision": bench_precision,
+    "concurrency": bench_concurrency,
+    "hedging": bench_hedging,
+    "circuit_breaker": bench_circuit_breaker,
+    "candidates": bench_candidates,
+    "payloads": bench_payloads,
+    "serialization": bench_serialization,
+    "batch": bench_batch,
+    "cache": bench_cache,
+}
+
+
+def main():
+    names = sys.argv[1:] or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        print(f"Unknown benchmark(s): {', '.join(unknown)}")
+        print(f"Available: {', '.join(BENCHMARKS)}")
+        sys.exit(1)
+
+    print("⏱️  PIPER ML API Benchmarks\n")
+    for name in names:
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,723 +1,776 @@
 from __future__ import annotations
 
+import atexit
+import logging
 import os
-import csv
+import secrets
+import sqlite3
+import sys
+import threading
 import time
-from typing import List, Literal, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, NamedTuple, Optional
 
-import joblib
 import numpy as np
-import requests
-import torch
-import torch.nn as nn
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, Field
+from fastapi import Header, HTTPException
+from fastapi.responses import Response
+from pydantic import BaseModel
+from sklearn.neighbors import KDTree
+
+# The shared piper_core package lives at the repo root, next to ml_service/.
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _REPO_ROOT not in sys.path:
+    sys.path.insert(0, _REPO_ROOT)
+
+from piper_core.candidates import FeatureRows  # noqa: E402
+from piper_core.export import ExportTopTracksCsvRequest  # noqa: E402
+from piper_core.jobs import ExportJob, ExportJobs  # noqa: E402
+from piper_core.jsonio import model_response  # noqa: E402
+from piper_core.prefetch import (  # noqa: E402
+    Prefetcher,
+    PrefetchRequest,
+    PrefetchResponse,
+)
+from piper_core.model import (  # noqa: E402
+    FEATURE_COLUMNS,
+    MODEL_PRECISION,
+    MOOD_TO_ID,
+    Artifacts,
+    configure_torch_threads,
+    feature_matrix,
+    precision_version,
+    predict_moods,
+    read_artifacts,
+)
+from piper_core.service import (  # noqa: E402
+    RECOMMENDATIONS_DEADLINE_S,
+    RecommendationsRequest,
+    PrefetchedTracks,
+    RecommendationsResponse,
+    Runtime,
+    create_app,
+    env_path,
+    require_artifacts,
+)
+from piper_core.spotify import (  # noqa: E402
+    deadline,
+    spotify_iter_audio_features,
+    top_track_ids,
+)
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = env_path("PIPER_MODEL_PATH", "models/piper_model.pth", _BASE_DIR)
+SCALER_PATH = env_path("PIPER_SCALER_PATH", "models/scaler1.joblib", _BASE_DIR)
+
+# Optional versioned registry: <registry>/<version>/{piper_model.pth,scaler1.joblib},
+# with the active version named in <registry>/CURRENT (else the greatest name).
+MODEL_REGISTRY = os.environ.get("PIPER_MODEL_REGISTRY") or None
+MODEL_POLL_S = float(os.environ.get("PIPER_MODEL_POLL_S", "30"))
+
+# Track activity (for prewarm.py) is buffered in memory and written to the
+# mood index every PIPER_ACTIVITY_FLUSH_S, or sooner once this many distinct
+# tracks are waiting.
+ACTIVITY_FLUSH_S = float(os.environ.get("PIPER_ACTIVITY_FLUSH_S", "30"))
+ACTIVITY_BUFFER_MAX = int(os.environ.get("PIPER_ACTIVITY_BUFFER_MAX", "10000"))
+
+
+def mood_index_path() -> Optional[str]:
+    """The mood index file from PIPER_MOOD_INDEX_PATH; None if disabled."""
+    value = os.environ.get("PIPER_MOOD_INDEX_PATH")
+    if value is not None:
+        # Explicitly empty disables the index.
+        return value or None
+    return os.path.join(_BASE_DIR, "data", "mood_index.sqlite")
+
+
+def _export_jobs_dir() -> Optional[str]:
+    value = os.environ.get("PIPER_EXPORT_JOBS_DIR")
+    if value is not None:
+        # Explicitly empty disables the export job endpoints.
+        return value or None
+    return os.path.join(_BASE_DIR, "data", "export_jobs")
 
-SPOTIFY_API_BASE_URL = "https://api.spotify.com/v1"
 
-TRENDING_PLAYLIST_ID = "37i9dQZF1DXbVhgADFy3im"
+def _csv_path() -> str:
+    value = os.environ.get("PIPER_TOP_TRACKS_CSV_PATH")
+    if value:
+        return value
+    repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    return os.path.join(repo_root, "web_app", "top_tracks_features.csv")
 
-Mood = Literal["Happy", "Calm", "Neutral", "Sad", "Very Sad"]
 
-MOOD_TO_ID = {
-    "Happy": 0,
-    "Calm": 1,
-    "Neutral": 2,
-    "Sad": 3,
-    "Very Sad": 4,
-}
+logger = logging.getLogger("piper.ml_service")
 
+# Replaced atomically on reload; take one reference per request and use it
+# throughout so a swap never mixes a model with another version's scaler.
+artifacts: Artifacts | None = None
+_reload_lock = threading.Lock()
 
-class MoodClassifier(nn.Module):
-    def __init__(self):
-        super().__init__()
-        self.fc1 = nn.Linear(5, 64)
-        self.fc2 = nn.Linear(64, 32)
-        self.fc3 = nn.Linear(32, 5)
-        self.relu = nn.ReLU()
-        self.dropout = nn.Dropout(0.5)
 
-    def forward(self, x):
-        x = self.relu(self.fc1(x))
-        x = self.dropout(x)
-        x = self.relu(self.fc2(x))
-        x = self.dropout(x)
-        x = self.fc3(x)
-        return x
+class MoodIndexEntry(NamedTuple):
+    features: np.ndarray
+    mood: int
+    probabilities: np.ndarray
+    model_version: str
 
 
-class RecommendationsRequest(BaseModel):
-    mood: Mood
-    access_token: str = Field(min_length=1)
-    limit: int = Field(default=20, ge=1, le=50)
+class MoodIndex:
+    """Persistent track ID -> audio features + predicted mood, backed by SQLite.
+
+    Predictions depend only on a track's five audio features, so each track is
+    classified once per model version. Entries written under an older model
+    version still carry the features, so they can be re-scored without asking
+    Spotify again.
+    """
+
+    def __init__(self, path: str, *, activity_buffer_max: int = ACTIVITY_BUFFER_MAX):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # track id -> last seen, not yet written to track_activity.
+        self._activity: dict[str, float] = {}
+        self._activity_lock = threading.Lock()
+        self._activity_buffer_max = activity_buffer_max
+        self._activity_full = threading.Event()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS mood_index (
+                    track_id TEXT PRIMARY KEY,
+                    features BLOB NOT NULL,
+                    mood INTEGER NOT NULL,
+                    probabilities BLOB NOT NULL,
+                    model_version TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """)
+            # Last time a request asked for each track, indexed or not; the
+            # prewarm job (prewarm.py) scores these ahead of peak hours.
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS track_activity (
+                    track_id TEXT PRIMARY KEY,
+                    seen_at REAL NOT NULL
+                )
+                """)
+
+    def touch(self, track_ids: list[str]):
+        """Record that a request just asked for ``track_ids``.
+
+        Only buffered; flush_activity writes the buffer to SQLite.
+        """
+        now = time.time()
+        with self._activity_lock:
+            self._activity.update(dict.fromkeys(track_ids, now))
+            full = len(self._activity) >= self._activity_buffer_max
+        if full:
+            self._activity_full.set()
+
+    def wait_for_activity(self, timeout: float) -> bool:
+        """Sleep up to ``timeout`` seconds, waking early once the buffer is full."""
+        full = self._activity_full.wait(timeout)
+        self._activity_full.clear()
+        return full
+
+    def flush_activity(self) -> int:
+        """Write the buffered activity to track_activity; returns the row count."""
+        with self._activity_lock:
+            activity, self._activity = self._activity, {}
+        if activity:
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO track_activity VALUES (?, ?)",
+                    activity.items(),
+                )
+        return len(activity)
+
+    def active_track_ids(self, since: float) -> list[str]:
+        """Tracks requested at or after ``since``, most recent first."""
+        self.flush_activity()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT track_id FROM track_activity WHERE seen_at >= ? "
+                "ORDER BY seen_at DESC",
+                (since,),
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def prune_activity(self, before: float) -> int:
+        self.flush_activity()
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "DELETE FROM track_activity WHERE seen_at < ?", (before,)
+            ).rowcount
+
+    def lookup(self, track_ids: list[str]) -> dict[str, MoodIndexEntry]:
+        out: dict[str, MoodIndexEntry] = {}
+        # Stay well below SQLite's bound-parameter limit.
+        for i in range(0, len(track_ids), 500):
+            chunk = track_ids[i : i + 500]
+            query = (
+                "SELECT track_id, features, mood, probabilities, model_version "
+                f"FROM mood_index WHERE track_id IN ({','.join('?' * len(chunk))})"
+            )
+            with self._lock:
+                rows = self._conn.execute(query, chunk).fetchall()
+            for tid, features, mood, probabilities, version in rows:
+                out[tid] = MoodIndexEntry(
+                    features=np.frombuffer(features, dtype=np.float32),
+                    mood=int(mood),
+                    probabilities=np.frombuffer(probabilities, dtype=np.float32),
+                    model_version=version,
+                )
+        return out
+
+    def scan(self, model_version: str) -> tuple[list[str], np.ndarray, np.ndarray]:
+        """Tracks scored by ``model_version`` as (track_ids, features, mood ids).
+
+        Entries from other versions are skipped: their moods are another
+        model's predictions.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT track_id, features, mood FROM mood_index "
+                "WHERE model_version = ?",
+                (model_version,),
+            ).fetchall()
+        X = np.frombuffer(b"".join(r[1] for r in rows), dtype=np.float32)
+        return (
+            [r[0] for r in rows],
+            X.reshape(-1, len(FEATURE_COLUMNS)),
+            np.array([r[2] for r in rows], dtype=np.int64),
+        )
 
+    def store(
+        self,
+        track_ids: list[str],
+        X: np.ndarray,
+        probabilities: np.ndarray,
+        version: str,
+    ):
+        X = np.asarray(X, dtype=np.float32)
+        probabilities = np.asarray(probabilities, dtype=np.float32)
+        moods = probabilities.argmax(axis=1).tolist()
+        now = time.time()
+        rows = [
+            (tid, X[i].tobytes(), moods[i], probabilities[i].tobytes(), version, now)
+            for i, tid in enumerate(track_ids)
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO mood_index VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
 
-class RecommendationsResponse(BaseModel):
-    trackIds: List[str]
 
+class FeatureNeighbors:
+    """Nearest-neighbour search over the scaled features of indexed tracks.
 
-class ExportTopTracksCsvRequest(BaseModel):
-    access_token: str = Field(min_length=1)
-    limit: int = Field(default=50, ge=1, le=50)
-    time_range: Literal["short_term", "medium_term", "long_term"] = "medium_term"
+    Keeps one KD-tree per predicted mood, built from the index entries scored
+    by the current model and rebuilt lazily once it is older than
+    ``max_age_s`` or the model version changed.
+    """
 
+    def __init__(self, index: MoodIndex, *, max_age_s: float = 300.0):
+        self._index = index
+        self._max_age_s = max_age_s
+        self._lock = threading.Lock()
+        self._built_at = 0.0
+        self._built_version: str | None = None
+        self._trees: dict[int, tuple[KDTree, list[str]]] = {}
+
+    def _trees_for_query(self, art: Artifacts) -> dict[int, tuple[KDTree, list[str]]]:
+        with self._lock:
+            fresh = time.monotonic() - self._built_at < self._max_age_s
+            if fresh and self._built_version == art.version:
+                return self._trees
+
+            track_ids, X, moods = self._index.scan(art.version)
+            trees: dict[int, tuple[KDTree, list[str]]] = {}
+            if track_ids:
+                X_scaled = art.scaler.transform(X)
+                for mood in np.unique(moods).tolist():
+                    rows = np.flatnonzero(moods == mood)
+                    trees[mood] = (
+                        KDTree(X_scaled[rows]),
+                        [track_ids[i] for i in rows],
+                    )
+            self._trees = trees
+            self._built_at = time.monotonic()
+            self._built_version = art.version
+            return trees
+
+    def query(
+        self,
+        art: Artifacts,
+        centroid: np.ndarray,
+        mood: int,
+        k: int,
+        exclude: set[str],
+    ) -> list[str]:
+        """The ``k`` tracks of ``mood`` nearest to ``centroid`` (scaled space)."""
+        entry = self._trees_for_query(art).get(mood)
+        if entry is None:
+            return []
+        tree, track_ids = entry
+        n = min(len(track_ids), k + len(exclude))
+        if n == 0:
+            return []
+        _, rows = tree.query(centroid.reshape(1, -1), k=n)
+        out = [track_ids[i] for i in rows[0] if track_ids[i] not in exclude]
+        return out[:k]
+
+
+mood_index: MoodIndex | None = None
+feature_neighbors: FeatureNeighbors | None = None
+export_jobs: ExportJobs | None = None
+prefetcher: Prefetcher | None = None
+
+# Optional dedicated inference threads (PIPER_INFERENCE_THREADS), pinned to
+# PIPER_INFERENCE_CPUS on Linux. Request threads hand batches to this pool, so
+# at most that many model calls run at once no matter how many requests are in
+# flight.
+_inference_pool: ThreadPoolExecutor | None = None
+
+
+def _pin_inference_thread(cpus: set[int]):
+    if cpus and hasattr(os, "sched_setaffinity"):
+        # pid 0 is the calling thread on Linux.
+        os.sched_setaffinity(0, cpus)
+
+
+def _run_inference(X: np.ndarray, art: Artifacts) -> np.ndarray:
+    if _inference_pool is None:
+        return predict_moods(X, art)
+    return _inference_pool.submit(predict_moods, X, art).result()
+
+
+def _registry_active_version(registry: str) -> str:
+    current = os.path.join(registry, "CURRENT")
+    if os.path.exists(current):
+        with open(current, encoding="utf-8") as f:
+            version = f.read().strip()
+        if version:
+            return version
+    versions = sorted(
+        d
+        for d in os.listdir(registry)
+        if not d.startswith(".") and os.path.isdir(os.path.join(registry, d))
+    )
+    if not versions:
+        raise RuntimeError(f"No model versions in registry: {registry}")
+    return versions[-1]
 
-class ExportTopTracksCsvResponse(BaseModel):
-    ok: bool
-    csvPath: str
-    rowsWritten: int
-    tracksFetched: int
-    failedAudioFeatures: int
 
+def _read_registry_artifacts(registry: str, version: str) -> Artifacts:
+    base = os.path.join(registry, version)
+    return read_artifacts(
+        os.path.join(base, "piper_model.pth"),
+        os.path.join(base, "scaler1.joblib"),
+        version=version,
+    )
 
-def _env_path(name: str, default_relative: str) -> str:
-    value = os.environ.get(name)
-    if value:
-        return value
-    # For local development from repo root
-    if os.path.exists(os.path.join("ml_service", "models")):
-        return os.path.join("ml_service", default_relative)
-    # For deployment (when ml_service is root directory)
-    return default_relative
 
+def _swap_artifacts(loaded: Artifacts) -> Artifacts | None:
+    """Install ``loaded``; returns the previous artifacts. Hold _reload_lock."""
+    global artifacts
 
-MODEL_PATH = _env_path("PIPER_MODEL_PATH", "models/piper_model.pth")
-SCALER_PATH = _env_path("PIPER_SCALER_PATH", "models/scaler1.joblib")
+    current, artifacts = artifacts, loaded
+    if current is not None:
+        logger.info("Model reloaded: %s -> %s", current.version, loaded.version)
+    return current
 
 
-def _csv_path() -> str:
-    value = os.environ.get("PIPER_TOP_TRACKS_CSV_PATH")
-    if value:
-        return value
-    repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-    return os.path.join(repo_root, "web_app", "top_tracks_features.csv")
+def _reload_artifacts(force: bool = False) -> Artifacts:
+    """Load the active artifacts and swap them in if their version changed."""
+    with _reload_lock:
+        current = artifacts
+        if MODEL_REGISTRY:
+            version = _registry_active_version(MODEL_REGISTRY)
+            expected = precision_version(version, MODEL_PRECISION)
+            if current is not None and current.version == expected and not force:
+                return current
+            loaded = _read_registry_artifacts(MODEL_REGISTRY, version)
+        else:
+            loaded = read_artifacts(MODEL_PATH, SCALER_PATH)
+            if current is not None and current.version == loaded.version:
+                return current
 
+        _swap_artifacts(loaded)
+        return loaded
 
-app = FastAPI(title="PIPER ML Service", version="0.1.0")
 
-model: MoodClassifier | None = None
-scaler = None
+def load_current_artifacts() -> Artifacts:
+    """The active model artifacts, loaded exactly as the service loads them.
 
+    For offline jobs (prewarm.py): index entries they write carry the version
+    the service looks up. The artifacts also become this module's current ones.
+    """
+    return _reload_artifacts()
 
-def _spotify_get(access_token: str, path: str, params: Optional[dict] = None):
-    res = requests.get(
-        f"{SPOTIFY_API_BASE_URL}{path}",
-        headers={"Authorization": f"Bearer {access_token}"},
-        params=params,
-        timeout=20,
-    )
-    trace_id = res.headers.get("sp-trace-id")
-    if res.status_code == 401:
-        raise HTTPException(status_code=401, detail=f"{path}:spotify_token_invalid")
-    if res.status_code == 403:
-        # Spotify 403 can be either missing scopes or the account not being added
-        # to the app's User Management list (when the Spotify app is in dev mode).
-        www_auth = (res.headers.get("www-authenticate") or "").lower()
+
+def _activate_registry_version(version: str, loaded: Artifacts) -> Artifacts | None:
+    """Point CURRENT at ``version`` and install its already loaded artifacts.
+
+    Both happen under _reload_lock, so a concurrent reload or registry poll
+    never sees CURRENT and the served model disagree. Returns the previous
+    artifacts.
+    """
+    current_path = os.path.join(MODEL_REGISTRY, "CURRENT")
+    with _reload_lock:
+        with open(f"{current_path}.tmp", "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(f"{current_path}.tmp", current_path)
+        return _swap_artifacts(loaded)
+
+
+def _configure_inference():
+    global _inference_pool
+
+    configure_torch_threads()
+    cpus = os.environ.get("PIPER_INFERENCE_CPUS")
+    cpu_set = {int(c) for c in cpus.split(",") if c.strip()} if cpus else set()
+    threads = int(os.environ.get("PIPER_INFERENCE_THREADS", "0")) or len(cpu_set)
+    if threads > 0 and _inference_pool is None:
+        _inference_pool = ThreadPoolExecutor(
+            max_workers=threads,
+            thread_name_prefix="inference",
+            initializer=_pin_inference_thread,
+            initargs=(cpu_set,),
+        )
+
+
+def _load_artifacts():
+    # Pre-forked workers (serve.py) inherit the parent's artifacts.
+    if artifacts is None:
+        _reload_artifacts()
+
+
+def _poll_model_registry():
+    while True:
+        time.sleep(MODEL_POLL_S)
         try:
-            payload = res.json()
-            message = (
-                payload.get("error", {}).get("message")
-                if isinstance(payload, dict)
-                else None
-            )
+            _reload_artifacts()
         except Exception:
-            message = None
+            logger.exception("Model registry poll failed")
+
+
+def _watch_model_registry():
+    if MODEL_REGISTRY and MODEL_POLL_S > 0:
+        threading.Thread(
+            target=_poll_model_registry, name="model-registry-poll", daemon=True
+        ).start()
 
-        lowered = (message or "").lower()
-        if "insufficient_scope" in www_auth:
-            raise HTTPException(
-                status_code=403, detail=f"{path}:spotify_insufficient_scope"
-            )
-        if "invalid_token" in www_auth:
-            raise HTTPException(status_code=401, detail=f"{path}:spotify_token_invalid")
-        if "insufficient" in lowered and "scope" in lowered:
-            raise HTTPException(
-                status_code=403, detail=f"{path}:spotify_insufficient_scope"
-            )
-        if "not registered" in lowered or "user not registered" in lowered:
-            raise HTTPException(
-                status_code=403, detail=f"{path}:spotify_user_not_registered"
-            )
 
-        short = (message or res.text or res.reason)[:300]
-        extras: list[str] = []
-        if trace_id:
-            extras.append(f"sp-trace-id: {trace_id}")
-        if www_auth:
-            extras.append(f"www-authenticate: {www_auth[:300]}")
-        if extras:
-            short = f"{short} | " + " | ".join(extras)
-        raise HTTPException(status_code=403, detail=f"{path}:spotify_forbidden:{short}")
-    if res.status_code == 429:
-        raise HTTPException(status_code=429, detail="spotify_rate_limited")
-    if not res.ok:
+def _flush_activity_loop(index: MoodIndex):
+    while True:
+        index.wait_for_activity(ACTIVITY_FLUSH_S)
         try:
-            payload = res.json()
-            message = (
-                payload.get("error", {}).get("message")
-                if isinstance(payload, dict)
-                else None
-            )
+            index.flush_activity()
         except Exception:
-            message = None
-        short = (message or res.text or res.reason)[:300]
-        if trace_id:
-            short = f"{short} | sp-trace-id: {trace_id}"
-        raise HTTPException(
-            status_code=502, detail=f"spotify_error:{res.status_code}:{short}"
+            logger.exception("Track activity flush failed")
+
+
+def _open_mood_index():
+    global mood_index, feature_neighbors
+
+    path = mood_index_path()
+    mood_index = MoodIndex(path) if path else None
+    if mood_index is not None:
+        threading.Thread(
+            target=_flush_activity_loop,
+            args=(mood_index,),
+            name="track-activity-flush",
+            daemon=True,
+        ).start()
+        atexit.register(mood_index.flush_activity)
+    feature_neighbors = (
+        FeatureNeighbors(
+            mood_index,
+            max_age_s=float(os.environ.get("PIPER_NEIGHBORS_MAX_AGE_S", "300")),
         )
-    return res.json()
+        if mood_index is not None
+        else None
+    )
 
 
-def _spotify_get_with_retry(
-    access_token: str,
-    path: str,
-    params: Optional[dict] = None,
-    *,
-    max_retries: int = 3,
-):
-    """Spotify GET with basic 429 retry support.
+def _open_export_jobs():
+    global export_jobs
 
-    We keep error semantics consistent with _spotify_get, but if Spotify rate-limits
-    us (429), we wait briefly and retry.
-    """
-    last_exc: Optional[HTTPException] = None
-    for attempt in range(max_retries + 1):
-        res = requests.get(
-            f"{SPOTIFY_API_BASE_URL}{path}",
-            headers={"Authorization": f"Bearer {access_token}"},
-            params=params,
-            timeout=20,
-        )
+    path = _export_jobs_dir()
+    export_jobs = ExportJobs(path) if path else None
 
-        if res.status_code == 429 and attempt < max_retries:
-            retry_after = res.headers.get("retry-after") or res.headers.get(
-                "Retry-After"
-            )
-            try:
-                wait_s = float(retry_after) if retry_after else 1.0
-            except Exception:
-                wait_s = 1.0
-            # Retry-After is in seconds. Keep a reasonable cap so requests don't hang forever,
-            # but also don't ignore legitimate wait times.
-            time.sleep(max(0.5, min(wait_s, 30.0)))
-            continue
-
-        if res.status_code == 401:
-            raise HTTPException(status_code=401, detail=f"{path}:spotify_token_invalid")
-
-        if res.status_code == 403:
-            www_auth = (res.headers.get("www-authenticate") or "").lower()
-            try:
-                payload = res.json()
-                message = (
-                    payload.get("error", {}).get("message")
-                    if isinstance(payload, dict)
-                    else None
-                )
-            except Exception:
-                message = None
 
-            lowered = (message or "").lower()
-            if "insufficient_scope" in www_auth:
-                raise HTTPException(
-                    status_code=403, detail=f"{path}:spotify_insufficient_scope"
-                )
-            if "invalid_token" in www_auth:
-                raise HTTPException(
-                    status_code=401, detail=f"{path}:spotify_token_invalid"
-                )
-            if "insufficient" in lowered and "scope" in lowered:
-                raise HTTPException(
-                    status_code=403, detail=f"{path}:spotify_insufficient_scope"
-                )
-            if "not registered" in lowered or "user not registered" in lowered:
-                raise HTTPException(
-                    status_code=403, detail=f"{path}:spotify_user_not_registered"
-                )
-            short = (message or res.text or res.reason)[:300]
-            raise HTTPException(
-                status_code=403, detail=f"{path}:spotify_forbidden:{short}"
-            )
+def _open_prefetcher():
+    global prefetcher
 
-        if res.status_code == 429:
-            last_exc = HTTPException(status_code=429, detail="spotify_rate_limited")
-            break
-
-        if not res.ok:
-            try:
-                payload = res.json()
-                message = (
-                    payload.get("error", {}).get("message")
-                    if isinstance(payload, dict)
-                    else None
-                )
-            except Exception:
-                message = None
-            short = (message or res.text or res.reason)[:300]
-            last_exc = HTTPException(
-                status_code=502, detail=f"spotify_error:{res.status_code}:{short}"
-            )
-            break
-
-        return res.json()
-
-    if last_exc is not None:
-        raise last_exc
-    raise HTTPException(status_code=502, detail="spotify_error:unknown")
-
-
-def _dedupe_preserve_order(values: list[str]) -> list[str]:
-    seen: set[str] = set()
-    out: list[str] = []
-    for v in values:
-        if not v:
-            continue
-        if v in seen:
-            continue
-        seen.add(v)
-        out.append(v)
-    return out
-
-
-def _spotify_get_playlist_tracks(
-    access_token: str, playlist_id: str, *, limit: int
-) -> list[dict]:
-    """Return playlist item.track dicts (id/name/artists)."""
-    target = max(0, min(200, int(limit)))
-    if target == 0:
-        return []
-
-    tracks: list[dict] = []
-    offset = 0
-    while len(tracks) < target:
-        page = _spotify_get(
-            access_token,
-            f"/playlists/{playlist_id}/tracks",
-            params={
-                "limit": 50,
-                "offset": offset,
-                "fields": "items(track(id,name,artists(name))),next",
-            },
-        )
+    if prefetcher is None:
+        prefetcher = Prefetcher(runtime)
 
-        items = page.get("items")
-        if not isinstance(items, list) or len(items) == 0:
-            break
-
-        for item in items:
-            if not isinstance(item, dict):
-                continue
-            track = item.get("track")
-            if not isinstance(track, dict):
-                continue
-            tid = track.get("id")
-            if isinstance(tid, str) and tid:
-                tracks.append(track)
-            if len(tracks) >= target:
-                break
-
-        if not page.get("next"):
-            break
-        offset += 50
-
-    return tracks[:target]
-
-
-def _spotify_get_recommendations_tracks(
-    access_token: str, *, limit: int, seed_genres: Optional[list[str]] = None
-) -> list[dict]:
-    target = max(0, min(100, int(limit)))
-    if target == 0:
-        return []
-
-    seeds = seed_genres or ["pop", "dance", "rock"]
-    seeds = [s for s in seeds if isinstance(s, str) and s.strip()][:5]
-    if not seeds:
-        seeds = ["pop"]
-
-    payload = _spotify_get(
-        access_token,
-        "/recommendations",
-        params={
-            "limit": target,
-            "market": "IN",
-            "seed_genres": ",".join(seeds),
-        },
-    )
-    tracks = payload.get("tracks") if isinstance(payload, dict) else None
-    if not isinstance(tracks, list):
-        return []
-    return [t for t in tracks if isinstance(t, dict) and isinstance(t.get("id"), str)]
 
+def _require_export_jobs() -> ExportJobs:
+    if export_jobs is None:
+        raise HTTPException(status_code=503, detail="export_jobs_disabled")
+    return export_jobs
 
-def _spotify_search_tracks(
-    access_token: str,
-    *,
-    limit: int,
-    market: str = "IN",
-    queries: Optional[list[str]] = None,
-) -> list[dict]:
-    target = max(0, min(50, int(limit)))
-    if target == 0:
-        return []
-
-    qs = queries or ["Top hits", "Bollywood", "Punjabi hits", "India top songs"]
-    out: list[dict] = []
-    for q in qs[:6]:
-        if len(out) >= target:
-            break
-        payload = _spotify_get(
-            access_token,
-            "/search",
-            params={
-                "q": q,
-                "type": "track",
-                "limit": min(50, target - len(out)),
-                "market": market,
-            },
-        )
-        tracks = (
-            payload.get("tracks", {}).get("items")
-            if isinstance(payload, dict)
-            else None
-        )
-        if not isinstance(tracks, list):
-            continue
-        out.extend(
-            [t for t in tracks if isinstance(t, dict) and isinstance(t.get("id"), str)]
-        )
-    return out[:target]
-
-
-def _spotify_get_audio_features_batch(
-    access_token: str, track_ids: list[str]
-) -> dict[str, dict]:
-    """Fetch audio features in batches (<=100 per request)."""
-    out: dict[str, dict] = {}
-    ids = [tid for tid in track_ids if isinstance(tid, str) and tid]
-    for i in range(0, len(ids), 100):
-        chunk = ids[i : i + 100]
-        payload = _spotify_get_with_retry(
-            access_token,
-            "/audio-features",
-            params={"ids": ",".join(chunk)},
-        )
-        audio_features = (
-            payload.get("audio_features") if isinstance(payload, dict) else None
-        )
-        if not isinstance(audio_features, list):
-            continue
-        for f in audio_features:
-            if not isinstance(f, dict):
-                continue
-            tid = f.get("id")
-            if isinstance(tid, str) and tid:
-                out[tid] = f
-    return out
-
-
-def _spotify_get_audio_features_resilient(
-    access_token: str,
-    track_ids: list[str],
-    *,
-    max_per_track_attempts: int = 1,
-) -> tuple[dict[str, dict], dict[str, int]]:
-    """Fetch audio features with best-effort resiliency.
-
-    Strategy:
-    - Batch fetch via /audio-features?ids=... (chunked)
-    - Fill any missing IDs via per-track /audio-features/{id} with retry
-    """
-    ids = [tid for tid in track_ids if isinstance(tid, str) and tid]
-    counts = {
-        "requested": len(ids),
-        "batch_ok": 0,
-        "per_track_ok": 0,
-        "failed": 0,
-        "unauthorized": 0,
-        "forbidden": 0,
-        "rate_limited": 0,
-        "other_error": 0,
-    }
 
-    features_by_id: dict[str, dict] = {}
-    try:
-        features_by_id = _spotify_get_audio_features_batch(access_token, ids)
-        counts["batch_ok"] = len(features_by_id)
-    except HTTPException as e:
-        if e.status_code == 401:
-            counts["unauthorized"] += 1
-        elif e.status_code == 403:
-            counts["forbidden"] += 1
-        elif e.status_code == 429:
-            counts["rate_limited"] += 1
-        else:
-            counts["other_error"] += 1
-
-    missing = [tid for tid in ids if tid not in features_by_id]
-    if missing and max_per_track_attempts > 0:
-        for tid in missing:
-            ok = False
-            for _ in range(max_per_track_attempts):
-                try:
-                    f = _spotify_get_with_retry(access_token, f"/audio-features/{tid}")
-                    if isinstance(f, dict) and isinstance(f.get("id"), str):
-                        features_by_id[f["id"]] = f
-                        counts["per_track_ok"] += 1
-                        ok = True
-                        break
-                except HTTPException as e:
-                    if e.status_code == 401:
-                        counts["unauthorized"] += 1
-                    elif e.status_code == 403:
-                        counts["forbidden"] += 1
-                    elif e.status_code == 429:
-                        counts["rate_limited"] += 1
-                    else:
-                        counts["other_error"] += 1
-                    break
-                except Exception:
-                    counts["other_error"] += 1
-                    break
-            if not ok:
-                counts["failed"] += 1
-
-    return features_by_id, counts
-
-
-@app.on_event("startup")
-def _load_artifacts():
-    global model, scaler
+def _score_and_index(
+    track_ids: list[str], X: np.ndarray, art: Artifacts
+) -> tuple[list[str], list[int]]:
+    probabilities = _run_inference(X, art)
+    if mood_index is not None:
+        mood_index.store(track_ids, X, probabilities, art.version)
+    return track_ids, probabilities.argmax(axis=1).tolist()
 
-    if not os.path.exists(MODEL_PATH):
-        raise RuntimeError(f"Model file not found: {MODEL_PATH}")
-    if not os.path.exists(SCALER_PATH):
-        raise RuntimeError(f"Scaler file not found: {SCALER_PATH}")
 
-    loaded_model = MoodClassifier()
-    loaded_model.load_state_dict(
-        torch.load(MODEL_PATH, map_location="cpu", weights_only=True)
-    )
-    loaded_model.eval()
+def _index_lookup(track_ids: list[str]) -> dict[str, MoodIndexEntry]:
+    """Mood index entries for a request's candidates, recording the activity."""
+    if mood_index is None:
+        return {}
+    mood_index.touch(track_ids)
+    return mood_index.lookup(track_ids)
 
-    model = loaded_model
-    scaler = joblib.load(SCALER_PATH)
 
+def _iter_classify_tracks(
+    access_token: str,
+    track_ids: list[str],
+    art: Artifacts,
+    counts: dict[str, int],
+) -> Iterator[tuple[list[str], list[int]]]:
+    """Yield (track ids, mood ids) as tracks are scored, mood index first.
+
+    Tracks already scored by the current model come straight from the index,
+    skipping both the audio-features fetch and inference; tracks scored by an
+    older model are re-scored from their stored features. The rest are scored
+    as their audio features arrive. Everything newly scored is written back.
+    """
+    indexed = _index_lookup(track_ids)
+    counts["indexed"] = len(indexed)
+    current_ids = [tid for tid, e in indexed.items() if e.model_version == art.version]
+    if current_ids:
+        yield current_ids, [indexed[tid].mood for tid in current_ids]
+
+    stale_ids = [tid for tid, e in indexed.items() if e.model_version != art.version]
+    if stale_ids:
+        yield _score_and_index(
+            stale_ids, np.stack([indexed[tid].features for tid in stale_ids]), art
+        )
 
-@app.get("/health")
-def health():
-    return {"ok": True}
+    to_fetch = [tid for tid in track_ids if tid not in indexed]
+    for features_by_id in spotify_iter_audio_features(
+        access_token, to_fetch, counts, max_per_track_attempts=2
+    ):
+        X, scored_ids = feature_matrix(list(features_by_id), features_by_id)
+        if scored_ids:
+            yield _score_and_index(scored_ids, X, art)
 
 
-def _atomic_write_csv(csv_path: str, fieldnames: list[str], rows: list[dict]):
-    os.makedirs(os.path.dirname(csv_path), exist_ok=True)
-    tmp_path = f"{csv_path}.tmp"
-    with open(tmp_path, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        for row in rows:
-            writer.writerow(row)
-    os.replace(tmp_path, csv_path)
+def _track_features(
+    access_token: str,
+    track_ids: list[str],
+    art: Artifacts,
+    counts: dict[str, int],
+) -> tuple[dict[str, int], list[str], np.ndarray]:
+    """Runtime.track_features through the mood index.
 
+    Current index entries are known moods; stale ones are re-scored from their
+    stored features, so only unindexed tracks are fetched from Spotify.
+    """
+    indexed = _index_lookup(track_ids)
+    counts["indexed"] = len(indexed)
+    known = {
+        tid: e.mood for tid, e in indexed.items() if e.model_version == art.version
+    }
+    stale_ids = [tid for tid in indexed if tid not in known]
+
+    X, fetched_ids = FeatureRows.from_chunks(
+        spotify_iter_audio_features(
+            access_token,
+            [tid for tid in track_ids if tid not in indexed],
+            counts,
+            max_per_track_attempts=2,
+        )
+    ).take()
+    if stale_ids:
+        X = np.concatenate([np.stack([indexed[t].features for t in stale_ids]), X])
+    return known, stale_ids + fetched_ids, X
 
-@app.post("/export/top-tracks-features", response_model=ExportTopTracksCsvResponse)
-def export_top_tracks_features(req: ExportTopTracksCsvRequest):
-    """Generate/update top_tracks_features.csv for the current user.
 
-    This mirrors the Streamlit flow: fetch top tracks, fetch per-track audio features,
-    write a CSV, then the model can be run from that CSV.
+class LongRunningRuntime(Runtime):
+    """uvicorn / serve.py runtime.
+
+    Artifacts are hot-reloaded from the registry, tracks are scored through the
+    mood index and the optional inference pool; all state lives in this
+    module's globals so pre-forked workers inherit it.
     """
-    top = _spotify_get(
-        req.access_token,
-        "/me/top/tracks",
-        params={"limit": req.limit, "time_range": req.time_range},
-    )
 
-    items = top.get("items")
-    if not isinstance(items, list) or len(items) == 0:
-        raise HTTPException(status_code=422, detail="no_top_tracks")
-
-    track_ids: list[str] = [
-        t.get("id")
-        for t in items
-        if isinstance(t, dict) and isinstance(t.get("id"), str)
-    ]
-    if not track_ids:
-        raise HTTPException(status_code=422, detail="no_track_ids")
-
-    all_ids = _dedupe_preserve_order(track_ids)
-    rows: list[dict] = []
-    failed_audio_features = 0
-    first_audio_features_error: Optional[HTTPException] = None
-
-    # Map track metadata from top tracks
-    meta_by_id: dict[str, dict] = {}
-    for track in items:
-        if not isinstance(track, dict):
-            continue
-        tid = track.get("id")
-        if not isinstance(tid, str) or not tid:
-            continue
-        meta_by_id[tid] = track
-
-    # Fetch audio-features in batch, then fill missing.
+    def startup(self):
+        _configure_inference()
+        _load_artifacts()
+        _watch_model_registry()
+        _open_mood_index()
+        _open_export_jobs()
+        _open_prefetcher()
+
+    def current_artifacts(self) -> Artifacts | None:
+        return artifacts
+
+    def csv_path(self) -> str:
+        return _csv_path()
+
+    def predict(self, X: np.ndarray, art: Artifacts) -> np.ndarray:
+        return _run_inference(X, art)
+
+    def iter_classify_tracks(
+        self,
+        access_token: str,
+        track_ids: list[str],
+        art: Artifacts,
+        counts: dict[str, int],
+    ) -> Iterator[tuple[list[str], list[int]]]:
+        return _iter_classify_tracks(access_token, track_ids, art, counts)
+
+    def track_features(
+        self,
+        access_token: str,
+        track_ids: list[str],
+        art: Artifacts,
+        counts: dict[str, int],
+    ) -> tuple[dict[str, int], list[str], np.ndarray]:
+        return _track_features(access_token, track_ids, art, counts)
+
+    def score_tracks(
+        self, track_ids: list[str], X: np.ndarray, art: Artifacts
+    ) -> list[int]:
+        return _score_and_index(track_ids, X, art)[1]
+
+    def prefetched_tracks(
+        self, access_token: str, art: Artifacts
+    ) -> PrefetchedTracks | None:
+        if prefetcher is None:
+            return None
+        return prefetcher.get(access_token, art)
+
+
+runtime = LongRunningRuntime()
+app = create_app(runtime)
+
+
+class ReloadModelRequest(BaseModel):
+    # Registry version to activate (written to CURRENT); omit to reload the
+    # active version.
+    version: Optional[str] = None
+
+
+@app.post("/admin/reload-model")
+def reload_model(
+    req: ReloadModelRequest,
+    x_admin_token: Optional[str] = Header(default=None),
+):
+    admin_token = os.environ.get("PIPER_ADMIN_TOKEN")
+    if not admin_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not secrets.compare_digest((x_admin_token or "").encode(), admin_token.encode()):
+        raise HTTPException(status_code=403, detail="admin_token_invalid")
+
+    if req.version is None:
+        previous = artifacts.version if artifacts else None
+        try:
+            loaded = _reload_artifacts(force=True)
+        except RuntimeError as e:
+            raise HTTPException(status_code=500, detail=f"model_reload_failed:{e}")
+        return {"ok": True, "modelVersion": loaded.version, "previousVersion": previous}
+
+    if not MODEL_REGISTRY:
+        raise HTTPException(status_code=400, detail="model_registry_not_configured")
+    version = req.version
+    if os.path.basename(version) != version or version.startswith("."):
+        raise HTTPException(status_code=400, detail="invalid_model_version")
+    if not os.path.isdir(os.path.join(MODEL_REGISTRY, version)):
+        raise HTTPException(status_code=404, detail="model_version_not_found")
+    # Load (and so validate) the version before pointing CURRENT at it; the
+    # same artifacts are then installed.
     try:
-        features_by_id, counts = _spotify_get_audio_features_resilient(
-            req.access_token, all_ids, max_per_track_attempts=2
-        )
-        failed_audio_features = int(counts.get("failed", 0))
-    except HTTPException as e:
-        first_audio_features_error = e
-        features_by_id = {}
-
-    for tid in all_ids:
-        meta = meta_by_id.get(tid)
-        if not isinstance(meta, dict):
-            continue
-        features = features_by_id.get(tid)
-        if not isinstance(features, dict):
-            continue
-
-        artists = meta.get("artists")
-        artist_names = (
-            ", ".join(
-                [
-                    a.get("name")
-                    for a in artists
-                    if isinstance(a, dict) and isinstance(a.get("name"), str)
-                ]
-            )
-            if isinstance(artists, list)
-            else ""
-        )
+        loaded = _read_registry_artifacts(MODEL_REGISTRY, version)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"model_version_invalid:{e}")
+    current = _activate_registry_version(version, loaded)
+    return {
+        "ok": True,
+        "modelVersion": loaded.version,
+        "previousVersion": current.version if current else None,
+    }
 
-        try:
-            rows.append(
-                {
-                    "track_id": tid,
-                    "track_name": (
-                        meta.get("name") if isinstance(meta.get("name"), str) else ""
-                    ),
-                    "artist_names": artist_names,
-                    "danceability": float(features["danceability"]),
-                    "energy": float(features["energy"]),
-                    "valence": float(features["valence"]),
-                    "tempo": float(features["tempo"]),
-                    "loudness": float(features["loudness"]),
-                }
-            )
-        except Exception:
-            failed_audio_features += 1
 
-    if len(rows) == 0:
-        # Don't overwrite any existing CSV with an empty file.
-        if first_audio_features_error is not None:
-            raise first_audio_features_error
-        raise HTTPException(status_code=422, detail="no_audio_features")
+@app.post("/export/jobs", response_model=ExportJob, status_code=202)
+def submit_export_job(req: ExportTopTracksCsvRequest):
+    """Queue /export/top-tracks-features to run in the background.
 
-    csv_path = _csv_path()
-    fieldnames = [
-        "track_id",
-        "track_name",
-        "artist_names",
-        "danceability",
-        "energy",
-        "valence",
-        "tempo",
-        "loudness",
-    ]
-    _atomic_write_csv(csv_path, fieldnames=fieldnames, rows=rows)
-
-    return ExportTopTracksCsvResponse(
-        ok=True,
-        csvPath=csv_path,
-        rowsWritten=len(rows),
-        tracksFetched=len(all_ids),
-        failedAudioFeatures=failed_audio_features,
-    )
+    Poll GET /export/jobs/{jobId} for status and progress, then download the
+    file from GET /export/jobs/{jobId}/result. ``stream`` is not supported.
+    """
+    return _require_export_jobs().submit(req)
 
 
-@app.post("/recommendations", response_model=RecommendationsResponse)
-def recommendations(req: RecommendationsRequest):
-    if model is None or scaler is None:
-        raise HTTPException(status_code=500, detail="model_not_loaded")
+@app.get("/export/jobs/{job_id}", response_model=ExportJob)
+def export_job_status(job_id: str):
+    return _require_export_jobs().get(job_id)
 
-    top = _spotify_get(
-        req.access_token,
-        "/me/top/tracks",
-        params={"limit": 50, "time_range": "medium_term"},
-    )
 
-    items = top.get("items")
-
-    if not isinstance(items, list) or len(items) == 0:
-        # New users often have no listening history/top tracks yet.
-        # Do NOT inject unrelated "popular" tracks into the model input; let the caller
-        # fill the playlist using a dedicated fallback path.
-        raise HTTPException(status_code=422, detail="no_top_tracks")
-
-    track_ids: List[str] = [
-        t.get("id")
-        for t in items
-        if isinstance(t, dict) and isinstance(t.get("id"), str)
-    ]
-    track_ids = _dedupe_preserve_order(track_ids)
-    if not track_ids:
-        raise HTTPException(status_code=422, detail="no_track_ids")
-
-    features_by_id, counts = _spotify_get_audio_features_resilient(
-        req.access_token, track_ids, max_per_track_attempts=2
-    )
+@app.get("/export/jobs/{job_id}/result")
+def export_job_result(job_id: str):
+    return _require_export_jobs().result(job_id)
 
-    rows = []
-    ordered_ids = []
-    for tid in track_ids:
-        f = features_by_id.get(tid)
-        if not f:
-            continue
-        try:
-            rows.append(
-                [
-                    float(f["danceability"]),
-                    float(f["energy"]),
-                    float(f["valence"]),
-                    float(f["tempo"]),
-                    float(f["loudness"]),
-                ]
-            )
-            ordered_ids.append(tid)
-        except Exception:
-            continue
-
-    if not rows:
-        # NOTE: CSV-based fallback is intentionally disabled.
-        # In deployment we won't have a local CSV, and using a shared CSV can
-        # accidentally serve stale/other-user data.
-        #
-        # If audio-features are unavailable, return candidate tracks directly so
-        # the caller can still create a playlist.
-        if counts.get("unauthorized", 0) > 0 and len(features_by_id) == 0:
-            raise HTTPException(
-                status_code=401,
-                detail="audio_features:spotify_token_invalid",
-            )
-        return RecommendationsResponse(trackIds=track_ids[: req.limit])
 
-    X = np.array(rows, dtype=np.float32)
-    X_scaled = scaler.transform(X)
-    X_tensor = torch.tensor(X_scaled, dtype=torch.float32)
+@app.post("/prefetch", response_model=PrefetchResponse, status_code=202)
+def prefetch(req: PrefetchRequest):
+    """Start classifying the user's top tracks ahead of /recommendations.
 
-    with torch.no_grad():
-        logits = model(X_tensor)
-        preds = torch.argmax(logits, dim=1).cpu().numpy().tolist()
+    Returns at once; the next /recommendations with the same access token on
+    this worker ranks from the stash (waiting for the prefetch if it is still
+    running), and the mood index serves the tracks on every other worker.
+    """
+    if prefetcher is None:
+        raise HTTPException(status_code=503, detail="prefetch_unavailable")
+    return PrefetchResponse(status=prefetcher.start(req.access_token))
 
-    target = MOOD_TO_ID[req.mood]
-    picked = [tid for tid, pred in zip(ordered_ids, preds) if pred == target]
 
-    # Fill to req.limit with remaining candidates so we don't create tiny playlists.
-    if len(picked) < req.limit:
-        picked_set = set(picked)
-        picked.extend([tid for tid in ordered_ids if tid not in picked_set])
+@app.post("/recommendations/similar", response_model=RecommendationsResponse)
+def similar_recommendations(req: RecommendationsRequest, response: Response):
+    """Tracks from the mood index closest to the user's centroid for ``mood``.
 
-    return RecommendationsResponse(trackIds=picked[: req.limit])
+    Unlike /recommendations this can return tracks the user has never played:
+    the user's top tracks of the requested mood (or all of them, if none match)
+    define a centroid in scaled feature space, and the nearest indexed tracks
+    predicted as that mood are returned, excluding the user's own top tracks.
+    """
+    art = require_artifacts(runtime, response)
+    if mood_index is None or feature_neighbors is None:
+        raise HTTPException(status_code=503, detail="mood_index_disabled")
+
+    with deadline(RECOMMENDATIONS_DEADLINE_S):
+        track_ids = top_track_ids(req.access_token)
+        ordered_ids, preds, _ = runtime.classify_tracks(
+            req.access_token, track_ids, art
+        )
+    if not ordered_ids:
+        raise HTTPException(status_code=422, detail="no_audio_features")
+
+    target = MOOD_TO_ID[req.mood]
+    seed_ids = [tid for tid, pred in zip(ordered_ids, preds) if pred == target]
+    indexed = mood_index.lookup(seed_ids or ordered_ids)
+    if not indexed:
+        # Classified but not in the index (a failed store, or an index file
+        # from another deployment): no centroid to search from.
+        raise HTTPException(status_code=503, detail="mood_index_incomplete")
+    X = np.stack([e.features for e in indexed.values()])
+    centroid = art.scaler.transform(X).mean(axis=0)
+
+    return model_response(
+        RecommendationsResponse(
+            trackIds=feature_neighbors.query(
+                art, centroid, target, req.limit, exclude=set(track_ids)
+            )
+        ),
+        response,
+    )
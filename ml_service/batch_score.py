@@ -0,0 +1,352 @@
+"""Offline mood scoring over exported audio-feature files.
+
+Reads the files written by /export/top-tracks-features (CSV, Parquet, Arrow IPC
+or npz), runs the scaler + MoodClassifier in large batches and writes one row
+per track with the predicted mood and the per-mood probabilities. Inputs are
+read chunk by chunk, so memory stays bounded regardless of file size.
+
+    python batch_score.py features.csv more.parquet -o moods.csv --workers 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import os
+import sys
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
+
+import numpy as np
+
+import app
+from piper_core.model import (
+    FEATURE_COLUMNS,
+    MODEL_PRECISION,
+    MOODS,
+    Artifacts,
+    artifact_version,
+    precision_version,
+    predict_moods,
+    read_artifacts,
+)
+
+FeatureChunk = tuple[list[str], np.ndarray]
+
+OUTPUT_FIELDS = ["track_id", "mood", *[f"prob_{m}" for m in MOODS]]
+
+# Set per scoring process by _init_worker.
+_artifacts: Artifacts | None = None
+
+
+def _parse_rows(ids: list[str], values: list[list[str]]) -> FeatureChunk:
+    """Convert text feature rows to float32, dropping unparseable rows."""
+    try:
+        return ids, np.array(values, dtype=np.float32).reshape(-1, len(FEATURE_COLUMNS))
+    except ValueError:
+        pass
+
+    X = np.empty((len(values), len(FEATURE_COLUMNS)), dtype=np.float32)
+    valid = np.zeros(len(values), dtype=bool)
+    for i, row in enumerate(values):
+        try:
+            X[i] = [float(v) for v in row]
+        except (TypeError, ValueError):
+            continue
+        valid[i] = True
+    return [tid for tid, ok in zip(ids, valid) if ok], X[valid]
+
+
+def _iter_csv(path: str, batch_size: int) -> Iterator[FeatureChunk]:
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        try:
+            id_col = header.index("track_id")
+            cols = [header.index(c) for c in FEATURE_COLUMNS]
+        except ValueError:
+            raise SystemExit(f"{path}: missing track_id or audio-feature columns")
+
+        ids: list[str] = []
+        values: list[list[str]] = []
+        for record in reader:
+            if len(record) < len(header):
+                continue
+            ids.append(record[id_col])
+            values.append([record[c] for c in cols])
+            if len(ids) >= batch_size:
+                yield _parse_rows(ids, values)
+                ids, values = [], []
+        if ids:
+            yield _parse_rows(ids, values)
+
+
+def _arrow_chunk(batch) -> FeatureChunk:
+    X = np.column_stack(
+        [batch.column(c).to_numpy(zero_copy_only=False) for c in FEATURE_COLUMNS]
+    ).astype(np.float32, copy=False)
+    ids = batch.column("track_id").to_pylist()
+    valid = ~np.isnan(X).any(axis=1)
+    if valid.all():
+        return ids, X
+    return [tid for tid, ok in zip(ids, valid) if ok], X[valid]
+
+
+def _iter_parquet(path: str, batch_size: int) -> Iterator[FeatureChunk]:
+    import pyarrow.parquet as pq
+
+    columns = ["track_id", *FEATURE_COLUMNS]
+    for batch in pq.ParquetFile(path).iter_batches(
+        batch_size=batch_size, columns=columns
+    ):
+        yield _arrow_chunk(batch)
+
+
+def _iter_arrow(path: str, batch_size: int) -> Iterator[FeatureChunk]:
+    import pyarrow as pa
+
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            for offset in range(0, batch.num_rows, batch_size):
+                yield _arrow_chunk(batch.slice(offset, batch_size))
+
+
+def _iter_npy_member(
+    zf: zipfile.ZipFile, name: str, batch_size: int
+) -> Iterator[np.ndarray]:
+    """Yield ``batch_size``-row slices of an npz member, reading only those rows.
+
+    Works for stored and compressed members alike; a column-major array
+    (not something the export writes) has no contiguous rows and is read whole.
+    """
+    with zf.open(f"{name}.npy") as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        if dtype.hasobject:
+            raise SystemExit(f"{zf.filename}: {name} holds pickled objects")
+        n_rows = shape[0] if shape else 1
+        row_shape = shape[1:]
+        if fortran_order and len(shape) > 1:
+            data = np.frombuffer(f.read(), dtype=dtype).reshape(shape, order="F")
+            for i in range(0, n_rows, batch_size):
+                yield data[i : i + batch_size]
+            return
+        row_bytes = dtype.itemsize * int(np.prod(row_shape))
+        for i in range(0, n_rows, batch_size):
+            count = min(batch_size, n_rows - i)
+            yield np.frombuffer(f.read(count * row_bytes), dtype=dtype).reshape(
+                count, *row_shape
+            )
+
+
+def _iter_npz(path: str, batch_size: int) -> Iterator[FeatureChunk]:
+    with zipfile.ZipFile(path) as zf:
+        names = set(zf.namelist())
+        if not {"features.npy", "track_ids.npy"} <= names:
+            raise SystemExit(f"{path}: missing features or track_ids arrays")
+        for ids, X in zip(
+            _iter_npy_member(zf, "track_ids", batch_size),
+            _iter_npy_member(zf, "features", batch_size),
+        ):
+            yield ids.tolist(), X.astype(np.float32, copy=False)
+
+
+READERS = {
+    ".csv": _iter_csv,
+    ".parquet": _iter_parquet,
+    ".arrow": _iter_arrow,
+    ".npz": _iter_npz,
+}
+
+
+def iter_feature_chunks(path: str, batch_size: int) -> Iterator[FeatureChunk]:
+    """Yield (track_ids, float32 features) chunks of at most ``batch_size`` rows."""
+    ext = os.path.splitext(path)[1].lower()
+    reader = READERS.get(ext)
+    if reader is None:
+        raise SystemExit(f"{path}: unsupported input format {ext or '(none)'}")
+    for ids, X in reader(path, batch_size):
+        if ids:
+            yield ids, X
+
+
+def _init_worker(
+    model_path: str, scaler_path: str, version: str, precision: str, num_threads: int
+):
+    global _artifacts
+
+    import torch
+
+    torch.set_num_threads(num_threads)
+    _artifacts = read_artifacts(
+        model_path, scaler_path, version=version, precision=precision
+    )
+
+
+def _score_chunk(X: np.ndarray) -> np.ndarray:
+    return predict_moods(X, _artifacts)
+
+
+def _score_chunks(
+    chunks: Iterator[FeatureChunk], args: argparse.Namespace
+) -> Iterator[tuple[list[str], np.ndarray, np.ndarray]]:
+    """Yield (track_ids, features, probabilities) in input order.
+
+    Scores in-process or across a bounded process pool.
+    """
+    if args.workers <= 1:
+        _init_worker(
+            args.model, args.scaler, args.model_version, args.precision, args.threads
+        )
+        for ids, X in chunks:
+            yield ids, X, _score_chunk(X)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=_init_worker,
+        initargs=(
+            args.model,
+            args.scaler,
+            args.model_version,
+            args.precision,
+            args.threads,
+        ),
+    ) as pool:
+        # Keep at most two chunks per worker in flight to bound memory.
+        pending: deque = deque()
+        for ids, X in chunks:
+            pending.append((ids, X, pool.submit(_score_chunk, X)))
+            if len(pending) >= 2 * args.workers:
+                ids, X, future = pending.popleft()
+                yield ids, X, future.result()
+        while pending:
+            ids, X, future = pending.popleft()
+            yield ids, X, future.result()
+
+
+class _CsvSink:
+    def __init__(self, path: str):
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(OUTPUT_FIELDS)
+
+    def write(self, ids: list[str], probs: np.ndarray):
+        moods = [MOODS[i] for i in probs.argmax(axis=1)]
+        self._writer.writerows(
+            (tid, mood, *row) for tid, mood, row in zip(ids, moods, probs.tolist())
+        )
+
+    def close(self):
+        self._file.close()
+
+
+class _ParquetSink:
+    def __init__(self, path: str):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        self._schema = pa.schema(
+            [("track_id", pa.string()), ("mood", pa.string())]
+            + [(f"prob_{m}", pa.float32()) for m in MOODS]
+        )
+        self._writer = pq.ParquetWriter(path, self._schema)
+
+    def write(self, ids: list[str], probs: np.ndarray):
+        moods = [MOODS[i] for i in probs.argmax(axis=1)]
+        arrays = [self._pa.array(ids), self._pa.array(moods)]
+        arrays += [
+            self._pa.array(np.ascontiguousarray(probs[:, i])) for i in range(len(MOODS))
+        ]
+        self._writer.write_batch(self._pa.record_batch(arrays, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+def _open_sink(path: str):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".parquet":
+        return _ParquetSink(path)
+    if ext == ".csv":
+        return _CsvSink(path)
+    raise SystemExit(f"{path}: output must be .csv or .parquet")
+
+
+def _all_chunks(paths: list[str], batch_size: int) -> Iterator[FeatureChunk]:
+    for path in paths:
+        yield from iter_feature_chunks(path, batch_size)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Pre-label exported audio-feature files with MoodClassifier."
+    )
+    parser.add_argument(
+        "inputs", nargs="+", help=".csv/.parquet/.arrow/.npz feature files"
+    )
+    parser.add_argument(
+        "-o", "--output", required=True, help=".csv or .parquet output path"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=65536, help="rows per inference batch"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="scoring processes (1 = in-process)"
+    )
+    parser.add_argument(
+        "--threads", type=int, default=1, help="torch threads per worker"
+    )
+    parser.add_argument("--model", default=app.MODEL_PATH)
+    parser.add_argument("--scaler", default=app.SCALER_PATH)
+    parser.add_argument(
+        "--model-version",
+        help="version recorded in the mood index (default: content hash; use the "
+        "registry directory name when scoring a registry model)",
+    )
+    parser.add_argument(
+        "--mood-index",
+        metavar="PATH",
+        help="also store predictions in this mood index (see PIPER_MOOD_INDEX_PATH)",
+    )
+    parser.add_argument(
+        "--precision",
+        choices=["float32", "int8", "float16"],
+        default=MODEL_PRECISION,
+        help="inference precision (default: PIPER_MODEL_PRECISION or float32)",
+    )
+    args = parser.parse_args(argv)
+
+    args.model_version = args.model_version or artifact_version(args.model, args.scaler)
+    index = app.MoodIndex(args.mood_index) if args.mood_index else None
+    index_version = precision_version(args.model_version, args.precision)
+
+    sink = _open_sink(args.output)
+    scored = 0
+    try:
+        for ids, X, probs in _score_chunks(
+            _all_chunks(args.inputs, args.batch_size), args
+        ):
+            sink.write(ids, probs)
+            if index is not None:
+                index.store(ids, X, probs, index_version)
+            scored += len(ids)
+    finally:
+        sink.close()
+
+    print(f"Scored {scored} tracks -> {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
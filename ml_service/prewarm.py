@@ -0,0 +1,184 @@
+"""Prewarm the mood index with the tracks of recently active users.
+
+Meant to run from cron ahead of peak hours. The service records every track a
+/recommendations request asks for (MoodIndex.touch); this job takes the tracks
+requested within ``--active-within`` and makes sure the loaded model has
+already scored them, so the next morning's requests skip both the Spotify
+audio-features call and inference:
+
+- tracks scored by an older model version are re-scored from their stored
+  features, without calling Spotify;
+- tracks that were never indexed (their audio features failed, ran out of
+  deadline or hit an open breaker) are fetched from /audio-features when
+  ``PIPER_PREWARM_SPOTIFY_TOKEN`` holds a token, at most ``--rate`` requests
+  per second and ``--max-requests`` in total.
+
+User access tokens are never stored, so the job cannot re-read anyone's top
+tracks; an app (client-credentials) token is enough for /audio-features.
+
+    30 5 * * *  cd ml_service && python prewarm.py --active-within 7d
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+import app
+from piper_core.model import Artifacts, feature_matrix, predict_moods
+from piper_core.spotify import spotify_iter_audio_features
+
+_DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def _parse_duration(value: str) -> float:
+    """``"90"``, ``"30m"``, ``"12h"`` or ``"7d"`` in seconds."""
+    unit = value[-1:].lower()
+    try:
+        if unit in _DURATION_UNITS:
+            return float(value[:-1]) * _DURATION_UNITS[unit]
+        return float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid duration: {value}")
+
+
+class RateBudget:
+    """Paces Spotify requests to ``rate`` per second, ``max_requests`` in total."""
+
+    def __init__(self, rate: float, max_requests: int):
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._remaining = max_requests
+        self._next_at = time.monotonic()
+
+    def acquire(self) -> bool:
+        """Wait for the next request slot; False once the budget is spent."""
+        if self._remaining <= 0:
+            return False
+        delay = self._next_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self._next_at = max(self._next_at, time.monotonic()) + self._interval
+        self._remaining -= 1
+        return True
+
+
+def _rescore(index: app.MoodIndex, art: Artifacts, track_ids: list[str], X: np.ndarray):
+    index.store(track_ids, X, predict_moods(X, art), art.version)
+
+
+def prewarm(
+    index: app.MoodIndex,
+    art: Artifacts,
+    *,
+    active_within_s: float,
+    access_token: str | None,
+    budget: RateBudget,
+    batch_size: int = 4096,
+) -> dict[str, int]:
+    """Score the recently requested tracks with ``art``; returns the counts."""
+    since = time.time() - active_within_s
+    active = index.active_track_ids(since)
+    counts = {
+        "active": len(active),
+        "current": 0,
+        "rescored": 0,
+        "fetched": 0,
+        "missing": 0,
+        "requests": 0,
+    }
+
+    unindexed: list[str] = []
+    for i in range(0, len(active), batch_size):
+        chunk = active[i : i + batch_size]
+        indexed = index.lookup(chunk)
+        stale = [tid for tid, e in indexed.items() if e.model_version != art.version]
+        counts["current"] += len(indexed) - len(stale)
+        if stale:
+            _rescore(index, art, stale, np.stack([indexed[t].features for t in stale]))
+            counts["rescored"] += len(stale)
+        unindexed += [tid for tid in chunk if tid not in indexed]
+
+    for i in range(0, len(unindexed), 100):
+        if not access_token or not budget.acquire():
+            break
+        spotify_counts: dict[str, int] = {}
+        features_by_id: dict[str, dict] = {}
+        # One batch request per 100 tracks; no per-track fills, which would
+        # cost one request each.
+        for found in spotify_iter_audio_features(
+            access_token,
+            unindexed[i : i + 100],
+            spotify_counts,
+            max_per_track_attempts=0,
+        ):
+            features_by_id.update(found)
+        if spotify_counts.get("circuit_open"):
+            break
+        counts["requests"] += 1
+        X, scored_ids = feature_matrix(list(features_by_id), features_by_id)
+        if scored_ids:
+            _rescore(index, art, scored_ids, X)
+            counts["fetched"] += len(scored_ids)
+        if spotify_counts.get("unauthorized") or spotify_counts.get("forbidden"):
+            break
+    counts["missing"] = len(unindexed) - counts["fetched"]
+
+    index.prune_activity(since)
+    return counts
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Score recently requested tracks into the mood index."
+    )
+    parser.add_argument(
+        "--active-within",
+        type=_parse_duration,
+        default="7d",
+        help="tracks requested within this window, e.g. 12h or 7d (default 7d)",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=2.0,
+        help="Spotify requests per second (default 2)",
+    )
+    parser.add_argument(
+        "--max-requests",
+        type=int,
+        default=500,
+        help="Spotify requests per run, 100 tracks each (default 500)",
+    )
+    parser.add_argument(
+        "--mood-index",
+        metavar="PATH",
+        default=app.mood_index_path(),
+        help="mood index to prewarm (default: PIPER_MOOD_INDEX_PATH)",
+    )
+    args = parser.parse_args(argv)
+    if not args.mood_index:
+        raise SystemExit("The mood index is disabled (PIPER_MOOD_INDEX_PATH)")
+
+    art = app.load_current_artifacts()
+    counts = prewarm(
+        app.MoodIndex(args.mood_index),
+        art,
+        active_within_s=args.active_within,
+        access_token=os.environ.get("PIPER_PREWARM_SPOTIFY_TOKEN") or None,
+        budget=RateBudget(args.rate, args.max_requests),
+    )
+    print(
+        "Prewarmed {active} active tracks for model {version}: {current} current, "
+        "{rescored} re-scored, {fetched} fetched ({requests} Spotify requests), "
+        "{missing} still unindexed".format(version=art.version, **counts),
+        file=sys.stderr,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""Pre-fork server for the ML service.
+
+`uvicorn --workers N` starts every worker from scratch, so each one imports
+torch and loads the model on its own. This entry point imports everything and
+loads the artifacts once in the parent, freezes the GC so the inherited objects
+are not dirtied, then forks workers that share those pages copy-on-write and
+serve on one pre-bound listening socket. Dead workers are restarted.
+
+    python serve.py --workers 4 --port 8000
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+
+import uvicorn
+
+import app
+
+
+def _bind(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _spawn_worker(sock: socket.socket, args: argparse.Namespace) -> int:
+    pid = os.fork()
+    if pid != 0:
+        return pid
+
+    # Worker: uvicorn installs its own SIGINT/SIGTERM handlers for a graceful
+    # shutdown. Startup hooks still run here, so per-process resources (the
+    # mood index connection, the registry poller) are created after the fork.
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    code = 0
+    try:
+        config = uvicorn.Config(app.app, log_level=args.log_level, lifespan="on")
+        uvicorn.Server(config).run(sockets=[sock])
+    except BaseException:
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Pre-fork PIPER ML service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv)
+
+    sock = _bind(args.host, args.port)
+
+    # Everything loaded here is inherited by the workers; _load_artifacts is a
+    # no-op in a worker that already has artifacts.
+    app.configure_torch_threads()
+    app._load_artifacts()
+    gc.collect()
+    gc.freeze()
+
+    workers = {_spawn_worker(sock, args) for _ in range(max(1, args.workers))}
+    print(
+        f"Serving on {args.host}:{args.port} with {len(workers)} workers "
+        f"(model {app.artifacts.version})",
+        file=sys.stderr,
+    )
+
+    stopping = False
+
+    def _stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, _stop)
+    signal.signal(signal.SIGTERM, _stop)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        workers.discard(pid)
+        if not stopping:
+            print(
+                f"Worker {pid} exited ({os.waitstatus_to_exitcode(status)}); restarting",
+                file=sys.stderr,
+            )
+            workers.add(_spawn_worker(sock, args))
+
+    sock.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,6 +4,7 @@ import { eq } from 'drizzle-orm';
 
 import { db } from '@/db/client';
 import { playlists, spotifyAccess, users } from '@/db/schema';
+import { getMlServiceUrl } from '@/lib/mlService';
 import {
 	getSpotifySessionFromCookieStore,
 } from '@/lib/spotifySession';
@@ -40,10 +41,6 @@ function isAllowedMood(value: string): value is AllowedMood {
 	return (ALLOWED_MOODS as readonly string[]).includes(value);
 }
 
-function getMlServiceUrl() {
-	return (process.env.ML_SERVICE_URL ?? 'http://127.0.0.1:8000').replace(/\/$/, '');
-}
-
 function getFallbackSeedGenres(mood: AllowedMood): string[] {
 	// Keep this deterministic and non-random; avoid search-based fallbacks.
 	switch (mood) {
@@ -62,6 +59,14 @@ function getFallbackSeedGenres(mood: AllowedMood): string[] {
 	}
 }
 
+// Messages for the ML service's server-side fallback (`fallbackSource`), which
+// tries the same sources in the same order as getFallbackTrackIds below.
+const FALLBACK_SOURCE_MESSAGES: Record<string, string> = {
+	liked_songs: 'No top tracks found; used your Liked Songs to curate this playlist.',
+	trending: 'No top tracks found; used Trending tracks to curate this playlist.',
+	spotify_recommendations: 'No top tracks found; used Spotify recommendations to curate this playlist.',
+};
+
 async function getFallbackTrackIds(
 	accessToken: string,
 	mood: AllowedMood
@@ -212,11 +217,17 @@ export async function POST(req: Request) {
 		const mlRes = await fetch(`${getMlServiceUrl()}/recommendations`, {
 			method: 'POST',
 			headers: { 'Content-Type': 'application/json' },
-			body: JSON.stringify({ mood, access_token: spotifySession.accessToken }),
+			body: JSON.stringify({ mood, access_token: spotifySession.accessToken, fallback: true }),
 			cache: 'no-store',
 		});
 		const mlJson = (await mlRes.json().catch(() => null)) as
-			| { trackIds?: unknown; error?: unknown; message?: unknown; detail?: unknown }
+			| {
+					trackIds?: unknown;
+					fallbackSource?: unknown;
+					error?: unknown;
+					message?: unknown;
+					detail?: unknown;
+			  }
 			| null;
 
 		const mlDetail = typeof mlJson?.detail === 'string' ? mlJson.detail : undefined;
@@ -305,6 +316,10 @@ export async function POST(req: Request) {
 		trackIds = Array.isArray(mlJson?.trackIds)
 			? (mlJson?.trackIds.filter((id): id is string => typeof id === 'string') as string[])
 			: [];
+		if (typeof mlJson?.fallbackSource === 'string') {
+			usedTrendingFallback = true;
+			fallbackMessage = FALLBACK_SOURCE_MESSAGES[mlJson.fallbackSource];
+		}
 	} catch (err) {
 		const message = err instanceof Error ? err.message : 'ml_request_failed';
 		return NextResponse.json(
@@ -1,6 +1,7 @@
-import { NextResponse } from 'next/server';
+import { after, NextResponse } from 'next/server';
 import { cookies } from 'next/headers';
 
+import { prefetchRecommendations } from '@/lib/mlService';
 import { exchangeSpotifyCodeForAccessToken } from '@/lib/spotify';
 import {
 	clearSpotifyOauthStateCookies,
@@ -36,5 +37,9 @@ export async function GET(request: Request) {
 	setSpotifySessionCookie(response, { accessToken, expiresAtMs });
 	clearSpotifyOauthStateCookies(response);
 
+	// Warm the ML service while the user picks a mood; runs after the redirect
+	// is sent.
+	after(() => prefetchRecommendations(accessToken));
+
 	return response;
 }
@@ -0,0 +1,26 @@
+import 'server-only';
+
+export function getMlServiceUrl() {
+	return (process.env.ML_SERVICE_URL ?? 'http://127.0.0.1:8000').replace(/\/$/, '');
+}
+
+const PREFETCH_TIMEOUT_MS = 2000;
+
+/**
+ * Ask the ML service to start classifying the user's top tracks so the first
+ * /recommendations call is served from its stash. Best effort: the service
+ * answers 202 at once, and any failure only means a cold first request.
+ */
+export async function prefetchRecommendations(accessToken: string): Promise<void> {
+	try {
+		await fetch(`${getMlServiceUrl()}/prefetch`, {
+			method: 'POST',
+			headers: { 'Content-Type': 'application/json' },
+			body: JSON.stringify({ access_token: accessToken }),
+			cache: 'no-store',
+			signal: AbortSignal.timeout(PREFETCH_TIMEOUT_MS),
+		});
+	} catch {
+		// Ignore: prefetching is an optimisation.
+	}
+}
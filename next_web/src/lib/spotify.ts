@@ -341,10 +341,12 @@ export async function getSpotifySavedTrackIds(input: {
 	if (target === 0) return [];
 
 	const collected: string[] = [];
+	// /me/tracks has no `fields` projection; `market` at least drops the
+	// available_markets lists from every track and album.
 	let nextPath: string | null = `/me/tracks?${new URLSearchParams({
 		limit: '50',
 		offset: '0',
-		fields: 'items(track(id)),next',
+		market: 'from_token',
 	}).toString()}`;
 
 	while (nextPath && collected.length < target) {
@@ -0,0 +1,12 @@
+"""Shared core of the PIPER mood recommendation API.
+
+- model: MoodClassifier, artifact loading and scoring
+- spotify: Spotify Web API helpers
+- candidates: compact candidate storage (TrackCatalog, FeatureRows)
+- jsonio: JSON encoding/decoding with the opt-in orjson fast path
+- cache: in-process cache of final /recommendations responses
+- export: top-tracks audio-feature export
+- jobs: background export jobs (persistent job table, bounded worker pool)
+- prefetch: speculative per-user prefetch stash behind /prefetch
+- service: the FastAPI app and the Runtime interface the entry points implement
+"""
@@ -0,0 +1,92 @@
+"""In-process cache of final /recommendations responses.
+
+The same user asking for the same mood again within minutes (refreshing the
+page, retrying a playlist) gets the response computed the first time, without
+calling Spotify or the model. Entries are keyed by a SHA-256 of the access
+token, the mood, the limit and the fallback flag. They are dropped after
+PIPER_RECOMMENDATIONS_CACHE_TTL_S seconds or when the model version changes,
+and can be invalidated per user.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, NamedTuple, Optional
+
+# 0 disables the cache.
+RECOMMENDATIONS_CACHE_TTL_S = float(
+    os.environ.get("PIPER_RECOMMENDATIONS_CACHE_TTL_S", "120")
+)
+RECOMMENDATIONS_CACHE_MAX_ENTRIES = int(
+    os.environ.get("PIPER_RECOMMENDATIONS_CACHE_MAX_ENTRIES", "4096")
+)
+
+
+def user_key(access_token: str) -> str:
+    return hashlib.sha256(access_token.encode()).hexdigest()
+
+
+class _Entry(NamedTuple):
+    stored_at: float
+    version: str
+    value: Any
+
+
+class ResponseCache:
+    """TTL + LRU map of (user key, *request fields) -> response."""
+
+    def __init__(
+        self,
+        *,
+        ttl_s: float = RECOMMENDATIONS_CACHE_TTL_S,
+        max_entries: int = RECOMMENDATIONS_CACHE_MAX_ENTRIES,
+    ):
+        self.ttl_s = ttl_s
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple, _Entry] = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_s > 0 and self._max_entries > 0
+
+    def get(self, key: tuple, version: str) -> Optional[Any]:
+        """The cached value for ``key`` if fresh and computed by ``version``."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expired = time.monotonic() - entry.stored_at > self.ttl_s
+            if expired or entry.version != version:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry.value
+
+    def put(self, key: tuple, version: str, value: Any):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = _Entry(time.monotonic(), version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, key: str) -> int:
+        """Drop every entry of the user with this ``user_key``; returns the count."""
+        with self._lock:
+            keys = [k for k in self._entries if k[0] == key]
+            for k in keys:
+                del self._entries[k]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+recommendations_cache = ResponseCache()
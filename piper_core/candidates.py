@@ -0,0 +1,144 @@
+"""Compact storage for candidate tracks.
+
+Spotify sends a full track object per top track (album, images, the
+``available_markets`` list) and about 18 fields per audio-features payload.
+The pipeline only uses a track's ID, name, artists and five floats, so it
+keeps exactly that: IDs in a list, names in parallel lists of interned
+strings, and features in one contiguous float32 matrix. Payloads are reduced
+as each Spotify page or audio-features batch arrives, so the parsed dicts
+can be freed straight away instead of living as long as the request or
+export job.
+"""
+
+from __future__ import annotations
+
+from typing import Iterable, Optional
+
+import numpy as np
+
+from piper_core.model import FEATURE_COLUMNS, feature_matrix
+
+
+class TrackCatalog:
+    """ID, name and artist names of tracks, in first-seen order.
+
+    Strings are interned per catalog: an artist appearing on many tracks is
+    stored once. A private table is used rather than ``sys.intern``, whose
+    strings are never freed.
+    """
+
+    __slots__ = ("track_ids", "names", "artist_names", "_row", "_strings")
+
+    def __init__(self, tracks: Iterable = ()):
+        self.track_ids: list[str] = []
+        self.names: list[str] = []
+        self.artist_names: list[str] = []
+        self._row: dict[str, int] = {}
+        self._strings: dict[str, str] = {}
+        self.add(tracks)
+
+    def _intern(self, value: str) -> str:
+        return self._strings.setdefault(value, value)
+
+    def add(self, tracks: Iterable):
+        """Add Spotify track objects; a track already in the catalog is skipped."""
+        for track in tracks:
+            if not isinstance(track, dict):
+                continue
+            tid = track.get("id")
+            if not isinstance(tid, str) or not tid or tid in self._row:
+                continue
+            name = track.get("name")
+            artists = track.get("artists")
+            self._row[tid] = len(self.track_ids)
+            self.track_ids.append(tid)
+            self.names.append(self._intern(name) if isinstance(name, str) else "")
+            self.artist_names.append(
+                self._intern(
+                    ", ".join(
+                        [
+                            self._intern(a["name"])
+                            for a in artists
+                            if isinstance(a, dict) and isinstance(a.get("name"), str)
+                        ]
+                    )
+                )
+                if isinstance(artists, list)
+                else ""
+            )
+
+    def __len__(self) -> int:
+        return len(self.track_ids)
+
+    def __contains__(self, track_id: str) -> bool:
+        return track_id in self._row
+
+    def row(self, track_id: str) -> int:
+        return self._row[track_id]
+
+
+class FeatureRows:
+    """Audio features as a float32 (n, 5) matrix plus the track IDs of its rows.
+
+    ``unusable`` counts payloads dropped because a feature was missing or not
+    numeric.
+    """
+
+    __slots__ = ("track_ids", "unusable", "_blocks", "_row")
+
+    def __init__(self):
+        self.track_ids: list[str] = []
+        self.unusable = 0
+        self._blocks: list[np.ndarray] = []
+        self._row: dict[str, int] = {}
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[dict[str, dict]]) -> FeatureRows:
+        """Collect the {track_id: payload} batches of spotify_iter_audio_features."""
+        rows = cls()
+        for chunk in chunks:
+            rows.add(chunk)
+        return rows
+
+    def add(self, features_by_id: dict[str, dict]) -> int:
+        """Append the payloads of tracks not seen yet; returns how many were usable."""
+        new_ids = [tid for tid in features_by_id if tid not in self._row]
+        X, ids = feature_matrix(new_ids, features_by_id)
+        self.unusable += len(new_ids) - len(ids)
+        if ids:
+            for tid in ids:
+                self._row[tid] = len(self.track_ids)
+                self.track_ids.append(tid)
+            self._blocks.append(X)
+        return len(ids)
+
+    def __len__(self) -> int:
+        return len(self.track_ids)
+
+    def __contains__(self, track_id: str) -> bool:
+        return track_id in self._row
+
+    @property
+    def X(self) -> np.ndarray:
+        """The (n, 5) matrix, rows aligned with ``track_ids``."""
+        if len(self._blocks) != 1:
+            self._blocks = [
+                (
+                    np.concatenate(self._blocks)
+                    if self._blocks
+                    else np.empty((0, len(FEATURE_COLUMNS)), dtype=np.float32)
+                )
+            ]
+        return self._blocks[0]
+
+    def take(
+        self, track_ids: Optional[list[str]] = None
+    ) -> tuple[np.ndarray, list[str]]:
+        """(features, ids) for the ``track_ids`` that have features, in order.
+
+        Without ``track_ids``, every row in insertion order.
+        """
+        if track_ids is None:
+            return self.X, self.track_ids
+        rows = [self._row[tid] for tid in track_ids if tid in self._row]
+        return self.X[rows], [self.track_ids[r] for r in rows]
@@ -0,0 +1,363 @@
+"""Top-tracks audio-feature export (CSV, npz, Arrow IPC, Parquet)."""
+
+from __future__ import annotations
+
+import csv
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, Literal, Optional
+
+import numpy as np
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field
+
+from piper_core.candidates import FeatureRows, TrackCatalog
+from piper_core.model import FEATURE_COLUMNS
+from piper_core.spotify import spotify_get_top_tracks, spotify_iter_audio_features
+
+TIME_RANGES = ("short_term", "medium_term", "long_term")
+
+TOP_TRACKS_CSV_FIELDS = ["track_id", "track_name", "artist_names", *FEATURE_COLUMNS]
+
+ExportFormat = Literal["csv", "npz", "arrow", "parquet"]
+
+EXPORT_MEDIA_TYPES = {
+    "npz": "application/octet-stream",
+    "arrow": "application/vnd.apache.arrow.file",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+class ExportTopTracksCsvRequest(BaseModel):
+    access_token: str = Field(min_length=1)
+    # Per time range; more than 50 pages through /me/top/tracks.
+    limit: int = Field(default=50, ge=1, le=1000)
+    # "all" fetches every range and tags each row with the ranges it appeared in.
+    time_range: Literal["short_term", "medium_term", "long_term", "all"] = "medium_term"
+    # Stream the CSV back (chunked) instead of writing it to PIPER_TOP_TRACKS_CSV_PATH.
+    stream: bool = False
+    # Non-CSV formats are returned as a binary download (see encode_top_tracks).
+    format: ExportFormat = "csv"
+
+
+class ExportTopTracksCsvResponse(BaseModel):
+    ok: bool
+    csvPath: str
+    rowsWritten: int
+    tracksFetched: int
+    failedAudioFeatures: int
+
+
+def atomic_write_csv(csv_path: str, fieldnames: list[str], rows: list[dict]):
+    os.makedirs(os.path.dirname(csv_path), exist_ok=True)
+    tmp_path = f"{csv_path}.tmp"
+    with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+    os.replace(tmp_path, csv_path)
+
+
+def top_track_table(
+    track_ids: list[str],
+    catalog: TrackCatalog,
+    features: FeatureRows,
+    ranges_by_id: Optional[dict[str, list[str]]] = None,
+) -> tuple[dict[str, list[str]], np.ndarray, int]:
+    """Columnar view of the tracks with metadata and usable audio features.
+
+    Returns (columns, features, failed): ``columns`` maps the text fields
+    (track_id, track_name, artist_names, plus time_range when ``ranges_by_id``
+    is given) to lists aligned with the rows of the float32 (n, 5) ``features``
+    matrix; ``failed`` counts the audio-features payloads that were unusable.
+    """
+    X, feature_ids = features.take([tid for tid in track_ids if tid in catalog])
+    rows = [catalog.row(tid) for tid in feature_ids]
+    columns = {
+        "track_id": feature_ids,
+        "track_name": [catalog.names[r] for r in rows],
+        "artist_names": [catalog.artist_names[r] for r in rows],
+    }
+    if ranges_by_id is not None:
+        columns["time_range"] = [
+            ",".join(ranges_by_id.get(tid, [])) for tid in feature_ids
+        ]
+    return columns, X, features.unusable
+
+
+def top_track_fieldnames(ranges_by_id: Optional[dict[str, list[str]]]) -> list[str]:
+    if ranges_by_id is None:
+        return TOP_TRACKS_CSV_FIELDS
+    return [*TOP_TRACKS_CSV_FIELDS, "time_range"]
+
+
+def top_track_rows(
+    track_ids: list[str],
+    catalog: TrackCatalog,
+    features: FeatureRows,
+    ranges_by_id: Optional[dict[str, list[str]]] = None,
+) -> tuple[list[dict], int]:
+    """Build CSV rows for tracks with metadata and usable audio features.
+
+    Returns the rows and the number of unusable audio-features payloads.
+    """
+    columns, X, failed = top_track_table(track_ids, catalog, features, ranges_by_id)
+    return table_rows(columns, X), failed
+
+
+def table_rows(columns: dict[str, list[str]], X: np.ndarray) -> list[dict]:
+    """CSV rows (dicts keyed by field name) for a top_track_table result."""
+    fieldnames = [*columns, *FEATURE_COLUMNS]
+    return [
+        dict(zip(fieldnames, (*texts, *values)))
+        for texts, values in zip(zip(*columns.values()), X)
+    ]
+
+
+def encode_top_tracks(fmt: str, columns: dict[str, list[str]], X: np.ndarray) -> bytes:
+    """Serialize the export in a binary columnar format.
+
+    - npz: ``features`` (float32, n x 5, columns in FEATURE_COLUMNS order) and
+      ``track_ids`` (plus ``time_ranges`` for multi-range exports); loads with
+      ``np.load`` without pickle.
+    - arrow / parquet: one column per CSV field, features as float32. Arrow IPC
+      files can be memory-mapped and read into NumPy without copying.
+      Both need the optional ``pyarrow`` package.
+    """
+    buf = io.BytesIO()
+    if fmt == "npz":
+        arrays = {
+            "features": X,
+            "track_ids": np.array(columns["track_id"], dtype=str),
+            "feature_columns": np.array(FEATURE_COLUMNS),
+        }
+        if "time_range" in columns:
+            arrays["time_ranges"] = np.array(columns["time_range"], dtype=str)
+        np.savez(buf, **arrays)
+        return buf.getvalue()
+
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise HTTPException(status_code=501, detail=f"export_format_unavailable:{fmt}")
+
+    arrow_columns = {
+        name: pa.array(values, type=pa.string()) for name, values in columns.items()
+    }
+    for i, name in enumerate(FEATURE_COLUMNS):
+        arrow_columns[name] = pa.array(np.ascontiguousarray(X[:, i]))
+    table = pa.table(arrow_columns)
+
+    if fmt == "parquet":
+        pyarrow.parquet.write_table(table, buf)
+    else:
+        with pyarrow.ipc.new_file(buf, table.schema) as writer:
+            writer.write_table(table)
+    return buf.getvalue()
+
+
+def iter_top_tracks_csv(
+    access_token: str,
+    catalog: TrackCatalog,
+    ranges_by_id: Optional[dict[str, list[str]]] = None,
+) -> Iterator[str]:
+    """Yield the top-tracks CSV as audio-feature batches arrive.
+
+    The header goes out before any audio-features request is made, and only one
+    batch of rows is held in memory at a time.
+    """
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=top_track_fieldnames(ranges_by_id))
+    writer.writeheader()
+    yield buf.getvalue()
+
+    for i in range(0, len(catalog.track_ids), 100):
+        chunk = catalog.track_ids[i : i + 100]
+        features = FeatureRows.from_chunks(
+            spotify_iter_audio_features(
+                access_token, chunk, {}, max_per_track_attempts=2
+            )
+        )
+        rows, _ = top_track_rows(chunk, catalog, features, ranges_by_id)
+        if not rows:
+            continue
+        buf.seek(0)
+        buf.truncate()
+        writer.writerows(rows)
+        yield buf.getvalue()
+
+
+def fetch_export_tracks(
+    req: ExportTopTracksCsvRequest,
+) -> tuple[TrackCatalog, Optional[dict[str, list[str]]]]:
+    """The top tracks an export covers.
+
+    Returns (catalog of the tracks, time ranges by id); the ranges are only
+    collected for ``time_range="all"`` and are None otherwise.
+    """
+    catalog = TrackCatalog()
+    ranges_by_id: Optional[dict[str, list[str]]] = None
+    if req.time_range == "all":
+        # Bulk mode: page through every time range concurrently and tag each
+        # track with the ranges it appeared in.
+        with ThreadPoolExecutor(max_workers=len(TIME_RANGES)) as pool:
+            pages = list(
+                pool.map(
+                    lambda time_range: spotify_get_top_tracks(
+                        req.access_token, limit=req.limit, time_range=time_range
+                    ),
+                    TIME_RANGES,
+                )
+            )
+        ranges_by_id = {}
+        n_items = 0
+        for time_range, tracks in zip(TIME_RANGES, pages):
+            for t in tracks:
+                tid = t.get("id")
+                if isinstance(tid, str) and tid:
+                    ranges_by_id.setdefault(tid, []).append(time_range)
+            catalog.add(tracks)
+            n_items += len(tracks)
+        del pages
+    else:
+        tracks = spotify_get_top_tracks(
+            req.access_token, limit=req.limit, time_range=req.time_range
+        )
+        catalog.add(tracks)
+        n_items = len(tracks)
+
+    if n_items == 0:
+        raise HTTPException(status_code=422, detail="no_top_tracks")
+    if not catalog.track_ids:
+        raise HTTPException(status_code=422, detail="no_track_ids")
+    return catalog, ranges_by_id
+
+
+def export_top_tracks_features(req: ExportTopTracksCsvRequest, csv_path: str):
+    """Generate/update top_tracks_features.csv for the current user.
+
+    This mirrors the Streamlit flow: fetch top tracks, fetch per-track audio features,
+    write a CSV, then the model can be run from that CSV. ``csv_path`` is where
+    the runtime keeps it.
+    """
+    catalog, ranges_by_id = fetch_export_tracks(req)
+    all_ids = catalog.track_ids
+
+    if req.stream and req.format != "csv":
+        raise HTTPException(status_code=422, detail="stream_requires_csv_format")
+
+    if req.stream:
+        return StreamingResponse(
+            iter_top_tracks_csv(req.access_token, catalog, ranges_by_id),
+            media_type="text/csv",
+            headers={
+                "Content-Disposition": 'attachment; filename="top_tracks_features.csv"',
+                "X-Tracks-Fetched": str(len(all_ids)),
+            },
+        )
+
+    # Fetch audio-features in batch, then fill missing.
+    counts: dict[str, int] = {}
+    features = FeatureRows.from_chunks(
+        spotify_iter_audio_features(
+            req.access_token, all_ids, counts, max_per_track_attempts=2
+        )
+    )
+    failed_audio_features = int(counts.get("failed", 0))
+
+    if req.format != "csv":
+        columns, X, failed_rows = top_track_table(
+            all_ids, catalog, features, ranges_by_id
+        )
+        if not columns["track_id"]:
+            raise HTTPException(status_code=422, detail="no_audio_features")
+        return Response(
+            content=encode_top_tracks(req.format, columns, X),
+            media_type=EXPORT_MEDIA_TYPES[req.format],
+            headers={
+                "Content-Disposition": (
+                    f'attachment; filename="top_tracks_features.{req.format}"'
+                ),
+                "X-Rows-Written": str(len(columns["track_id"])),
+                "X-Tracks-Fetched": str(len(all_ids)),
+                "X-Failed-Audio-Features": str(failed_audio_features + failed_rows),
+            },
+        )
+
+    rows, failed_rows = top_track_rows(all_ids, catalog, features, ranges_by_id)
+    failed_audio_features += failed_rows
+
+    if len(rows) == 0:
+        # Don't overwrite any existing CSV with an empty file.
+        raise HTTPException(status_code=422, detail="no_audio_features")
+
+    atomic_write_csv(csv_path, fieldnames=top_track_fieldnames(ranges_by_id), rows=rows)
+
+    return ExportTopTracksCsvResponse(
+        ok=True,
+        csvPath=csv_path,
+        rowsWritten=len(rows),
+        tracksFetched=len(all_ids),
+        failedAudioFeatures=failed_audio_features,
+    )
+
+
+def write_top_tracks_export(
+    req: ExportTopTracksCsvRequest,
+    path: str,
+    on_progress: Callable[[dict], None] = lambda progress: None,
+) -> dict[str, int]:
+    """Run an export to completion and write it to ``path`` in req.format.
+
+    For background jobs: ``on_progress`` gets a {stage, tracksFetched,
+    audioFeaturesFetched} dict as each audio-features batch arrives. Returns
+    the rowsWritten / tracksFetched / failedAudioFeatures counts. Nothing is
+    written if no track has usable audio features.
+    """
+    on_progress({"stage": "top_tracks", "tracksFetched": 0, "audioFeaturesFetched": 0})
+    catalog, ranges_by_id = fetch_export_tracks(req)
+    all_ids = catalog.track_ids
+
+    counts: dict[str, int] = {}
+    features = FeatureRows()
+    progress = {
+        "stage": "audio_features",
+        "tracksFetched": len(all_ids),
+        "audioFeaturesFetched": 0,
+    }
+    on_progress(dict(progress))
+    for chunk in spotify_iter_audio_features(
+        req.access_token, all_ids, counts, max_per_track_attempts=2
+    ):
+        features.add(chunk)
+        progress["audioFeaturesFetched"] = len(features) + features.unusable
+        on_progress(dict(progress))
+
+    on_progress({**progress, "stage": "writing"})
+    columns, X, failed_rows = top_track_table(all_ids, catalog, features, ranges_by_id)
+    if not columns["track_id"]:
+        raise HTTPException(status_code=422, detail="no_audio_features")
+
+    if req.format == "csv":
+        atomic_write_csv(
+            path,
+            fieldnames=top_track_fieldnames(ranges_by_id),
+            rows=table_rows(columns, X),
+        )
+    else:
+        content = encode_top_tracks(req.format, columns, X)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    return {
+        "rowsWritten": len(columns["track_id"]),
+        "tracksFetched": len(all_ids),
+        "failedAudioFeatures": int(counts.get("failed", 0)) + failed_rows,
+    }
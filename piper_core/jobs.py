@@ -0,0 +1,265 @@
+"""Background export jobs: a persistent job table and a bounded worker pool.
+
+A job runs write_top_tracks_export on one of the pool's threads and writes the
+result next to the job table, so the HTTP worker that submitted it returns at
+once and any worker sharing the directory can report on it or serve the file.
+Access tokens are never written to the table; a job whose process died before
+it finished (restart, crash) is reported as failed with ``job_interrupted``.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Literal, Optional
+
+from fastapi import HTTPException
+from fastapi.responses import FileResponse
+from pydantic import BaseModel
+
+from piper_core.export import (
+    EXPORT_MEDIA_TYPES,
+    ExportFormat,
+    ExportTopTracksCsvRequest,
+    write_top_tracks_export,
+)
+
+EXPORT_JOB_WORKERS = int(os.environ.get("PIPER_EXPORT_JOB_WORKERS", "2"))
+# Jobs queued or running in this process beyond which submissions get a 503.
+EXPORT_JOB_MAX_PENDING = int(os.environ.get("PIPER_EXPORT_JOB_MAX_PENDING", "32"))
+# Finished jobs and their files are deleted this long after their last update.
+EXPORT_JOB_TTL_S = float(os.environ.get("PIPER_EXPORT_JOB_TTL_S", "86400"))
+
+logger = logging.getLogger("piper.jobs")
+
+JobStatus = Literal["queued", "running", "done", "failed"]
+
+
+class ExportJob(BaseModel):
+    jobId: str
+    status: JobStatus
+    format: ExportFormat
+    timeRange: str
+    limit: int
+    # {stage, tracksFetched, audioFeaturesFetched} while running.
+    progress: dict[str, Any]
+    # {rowsWritten, tracksFetched, failedAudioFeatures} once done.
+    result: Optional[dict[str, int]] = None
+    # {status, detail} of the HTTPException the export failed with.
+    error: Optional[dict[str, Any]] = None
+    createdAt: float
+    updatedAt: float
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _new_owner() -> str:
+    return f"{os.getpid()}-{secrets.token_hex(4)}"
+
+
+class ExportJobs:
+    """Export job table in ``directory``/jobs.sqlite, results alongside it."""
+
+    def __init__(
+        self,
+        directory: str,
+        *,
+        max_workers: int = EXPORT_JOB_WORKERS,
+        max_pending: int = EXPORT_JOB_MAX_PENDING,
+        ttl_s: float = EXPORT_JOB_TTL_S,
+    ):
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._max_pending = max_pending
+        self._ttl_s = ttl_s
+        self._pending = 0
+        # "<pid>-<random>": tells this process's jobs from those of an earlier
+        # process that had the same PID (e.g. PID 1 in a restarted container).
+        self._owner = _new_owner()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            os.path.join(directory, "jobs.sqlite"), check_same_thread=False, timeout=10
+        )
+        self._pool = ThreadPoolExecutor(
+            max_workers=max(1, max_workers), thread_name_prefix="piper-export"
+        )
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS export_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    format TEXT NOT NULL,
+                    time_range TEXT NOT NULL,
+                    track_limit INTEGER NOT NULL,
+                    progress TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    owner TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """)
+
+    def _result_path(self, job_id: str, fmt: str) -> str:
+        return os.path.join(self._directory, f"{job_id}.{fmt}")
+
+    def _update(self, job_id: str, **fields):
+        columns = {
+            k: json.dumps(v) if k in ("progress", "result", "error") else v
+            for k, v in fields.items()
+        }
+        columns["updated_at"] = time.time()
+        assignments = ", ".join(f"{k} = ?" for k in columns)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE export_jobs SET {assignments} WHERE job_id = ?",
+                [*columns.values(), job_id],
+            )
+
+    def _prune(self):
+        cutoff = time.time() - self._ttl_s
+        with self._lock, self._conn:
+            expired = self._conn.execute(
+                "SELECT job_id, format FROM export_jobs "
+                "WHERE status IN ('done', 'failed') AND updated_at < ?",
+                (cutoff,),
+            ).fetchall()
+            self._conn.execute(
+                "DELETE FROM export_jobs "
+                "WHERE status IN ('done', 'failed') AND updated_at < ?",
+                (cutoff,),
+            )
+        for job_id, fmt in expired:
+            try:
+                os.remove(self._result_path(job_id, fmt))
+            except FileNotFoundError:
+                pass
+
+    def submit(self, req: ExportTopTracksCsvRequest) -> ExportJob:
+        if req.stream:
+            raise HTTPException(status_code=422, detail="stream_not_supported_for_jobs")
+        self._prune()
+        with self._lock:
+            if self._pending >= self._max_pending:
+                raise HTTPException(status_code=503, detail="export_queue_full")
+            self._pending += 1
+
+        job_id = secrets.token_hex(16)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO export_jobs VALUES (?, ?, ?, ?, ?, ?, NULL, NULL, ?, ?, ?)",
+                (
+                    job_id,
+                    "queued",
+                    req.format,
+                    req.time_range,
+                    req.limit,
+                    json.dumps({"stage": "queued"}),
+                    self._owner,
+                    now,
+                    now,
+                ),
+            )
+        self._pool.submit(self._run, job_id, req)
+        return self.get(job_id)
+
+    def _run(self, job_id: str, req: ExportTopTracksCsvRequest):
+        try:
+            self._update(job_id, status="running")
+            result = write_top_tracks_export(
+                req,
+                self._result_path(job_id, req.format),
+                on_progress=lambda progress: self._update(job_id, progress=progress),
+            )
+            self._update(
+                job_id, status="done", progress={"stage": "done"}, result=result
+            )
+        except HTTPException as e:
+            self._update(
+                job_id,
+                status="failed",
+                error={"status": e.status_code, "detail": e.detail},
+            )
+        except Exception:
+            logger.exception("Export job %s failed", job_id)
+            self._update(
+                job_id,
+                status="failed",
+                error={"status": 500, "detail": "export_failed"},
+            )
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _owner_alive(self, owner: str) -> bool:
+        if owner == self._owner:
+            return True
+        pid = int(owner.split("-", 1)[0])
+        return pid != os.getpid() and _pid_alive(pid)
+
+    def get(self, job_id: str) -> ExportJob:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, format, time_range, track_limit, progress, result, "
+                "error, owner, created_at, updated_at FROM export_jobs WHERE job_id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            raise HTTPException(status_code=404, detail="job_not_found")
+        status, fmt, time_range, limit, progress, result, error, owner = row[:8]
+        error = json.loads(error) if error else None
+        if status in ("queued", "running") and not self._owner_alive(owner):
+            status = "failed"
+            error = {"status": 500, "detail": "job_interrupted"}
+            self._update(job_id, status=status, error=error)
+        return ExportJob(
+            jobId=job_id,
+            status=status,
+            format=fmt,
+            timeRange=time_range,
+            limit=limit,
+            progress=json.loads(progress),
+            result=json.loads(result) if result else None,
+            error=error,
+            createdAt=row[8],
+            updatedAt=row[9],
+        )
+
+    def result(self, job_id: str) -> FileResponse:
+        job = self.get(job_id)
+        if job.status == "failed":
+            raise HTTPException(status_code=409, detail="job_failed")
+        if job.status != "done":
+            raise HTTPException(status_code=409, detail="job_not_done")
+        path = self._result_path(job_id, job.format)
+        if not os.path.exists(path):
+            raise HTTPException(status_code=404, detail="job_result_expired")
+        return FileResponse(
+            path,
+            media_type=EXPORT_MEDIA_TYPES.get(job.format, "text/csv"),
+            filename=f"top_tracks_features.{job.format}",
+            headers={
+                "X-Rows-Written": str(job.result["rowsWritten"]),
+                "X-Tracks-Fetched": str(job.result["tracksFetched"]),
+                "X-Failed-Audio-Features": str(job.result["failedAudioFeatures"]),
+            },
+        )
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
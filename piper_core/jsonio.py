@@ -0,0 +1,76 @@
+"""JSON encoding and decoding, with an opt-in orjson fast path.
+
+``PIPER_JSON_BACKEND=orjson`` parses Spotify payloads with orjson, renders API
+responses with it and lets the recommendation endpoints skip FastAPI's
+``response_model`` revalidation (see ``model_response``). The default,
+``stdlib``, keeps the json module and ``requests``' own decoding.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from typing import Any
+
+import requests
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel
+
+# stdlib | orjson
+JSON_BACKEND = os.environ.get("PIPER_JSON_BACKEND", "stdlib")
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if JSON_BACKEND == "orjson":
+    if orjson is None:
+        raise RuntimeError("PIPER_JSON_BACKEND=orjson needs the orjson package")
+elif JSON_BACKEND != "stdlib":
+    raise RuntimeError(f"Unsupported PIPER_JSON_BACKEND: {JSON_BACKEND}")
+
+FAST_JSON = JSON_BACKEND == "orjson"
+
+
+def loads(data: bytes | str) -> Any:
+    if FAST_JSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj: Any) -> str:
+    if FAST_JSON:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
+
+def response_json(res: requests.Response) -> Any:
+    """``res.json()``, parsed straight from the body bytes on the fast path."""
+    if FAST_JSON:
+        return orjson.loads(res.content)
+    return res.json()
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson.
+
+    Pydantic models are dumped as they are, without being validated again.
+    """
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, BaseModel):
+            content = content.model_dump()
+        return orjson.dumps(content)
+
+
+def model_response(model: BaseModel, response: Response) -> BaseModel | Response:
+    """Return ``model`` from an endpoint that declares it as ``response_model``.
+
+    On the fast path the model is rendered directly, with the headers set on
+    ``response``: FastAPI passes Response objects through untouched instead of
+    dumping, revalidating and re-encoding the model it was just built from.
+    """
+    if not FAST_JSON:
+        return model
+    return FastJSONResponse(model, headers=response.headers)
@@ -0,0 +1,216 @@
+"""MoodClassifier, its inference variants and the feature/scoring helpers."""
+
+from __future__ import annotations
+
+import hashlib
+import os
+from itertools import chain
+from operator import itemgetter
+from typing import Literal, NamedTuple, Optional
+
+import joblib
+import numpy as np
+import torch
+import torch.nn as nn
+
+Mood = Literal["Happy", "Calm", "Neutral", "Sad", "Very Sad"]
+
+MOOD_TO_ID = {
+    "Happy": 0,
+    "Calm": 1,
+    "Neutral": 2,
+    "Sad": 3,
+    "Very Sad": 4,
+}
+
+# Mood names in model output (class index) order.
+MOODS = sorted(MOOD_TO_ID, key=MOOD_TO_ID.get)
+
+# Model input order; the scaler was fitted on columns in exactly this order.
+FEATURE_COLUMNS = ("danceability", "energy", "valence", "tempo", "loudness")
+
+_get_feature_values = itemgetter(*FEATURE_COLUMNS)
+
+# float32 | int8 | float16, see reduce_precision().
+MODEL_PRECISION = os.environ.get("PIPER_MODEL_PRECISION", "float32")
+
+
+class MoodClassifier(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.fc1 = nn.Linear(5, 64)
+        self.fc2 = nn.Linear(64, 32)
+        self.fc3 = nn.Linear(32, 5)
+        self.relu = nn.ReLU()
+        self.dropout = nn.Dropout(0.5)
+
+    def forward(self, x):
+        x = self.relu(self.fc1(x))
+        x = self.dropout(x)
+        x = self.relu(self.fc2(x))
+        x = self.dropout(x)
+        x = self.fc3(x)
+        return x
+
+
+class _Float16Inference(nn.Module):
+    """float16 copy of a model that takes and returns float32 tensors."""
+
+    def __init__(self, model: nn.Module):
+        super().__init__()
+        self.model = model.half()
+
+    def forward(self, x):
+        return self.model(x.half()).float()
+
+
+def reduce_precision(model: MoodClassifier, precision: str) -> nn.Module:
+    """Inference variant of a loaded float32 model.
+
+    - float32: the model as is
+    - int8: dynamically quantized Linear layers (int8 weights, activations
+      quantized per batch); needs a quantized engine (fbgemm/x86 or qnnpack)
+    - float16: float16 weights and activations, float32 in and out
+    """
+    if precision == "float32":
+        return model
+    if precision == "int8":
+        return torch.ao.quantization.quantize_dynamic(
+            model, {nn.Linear}, dtype=torch.qint8
+        )
+    if precision == "float16":
+        return _Float16Inference(model)
+    raise RuntimeError(f"Unsupported PIPER_MODEL_PRECISION: {precision}")
+
+
+def configure_torch_threads():
+    """Apply PIPER_TORCH_THREADS / PIPER_TORCH_INTEROP_THREADS.
+
+    "auto" (the default) means one thread each: the MLP is far too small to
+    gain from intra-op parallelism, and with torch's default of one thread per
+    core every concurrent request fans out across all cores and they contend.
+    Request concurrency comes from the server's threadpool instead.
+    """
+    intra = os.environ.get("PIPER_TORCH_THREADS", "auto")
+    interop = os.environ.get("PIPER_TORCH_INTEROP_THREADS", "auto")
+    torch.set_num_threads(1 if intra == "auto" else int(intra))
+    try:
+        torch.set_num_interop_threads(1 if interop == "auto" else int(interop))
+    except RuntimeError:
+        # Can only be set once per process, before any inter-op work; a
+        # pre-forked worker inherits the parent's setting.
+        pass
+
+
+class Artifacts(NamedTuple):
+    """A model and the scaler it was trained with, swapped as one unit."""
+
+    model: nn.Module
+    scaler: object
+    version: str
+
+
+def feature_matrix(
+    track_ids: list[str], features_by_id: dict[str, dict]
+) -> tuple[np.ndarray, list[str]]:
+    """Assemble the float32 (n, 5) model input for ``track_ids``.
+
+    Tracks without an audio-features payload, or whose payload has a missing or
+    non-numeric field, are dropped. The returned IDs are aligned with the rows
+    of the returned matrix.
+    """
+    n_cols = len(FEATURE_COLUMNS)
+    values: list[tuple] = []
+    ordered_ids: list[str] = []
+    for tid in track_ids:
+        f = features_by_id.get(tid)
+        if not f:
+            continue
+        try:
+            values.append(_get_feature_values(f))
+        except (KeyError, TypeError):
+            continue
+        ordered_ids.append(tid)
+
+    try:
+        X = np.fromiter(
+            chain.from_iterable(values),
+            dtype=np.float32,
+            count=len(values) * n_cols,
+        ).reshape(-1, n_cols)
+        # fromiter turns None into NaN instead of raising; recheck those rows.
+        if not np.isnan(X).any():
+            return X, ordered_ids
+    except (TypeError, ValueError):
+        pass
+
+    # Some payload carries a null/non-numeric value: fill row by row and mask.
+    X = np.empty((len(values), n_cols), dtype=np.float32)
+    valid = np.zeros(len(values), dtype=bool)
+    for i, row in enumerate(values):
+        try:
+            X[i] = [float(v) for v in row]
+        except (TypeError, ValueError):
+            continue
+        valid[i] = True
+    return X[valid], [tid for tid, ok in zip(ordered_ids, valid) if ok]
+
+
+def predict_moods(X: np.ndarray, art: Artifacts) -> np.ndarray:
+    """Mood probabilities (n, 5) for a float32 (n, 5) feature matrix.
+
+    Columns follow MOODS.
+    """
+    X_scaled = art.scaler.transform(X)
+    X_tensor = torch.tensor(X_scaled, dtype=torch.float32)
+
+    with torch.no_grad():
+        logits = art.model(X_tensor)
+        return torch.softmax(logits, dim=1).cpu().numpy()
+
+
+def artifact_version(model_path: str, scaler_path: str) -> str:
+    """Short content hash identifying a model + scaler pair."""
+    digest = hashlib.sha256()
+    for path in (model_path, scaler_path):
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+def precision_version(version: str, precision: str) -> str:
+    return version if precision == "float32" else f"{version}-{precision}"
+
+
+def read_artifacts(
+    model_path: str,
+    scaler_path: str,
+    version: Optional[str] = None,
+    precision: Optional[str] = None,
+) -> Artifacts:
+    """Load a model + scaler pair.
+
+    ``version`` defaults to their content hash; non-float32 ``precision``
+    (default MODEL_PRECISION) is appended to it, since reduced-precision
+    predictions can differ slightly.
+    """
+    precision = precision or MODEL_PRECISION
+    if not os.path.exists(model_path):
+        raise RuntimeError(f"Model file not found: {model_path}")
+    if not os.path.exists(scaler_path):
+        raise RuntimeError(f"Scaler file not found: {scaler_path}")
+
+    loaded_model = MoodClassifier()
+    loaded_model.load_state_dict(
+        torch.load(model_path, map_location="cpu", weights_only=True)
+    )
+    loaded_model.eval()
+
+    return Artifacts(
+        model=reduce_precision(loaded_model, precision),
+        scaler=joblib.load(scaler_path),
+        version=precision_version(
+            version or artifact_version(model_path, scaler_path), precision
+        ),
+    )
@@ -0,0 +1,173 @@
+"""Speculative prefetch of a user's candidates between login and first request.
+
+/prefetch is called right after the Spotify OAuth callback. It returns at once
+and, on a small thread pool, reads the user's top tracks, fetches their audio
+features and classifies them through the runtime (which also fills the mood
+index, where there is one). The result is stashed in memory for a few minutes
+under a hash of the access token; /recommendations then ranks straight from the
+stash, or waits for a prefetch that is still running rather than repeating it.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Literal
+
+from fastapi import HTTPException
+from pydantic import BaseModel, Field
+
+from piper_core.cache import user_key
+from piper_core.model import Artifacts
+from piper_core.service import (
+    RECOMMENDATIONS_DEADLINE_S,
+    PrefetchedTracks,
+    Runtime,
+)
+from piper_core.spotify import deadline, remaining_budget, top_track_ids
+
+# How long a prefetched user stays stashed; top tracks change slowly, but the
+# stash only has to bridge the gap between login and picking a mood.
+PREFETCH_TTL_S = float(os.environ.get("PIPER_PREFETCH_TTL_S", "300"))
+PREFETCH_MAX_ENTRIES = int(os.environ.get("PIPER_PREFETCH_MAX_ENTRIES", "1024"))
+PREFETCH_WORKERS = int(os.environ.get("PIPER_PREFETCH_WORKERS", "4"))
+# Prefetches queued or running beyond which new ones are dropped ("busy").
+PREFETCH_MAX_PENDING = int(os.environ.get("PIPER_PREFETCH_MAX_PENDING", "64"))
+# Share of a request's remaining deadline it may spend waiting for a running
+# prefetch of the same user, before doing the work itself.
+PREFETCH_MAX_WAIT_FRACTION = float(
+    os.environ.get("PIPER_PREFETCH_MAX_WAIT_FRACTION", "0.25")
+)
+
+logger = logging.getLogger("piper.prefetch")
+
+PrefetchStatus = Literal["started", "in_flight", "stashed", "busy"]
+
+
+class PrefetchRequest(BaseModel):
+    access_token: str = Field(min_length=1)
+
+
+class PrefetchResponse(BaseModel):
+    status: PrefetchStatus
+
+
+class Prefetcher:
+    """Per-process stash of prefetched users, keyed by access-token hash."""
+
+    def __init__(
+        self,
+        runtime: Runtime,
+        *,
+        ttl_s: float = PREFETCH_TTL_S,
+        max_entries: int = PREFETCH_MAX_ENTRIES,
+        max_workers: int = PREFETCH_WORKERS,
+        max_pending: int = PREFETCH_MAX_PENDING,
+        max_wait_fraction: float = PREFETCH_MAX_WAIT_FRACTION,
+    ):
+        self._runtime = runtime
+        self._max_wait_fraction = max_wait_fraction
+        self._ttl_s = ttl_s
+        self._max_entries = max_entries
+        self._max_pending = max_pending
+        self._lock = threading.Lock()
+        # key -> (stashed at, tracks), oldest first.
+        self._stash: OrderedDict[str, tuple[float, PrefetchedTracks]] = OrderedDict()
+        self._in_flight: dict[str, Future] = {}
+        self._pool = ThreadPoolExecutor(
+            max_workers=max(1, max_workers), thread_name_prefix="piper-prefetch"
+        )
+
+    def _fresh(self, key: str) -> PrefetchedTracks | None:
+        entry = self._stash.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > self._ttl_s:
+            del self._stash[key]
+            return None
+        return entry[1]
+
+    def start(self, access_token: str) -> PrefetchStatus:
+        key = user_key(access_token)
+        with self._lock:
+            if self._fresh(key) is not None:
+                return "stashed"
+            if key in self._in_flight:
+                return "in_flight"
+            # Speculative work: shed it rather than queue behind a burst.
+            if len(self._in_flight) >= self._max_pending:
+                return "busy"
+            self._in_flight[key] = self._pool.submit(self._run, key, access_token)
+        return "started"
+
+    def _run(self, key: str, access_token: str) -> PrefetchedTracks | None:
+        try:
+            art = self._runtime.current_artifacts()
+            if art is None:
+                return None
+            with deadline(RECOMMENDATIONS_DEADLINE_S):
+                track_ids = top_track_ids(access_token)
+                ordered_ids, preds, counts = self._runtime.classify_tracks(
+                    access_token, track_ids, art
+                )
+            moods = dict(zip(ordered_ids, preds))
+            retry_ids: list[str] = []
+            if counts.get("failed", 0) > counts.get("not_found", 0):
+                # Some failures were transient; the counts don't say which
+                # tracks, so the request retries every unclassified one.
+                retry_ids = [tid for tid in track_ids if tid not in moods]
+            tracks = PrefetchedTracks(
+                track_ids=track_ids,
+                moods=moods,
+                counts=counts,
+                version=art.version,
+                retry_ids=retry_ids,
+            )
+            with self._lock:
+                self._stash[key] = (time.monotonic(), tracks)
+                self._stash.move_to_end(key)
+                while len(self._stash) > self._max_entries:
+                    self._stash.popitem(last=False)
+            return tracks
+        except HTTPException:
+            # No top tracks, bad token, ...: the request reports it.
+            return None
+        except Exception:
+            logger.exception("Prefetch failed")
+            return None
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def get(self, access_token: str, art: Artifacts) -> PrefetchedTracks | None:
+        """The stashed candidates for this user and ``art``, if any.
+
+        A prefetch already running is waited for, up to ``max_wait_fraction``
+        of the caller's remaining deadline. One still queued behind other
+        prefetches is not: the caller does the work itself.
+        """
+        key = user_key(access_token)
+        with self._lock:
+            tracks = self._fresh(key)
+            future = self._in_flight.get(key) if tracks is None else None
+        if future is not None:
+            if not (future.running() or future.done()):
+                return None
+            budget = remaining_budget()
+            if budget is None:
+                budget = RECOMMENDATIONS_DEADLINE_S
+            try:
+                tracks = future.result(timeout=budget * self._max_wait_fraction)
+            except FutureTimeoutError:
+                return None
+        if tracks is None or tracks.version != art.version:
+            return None
+        return tracks
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
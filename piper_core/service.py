@@ -0,0 +1,655 @@
+"""The FastAPI app shared by every entry point, parameterised by a Runtime.
+
+The endpoints only reach the model and the Spotify data through the runtime,
+so the serverless entry (api/index.py) and the long-running service
+(ml_service/app.py) pick their own model loading, caching and pooling while
+sharing the request handling.
+"""
+
+from __future__ import annotations
+
+import os
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Any, Iterator, List, Literal, NamedTuple, Optional
+
+import numpy as np
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
+
+from piper_core import jsonio, spotify
+from piper_core.cache import recommendations_cache, user_key
+from piper_core.candidates import FeatureRows
+from piper_core.export import (
+    ExportTopTracksCsvRequest,
+    ExportTopTracksCsvResponse,
+    export_top_tracks_features,
+)
+from piper_core.model import (
+    FEATURE_COLUMNS,
+    MOOD_TO_ID,
+    MOODS,
+    Artifacts,
+    Mood,
+    feature_matrix,
+    predict_moods,
+)
+from piper_core.spotify import (
+    TRENDING_PLAYLIST_ID,
+    deadline,
+    dedupe_preserve_order,
+    iter_with_deadline,
+    spotify_get_playlist_tracks,
+    spotify_get_recommendations_tracks,
+    spotify_get_saved_tracks,
+    spotify_iter_audio_features,
+    top_track_ids,
+)
+
+# Latency budget for all Spotify calls made by one recommendations request,
+# retries and backoff included; 0 disables it.
+RECOMMENDATIONS_DEADLINE_S = float(
+    os.environ.get("PIPER_RECOMMENDATIONS_DEADLINE_S", "10")
+)
+
+
+# Cold-user candidate sources in priority order, as in getFallbackTrackIds
+# (next_web/src/app/api/playlists/route.ts).
+FALLBACK_SOURCES = ("liked_songs", "trending", "spotify_recommendations")
+
+# Seed genres for the Spotify recommendations fallback.
+FALLBACK_SEED_GENRES: dict[str, list[str]] = {
+    "Happy": ["pop", "dance", "edm"],
+    "Calm": ["chill", "acoustic", "ambient"],
+    "Neutral": ["pop", "indie", "rock"],
+    "Sad": ["acoustic", "ambient", "indie"],
+    "Very Sad": ["ambient", "acoustic", "indie"],
+}
+
+
+class RecommendationsRequest(BaseModel):
+    mood: Mood
+    access_token: str = Field(min_length=1)
+    limit: int = Field(default=20, ge=1, le=50)
+    # Without top tracks, rank candidates from FALLBACK_SOURCES instead of
+    # failing with no_top_tracks.
+    fallback: bool = False
+
+
+class RecommendationsResponse(BaseModel):
+    trackIds: List[str]
+    # FALLBACK_SOURCES entry the candidates came from, if not the top tracks.
+    fallbackSource: Optional[str] = None
+
+
+class InvalidateCacheRequest(BaseModel):
+    access_token: str = Field(min_length=1)
+
+
+# Users whose Spotify data one /recommendations/batch request fetches at once.
+BATCH_RECOMMENDATIONS_CONCURRENCY = int(
+    os.environ.get("PIPER_BATCH_RECOMMENDATIONS_CONCURRENCY", "8")
+)
+
+
+class BatchRecommendationsRequest(BaseModel):
+    requests: List[RecommendationsRequest] = Field(min_length=1, max_length=100)
+
+
+class BatchRecommendationsResult(BaseModel):
+    trackIds: List[str] = Field(default_factory=list)
+    fallbackSource: Optional[str] = None
+    # {status, detail} of the error /recommendations would have returned.
+    error: Optional[dict[str, Any]] = None
+
+
+class BatchRecommendationsResponse(BaseModel):
+    # One per request entry, in the same order.
+    results: List[BatchRecommendationsResult]
+
+
+class PrefetchedTracks(NamedTuple):
+    """A user's candidates, classified ahead of their request by /prefetch."""
+
+    track_ids: list[str]
+    # Mood id by track id, for the tracks that had audio features.
+    moods: dict[str, int]
+    # Audio-features counts of the fetch.
+    counts: dict[str, int]
+    # Artifacts version the moods were predicted with.
+    version: str
+    # Tracks whose audio features failed for a transient reason (rate limit,
+    # timeout, open breaker, ...); the request classifies them again.
+    retry_ids: list[str]
+
+
+def env_path(name: str, default_relative: str, base_dir: str) -> str:
+    """``$name`` if set, else ``default_relative`` under ``base_dir``."""
+    value = os.environ.get(name)
+    if value:
+        return value
+    return os.path.join(base_dir, default_relative)
+
+
+class Runtime(ABC):
+    """Deployment-specific behaviour behind the shared endpoints.
+
+    Subclasses load the artifacts in ``startup`` and must implement
+    ``current_artifacts`` and ``csv_path``; ``iter_classify_tracks``,
+    ``track_features``, ``score_tracks`` and ``predict`` default to fetching
+    audio features and running the model on every request.
+    """
+
+    def startup(self):
+        pass
+
+    @abstractmethod
+    def current_artifacts(self) -> Artifacts | None:
+        """The artifacts to serve with, or None until they are loaded."""
+
+    @abstractmethod
+    def csv_path(self) -> str:
+        """Where /export/top-tracks-features writes its CSV."""
+
+    def predict(self, X: np.ndarray, art: Artifacts) -> np.ndarray:
+        return predict_moods(X, art)
+
+    def iter_classify_tracks(
+        self,
+        access_token: str,
+        track_ids: list[str],
+        art: Artifacts,
+        counts: dict[str, int],
+    ) -> Iterator[tuple[list[str], list[int]]]:
+        """Yield (track ids, mood ids) as each batch of tracks is scored.
+
+        Tracks without usable audio features are left out; ``counts`` is
+        filled with the audio-features counts as fetching proceeds.
+        """
+        for features_by_id in spotify_iter_audio_features(
+            access_token, track_ids, counts, max_per_track_attempts=2
+        ):
+            X, ids = feature_matrix(list(features_by_id), features_by_id)
+            if ids:
+                yield ids, self.predict(X, art).argmax(axis=1).tolist()
+
+    def track_features(
+        self,
+        access_token: str,
+        track_ids: list[str],
+        art: Artifacts,
+        counts: dict[str, int],
+    ) -> tuple[dict[str, int], list[str], np.ndarray]:
+        """Split ``track_ids`` into known moods and tracks that need scoring.
+
+        Returns (mood id by track id for tracks that need no inference, ids
+        to score, their (n, 5) feature matrix), for callers that batch the
+        inference of several requests into one score_tracks call.
+        """
+        features = FeatureRows.from_chunks(
+            spotify_iter_audio_features(
+                access_token, track_ids, counts, max_per_track_attempts=2
+            )
+        )
+        X, ids = features.take()
+        return {}, ids, X
+
+    def score_tracks(
+        self, track_ids: list[str], X: np.ndarray, art: Artifacts
+    ) -> list[int]:
+        """Mood ids for the rows of ``X`` (features of ``track_ids``)."""
+        return self.predict(X, art).argmax(axis=1).tolist()
+
+    def prefetched_tracks(
+        self, access_token: str, art: Artifacts
+    ) -> PrefetchedTracks | None:
+        """The user's candidates as classified by /prefetch with ``art``.
+
+        None unless the runtime keeps a prefetch stash (ml_service does).
+        """
+        return None
+
+    def classify_tracks(
+        self, access_token: str, track_ids: list[str], art: Artifacts
+    ) -> tuple[list[str], list[int], dict[str, int]]:
+        """Predict a mood for every track that has audio features.
+
+        Returns (ordered_ids, mood ids, audio-features counts); ordered_ids
+        keeps the order of ``track_ids`` minus tracks without usable features.
+        """
+        counts: dict[str, int] = {}
+        mood_by_id: dict[str, int] = {}
+        for ids, moods in self.iter_classify_tracks(
+            access_token, track_ids, art, counts
+        ):
+            mood_by_id.update(zip(ids, moods))
+        ordered_ids = [tid for tid in track_ids if tid in mood_by_id]
+        return ordered_ids, [mood_by_id[tid] for tid in ordered_ids], counts
+
+
+def require_artifacts(runtime: Runtime, response: Response) -> Artifacts:
+    art = runtime.current_artifacts()
+    if art is None:
+        raise HTTPException(status_code=500, detail="model_not_loaded")
+    response.headers["X-Model-Version"] = art.version
+    return art
+
+
+def _fallback_recommendations(access_token: str, mood: str) -> list[dict]:
+    try:
+        return spotify_get_recommendations_tracks(
+            access_token, limit=50, seed_genres=FALLBACK_SEED_GENRES[mood]
+        )
+    except HTTPException as e:
+        if e.status_code in (401, 403):
+            raise
+    # One more attempt with a conservative seed list.
+    try:
+        return spotify_get_recommendations_tracks(
+            access_token, limit=50, seed_genres=["pop"], market="from_token"
+        )
+    except HTTPException:
+        return []
+
+
+def fallback_track_ids(access_token: str, mood: str) -> tuple[list[str], str | None]:
+    """Candidates for a user without top tracks, and the source they came from.
+
+    All FALLBACK_SOURCES are fetched concurrently and the first one in
+    priority order with tracks wins. As in the web app's chain, a 401/403 from
+    a source ahead of the winner is raised and other errors skip the source.
+    """
+    fetchers = {
+        "liked_songs": lambda: spotify_get_saved_tracks(access_token, limit=50),
+        "trending": lambda: spotify_get_playlist_tracks(
+            access_token, TRENDING_PLAYLIST_ID, limit=50, track_fields="id"
+        ),
+        "spotify_recommendations": lambda: _fallback_recommendations(
+            access_token, mood
+        ),
+    }
+    pool = ThreadPoolExecutor(max_workers=len(fetchers))
+    try:
+        # Each fetch runs in a copy of the caller's context, so it spends the
+        # caller's deadline budget.
+        futures = {
+            name: pool.submit(copy_context().run, fetch)
+            for name, fetch in fetchers.items()
+        }
+        for name in FALLBACK_SOURCES:
+            try:
+                tracks = futures[name].result()
+            except HTTPException as e:
+                if e.status_code in (401, 403):
+                    raise
+                continue
+            track_ids = dedupe_preserve_order([t["id"] for t in tracks])
+            if track_ids:
+                return track_ids, name
+    finally:
+        # Lower-priority fetches still running are not waited for.
+        pool.shutdown(wait=False)
+    return [], None
+
+
+def candidate_track_ids(req: RecommendationsRequest) -> tuple[list[str], str | None]:
+    """The user's top track IDs, or fallback candidates if req.fallback is set.
+
+    Returns (track ids, fallback source or None).
+    """
+    try:
+        return top_track_ids(req.access_token), None
+    except HTTPException as e:
+        if not req.fallback or e.detail not in ("no_top_tracks", "no_track_ids"):
+            raise
+        track_ids, source = fallback_track_ids(req.access_token, req.mood)
+        if not track_ids:
+            raise
+        return track_ids, source
+
+
+def rank_tracks(
+    req: RecommendationsRequest,
+    track_ids: list[str],
+    ordered_ids: list[str],
+    preds: list[int],
+    counts: dict[str, int],
+) -> list[str]:
+    """Up to req.limit candidates, those predicted as req.mood first."""
+    if not ordered_ids:
+        # NOTE: CSV-based fallback is intentionally disabled.
+        # In deployment we won't have a local CSV, and using a shared CSV can
+        # accidentally serve stale/other-user data.
+        #
+        # If audio-features are unavailable, return candidate tracks directly so
+        # the caller can still create a playlist.
+        fetched = counts.get("batch_ok", 0) + counts.get("per_track_ok", 0)
+        if counts.get("unauthorized", 0) > 0 and fetched == 0:
+            raise HTTPException(
+                status_code=401,
+                detail="audio_features:spotify_token_invalid",
+            )
+        return track_ids[: req.limit]
+
+    target = MOOD_TO_ID[req.mood]
+    picked = [tid for tid, pred in zip(ordered_ids, preds) if pred == target]
+
+    # Fill to req.limit with remaining candidates so we don't create tiny playlists.
+    if len(picked) < req.limit:
+        picked_set = set(picked)
+        picked.extend([tid for tid in ordered_ids if tid not in picked_set])
+
+    return picked[: req.limit]
+
+
+def classify_stashed(
+    runtime: Runtime, access_token: str, stashed: PrefetchedTracks, art: Artifacts
+) -> tuple[list[str], list[int], dict[str, int]]:
+    """classify_tracks for a prefetched user, retrying only stashed.retry_ids."""
+    moods, counts = stashed.moods, stashed.counts
+    if stashed.retry_ids:
+        ids, preds, counts = runtime.classify_tracks(
+            access_token, stashed.retry_ids, art
+        )
+        moods = {**moods, **dict(zip(ids, preds))}
+    ordered_ids = [tid for tid in stashed.track_ids if tid in moods]
+    return ordered_ids, [moods[tid] for tid in ordered_ids], counts
+
+
+def recommendations(
+    runtime: Runtime,
+    req: RecommendationsRequest,
+    response: Response,
+    *,
+    use_cache: bool = True,
+) -> RecommendationsResponse:
+    """Rank the user's candidates for req.mood, through recommendations_cache.
+
+    A request identical to one answered by the same model version within the
+    cache TTL (same user, mood, limit and fallback flag) is served from the
+    cache; degraded answers are not stored. ``X-Cache`` reports HIT, MISS or BYPASS (``use_cache`` false or the
+    cache disabled); a bypassed request still refreshes the cached response.
+    """
+    art = require_artifacts(runtime, response)
+    key = (user_key(req.access_token), req.mood, req.limit, req.fallback)
+    if use_cache and recommendations_cache.enabled:
+        cached = recommendations_cache.get(key, art.version)
+        if cached is not None:
+            response.headers["X-Cache"] = "HIT"
+            return cached
+        response.headers["X-Cache"] = "MISS"
+    else:
+        response.headers["X-Cache"] = "BYPASS"
+
+    with deadline(RECOMMENDATIONS_DEADLINE_S):
+        stashed = runtime.prefetched_tracks(req.access_token, art)
+        if stashed is not None:
+            track_ids, source = stashed.track_ids, None
+            ordered_ids, preds, counts = classify_stashed(
+                runtime, req.access_token, stashed, art
+            )
+        else:
+            track_ids, source = candidate_track_ids(req)
+            ordered_ids, preds, counts = runtime.classify_tracks(
+                req.access_token, track_ids, art
+            )
+
+    result = RecommendationsResponse(
+        trackIds=rank_tracks(req, track_ids, ordered_ids, preds, counts),
+        fallbackSource=source,
+    )
+    # A degraded answer (unranked, or ranked without the tracks whose audio
+    # features failed, ran out of deadline or hit the open breaker) is not
+    # cached; a 404 is permanent, so those alone don't count.
+    degraded = (
+        not ordered_ids
+        or counts.get("circuit_open", 0) > 0
+        or counts.get("failed", 0) > counts.get("not_found", 0)
+    )
+    if not degraded:
+        recommendations_cache.put(key, art.version, result)
+    return result
+
+
+def batch_recommendations(
+    runtime: Runtime, req: BatchRecommendationsRequest, response: Response
+) -> BatchRecommendationsResponse:
+    """/recommendations for many users, with a single inference pass.
+
+    Each entry's Spotify data is fetched on a pool of
+    BATCH_RECOMMENDATIONS_CONCURRENCY threads, each entry with its own
+    deadline; with PIPER_SPOTIFY_MAX_RPS set, their requests share the
+    process-wide spotify.rate_limiter with every other endpoint. The tracks that need scoring, across all entries and each
+    once, then go through one score_tracks call. Errors are per entry.
+    """
+    art = require_artifacts(runtime, response)
+
+    def fetch(entry: RecommendationsRequest):
+        counts: dict[str, int] = {}
+        with deadline(RECOMMENDATIONS_DEADLINE_S):
+            stashed = runtime.prefetched_tracks(entry.access_token, art)
+            if stashed is not None:
+                if not stashed.retry_ids:
+                    return (
+                        stashed.track_ids,
+                        None,
+                        stashed.counts,
+                        stashed.moods,
+                        [],
+                        np.empty((0, len(FEATURE_COLUMNS)), dtype=np.float32),
+                    )
+                known, ids, X = runtime.track_features(
+                    entry.access_token, stashed.retry_ids, art, counts
+                )
+                return (
+                    stashed.track_ids,
+                    None,
+                    counts,
+                    {**stashed.moods, **known},
+                    ids,
+                    X,
+                )
+            track_ids, source = candidate_track_ids(entry)
+            known, ids, X = runtime.track_features(
+                entry.access_token, track_ids, art, counts
+            )
+        return track_ids, source, counts, known, ids, X
+
+    workers = max(1, min(BATCH_RECOMMENDATIONS_CONCURRENCY, len(req.requests)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(fetch, entry) for entry in req.requests]
+    fetched: list[tuple | HTTPException] = []
+    for future in futures:
+        try:
+            fetched.append(future.result())
+        except HTTPException as e:
+            fetched.append(e)
+
+    score_ids: list[str] = []
+    blocks: list[np.ndarray] = []
+    seen: set[str] = set()
+    for item in fetched:
+        if isinstance(item, HTTPException):
+            continue
+        _, _, _, _, ids, X = item
+        rows = [i for i, tid in enumerate(ids) if tid not in seen]
+        seen.update(ids)
+        score_ids.extend(ids[i] for i in rows)
+        blocks.append(X[rows])
+    scored: dict[str, int] = {}
+    if score_ids:
+        scored = dict(
+            zip(score_ids, runtime.score_tracks(score_ids, np.concatenate(blocks), art))
+        )
+
+    results: list[BatchRecommendationsResult] = []
+    for entry, item in zip(req.requests, fetched):
+        try:
+            if isinstance(item, HTTPException):
+                raise item
+            track_ids, source, counts, known, _, _ = item
+            ordered_ids = [tid for tid in track_ids if tid in known or tid in scored]
+            preds = [known.get(tid, scored.get(tid)) for tid in ordered_ids]
+            ranked = rank_tracks(entry, track_ids, ordered_ids, preds, counts)
+        except HTTPException as e:
+            results.append(
+                BatchRecommendationsResult(
+                    error={"status": e.status_code, "detail": e.detail}
+                )
+            )
+            continue
+        results.append(
+            BatchRecommendationsResult(trackIds=ranked, fallbackSource=source)
+        )
+    return BatchRecommendationsResponse(results=results)
+
+
+StreamFormat = Literal["ndjson", "sse"]
+
+STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+
+def _stream_event(fmt: str, event: str, data: dict) -> str:
+    if fmt == "sse":
+        return f"event: {event}\ndata: {jsonio.dumps(data)}\n\n"
+    return jsonio.dumps({"event": event, **data}) + "\n"
+
+
+def _iter_recommendation_events(
+    runtime: Runtime,
+    req: RecommendationsRequest,
+    art: Artifacts,
+    track_ids: list[str],
+    source: str | None,
+    fmt: str,
+) -> Iterator[str]:
+    target = MOOD_TO_ID[req.mood]
+    counts: dict[str, int] = {}
+    mood_by_id: dict[str, int] = {}
+    try:
+        for ids, moods in runtime.iter_classify_tracks(
+            req.access_token, track_ids, art, counts
+        ):
+            mood_by_id.update(zip(ids, moods))
+            yield _stream_event(
+                fmt,
+                "tracks",
+                {
+                    "trackIds": [t for t, m in zip(ids, moods) if m == target],
+                    "moods": {t: MOODS[m] for t, m in zip(ids, moods)},
+                },
+            )
+        ordered_ids = [tid for tid in track_ids if tid in mood_by_id]
+        ranked = rank_tracks(
+            req,
+            track_ids,
+            ordered_ids,
+            [mood_by_id[tid] for tid in ordered_ids],
+            counts,
+        )
+    except HTTPException as e:
+        # Too late for an HTTP status: report the error as the last event.
+        yield _stream_event(fmt, "error", {"status": e.status_code, "detail": e.detail})
+        return
+    yield _stream_event(fmt, "done", {"trackIds": ranked, "fallbackSource": source})
+
+
+def recommendations_stream(
+    runtime: Runtime, req: RecommendationsRequest, fmt: StreamFormat
+) -> StreamingResponse:
+    """Progressive /recommendations.
+
+    Emits a ``tracks`` event for each batch of tracks as it is scored (the
+    batch's tracks predicted as req.mood, plus every scored track's mood),
+    then a ``done`` event with the same list /recommendations returns, or an
+    ``error`` event if scoring fails after the stream has started.
+    """
+    art = runtime.current_artifacts()
+    if art is None:
+        raise HTTPException(status_code=500, detail="model_not_loaded")
+    # Top tracks are fetched up front so that token/scope errors still get an
+    # HTTP status; the stream spends what is left of the same budget.
+    with deadline(RECOMMENDATIONS_DEADLINE_S):
+        track_ids, source = candidate_track_ids(req)
+        events = iter_with_deadline(
+            _iter_recommendation_events(runtime, req, art, track_ids, source, fmt)
+        )
+
+    return StreamingResponse(
+        events,
+        media_type=STREAM_MEDIA_TYPES[fmt],
+        headers={
+            "X-Model-Version": art.version,
+            "Cache-Control": "no-cache",
+            # Keep reverse proxies (nginx) from buffering the events.
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+def create_app(runtime: Runtime) -> FastAPI:
+    """FastAPI app with the shared endpoints, backed by ``runtime``.
+
+    Entry points add their own routes and middleware to the returned app.
+    """
+    app = FastAPI(
+        title="PIPER ML Service",
+        version="0.1.0",
+        default_response_class=(
+            jsonio.FastJSONResponse if jsonio.FAST_JSON else JSONResponse
+        ),
+    )
+    app.state.runtime = runtime
+
+    @app.on_event("startup")
+    def _startup():
+        runtime.startup()
+
+    @app.get("/health")
+    def health():
+        art = runtime.current_artifacts()
+        body = {
+            "ok": True,
+            "modelVersion": art.version if art else None,
+            "audioFeaturesCircuit": spotify.audio_features_breaker.stats(),
+        }
+        if spotify.hedger is not None:
+            body["spotifyHedging"] = spotify.hedger.stats()
+        if spotify.rate_limiter is not None:
+            body["spotifyRateLimit"] = spotify.rate_limiter.stats()
+        return body
+
+    @app.post("/export/top-tracks-features", response_model=ExportTopTracksCsvResponse)
+    def export_top_tracks(req: ExportTopTracksCsvRequest):
+        return export_top_tracks_features(req, runtime.csv_path())
+
+    @app.post("/recommendations", response_model=RecommendationsResponse)
+    def recommend(
+        req: RecommendationsRequest,
+        response: Response,
+        cache_control: Optional[str] = Header(default=None),
+    ):
+        use_cache = "no-cache" not in (cache_control or "").lower()
+        return jsonio.model_response(
+            recommendations(runtime, req, response, use_cache=use_cache), response
+        )
+
+    @app.post("/recommendations/cache/invalidate")
+    def invalidate_recommendations_cache(req: InvalidateCacheRequest):
+        """Drop the cached /recommendations responses of this user."""
+        invalidated = recommendations_cache.invalidate_user(user_key(req.access_token))
+        return {"ok": True, "invalidated": invalidated}
+
+    @app.post("/recommendations/batch", response_model=BatchRecommendationsResponse)
+    def recommend_batch(req: BatchRecommendationsRequest, response: Response):
+        return jsonio.model_response(
+            batch_recommendations(runtime, req, response), response
+        )
+
+    @app.post("/recommendations/stream")
+    def recommend_stream(req: RecommendationsRequest, format: StreamFormat = "ndjson"):
+        return recommendations_stream(runtime, req, format)
+
+    return app
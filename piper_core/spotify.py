@@ -0,0 +1,904 @@
+"""Spotify Web API helpers shared by every runtime.
+
+Errors surface as HTTPException with a ``<path>:<reason>`` detail so endpoints
+can let them propagate to the client unchanged. Every GET goes through
+spotify_get, which retries transient failures within the caller's deadline
+budget (see deadline()).
+"""
+
+from __future__ import annotations
+
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from typing import Iterator, List, Optional
+
+import requests
+from fastapi import HTTPException
+
+from piper_core.jsonio import response_json
+
+SPOTIFY_API_BASE_URL = "https://api.spotify.com/v1"
+
+TRENDING_PLAYLIST_ID = "37i9dQZF1DXbVhgADFy3im"
+
+# Per-attempt HTTP timeout; shortened to whatever is left of the deadline.
+SPOTIFY_TIMEOUT_S = float(os.environ.get("PIPER_SPOTIFY_TIMEOUT_S", "20"))
+SPOTIFY_MAX_RETRIES = int(os.environ.get("PIPER_SPOTIFY_MAX_RETRIES", "3"))
+# Full-jitter exponential backoff: attempt n sleeps uniform(0, base * 2**n),
+# capped at SPOTIFY_BACKOFF_MAX_S (Retry-After, if longer, wins up to 30 s).
+SPOTIFY_BACKOFF_BASE_S = float(os.environ.get("PIPER_SPOTIFY_BACKOFF_BASE_S", "0.25"))
+SPOTIFY_BACKOFF_MAX_S = float(os.environ.get("PIPER_SPOTIFY_BACKOFF_MAX_S", "4"))
+
+_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Absolute time.monotonic() by which the current request's Spotify calls must
+# finish; None means unbounded.
+_deadline: ContextVar[Optional[float]] = ContextVar("spotify_deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds: Optional[float]) -> Iterator[None]:
+    """Bound all Spotify calls made inside the block to ``seconds`` in total.
+
+    Nested budgets can only shorten the enclosing one. The budget lives in a
+    context variable, so work handed to other threads must be run in a copy of
+    the caller's context (contextvars.copy_context()) to inherit it. ``None``
+    or a non-positive value leaves the current budget unchanged.
+    """
+    if not seconds or seconds <= 0:
+        yield
+        return
+    end = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(end if current is None else min(current, end))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def iter_with_deadline(iterator: Iterator) -> Iterator:
+    """Advance ``iterator`` under the deadline in effect when this is called.
+
+    A streaming response resumes its generator from worker threads, each time
+    in a fresh copy of the request context, so a deadline() set around the
+    response would not reach the generator and one set inside it would not
+    survive a yield. Every step here runs in one snapshot of the caller's
+    context instead.
+    """
+    # Captured now: a generator body would only run on the first next().
+    context = copy_context()
+
+    def steps() -> Iterator:
+        while True:
+            try:
+                item = context.run(next, iterator)
+            except StopIteration:
+                return
+            yield item
+
+    return steps()
+
+
+def remaining_budget() -> Optional[float]:
+    """Seconds left in the current deadline, or None without one."""
+    end = _deadline.get()
+    return None if end is None else end - time.monotonic()
+
+
+# Process-wide cap on Spotify requests per second (0 = off), shared by every
+# endpoint, batch entry, retry and hedge in this process. Bursts of up to one
+# second's worth are let through at once.
+SPOTIFY_MAX_RPS = float(os.environ.get("PIPER_SPOTIFY_MAX_RPS", "0"))
+
+
+class RateLimiter:
+    """Token bucket pacing requests to ``rate`` per second, ``burst`` at once.
+
+    A caller that has to wait reserves its slot before sleeping, so waiters
+    are served in arrival order and the rate holds however many threads ask.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = max(1.0, burst if burst is not None else rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "delayed": 0, "denied": 0}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "maxRps": self.rate}
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """Take a slot, waiting up to ``timeout`` seconds (None: as long as needed).
+
+        Returns False, without taking a slot, when the wait would be longer.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            wait_s = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+            if timeout is not None and wait_s > timeout:
+                self._stats["denied"] += 1
+                return False
+            self._tokens -= 1
+            self._stats["requests"] += 1
+            if wait_s > 0:
+                self._stats["delayed"] += 1
+        if wait_s > 0:
+            time.sleep(wait_s)
+        return True
+
+
+rate_limiter: RateLimiter | None = (
+    RateLimiter(SPOTIFY_MAX_RPS) if SPOTIFY_MAX_RPS > 0 else None
+)
+
+
+# Hedging, off unless PIPER_SPOTIFY_HEDGE_PERCENTILE is set (e.g. 95): a
+# hedged GET still running after that percentile of recent latencies gets a
+# duplicate and the first response wins. Only single-request, idempotent reads
+# opt in (spotify_get(..., hedge=True)); pages and ids batches do not. Hedges
+# are capped at PIPER_SPOTIFY_HEDGE_MAX_RATIO of all requests.
+SPOTIFY_HEDGE_PERCENTILE = float(os.environ.get("PIPER_SPOTIFY_HEDGE_PERCENTILE", "0"))
+SPOTIFY_HEDGE_MAX_RATIO = float(os.environ.get("PIPER_SPOTIFY_HEDGE_MAX_RATIO", "0.1"))
+SPOTIFY_HEDGE_THREADS = int(os.environ.get("PIPER_SPOTIFY_HEDGE_THREADS", "64"))
+
+
+class RequestHedger:
+    """Sends a backup GET when the first one is slower than usual.
+
+    The hedge delay is the ``percentile`` of recent request latencies
+    (``min_delay_s`` until ``min_samples`` are in). Extra load is bounded by a
+    token bucket: every request earns ``max_ratio`` tokens, up to ``burst``,
+    and every hedge spends one. A hedge also needs a free slot of the
+    process-wide rate_limiter, if there is one; it never waits for one. The
+    losing request is not cancelled (requests can't be), it finishes in the
+    background within its own timeout.
+    """
+
+    def __init__(
+        self,
+        percentile: float,
+        max_ratio: float,
+        *,
+        max_workers: int = 64,
+        window: int = 512,
+        min_samples: int = 20,
+        min_delay_s: float = 0.05,
+        burst: float = 10.0,
+    ):
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+        self.min_delay_s = min_delay_s
+        self.burst = burst
+        self._latencies: deque[float] = deque(maxlen=window)
+        self._since_update = 0
+        self._delay_s = min_delay_s
+        self._tokens = burst
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="spotify-hedge"
+        )
+        self._stats = {"requests": 0, "hedged": 0, "hedgeWins": 0, "budgetDenied": 0}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "delayMs": round(self._delay_s * 1e3, 1)}
+
+    def _record(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+            self._since_update += 1
+            if len(self._latencies) < self.min_samples or self._since_update < 16:
+                return
+            self._since_update = 0
+            ordered = sorted(self._latencies)
+            rank = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+            self._delay_s = max(self.min_delay_s, ordered[rank])
+
+    def _timed_get(
+        self, url: str, kwargs: dict, submitted_at: float
+    ) -> requests.Response:
+        res = requests.get(url, **kwargs)
+        # From submission, so time queued for a pool thread counts too.
+        self._record(time.monotonic() - submitted_at)
+        return res
+
+    def _try_hedge(self) -> bool:
+        with self._lock:
+            if self._tokens < 1 or (
+                rate_limiter is not None and not rate_limiter.acquire(timeout=0)
+            ):
+                self._stats["budgetDenied"] += 1
+                return False
+            self._tokens -= 1
+            self._stats["hedged"] += 1
+            return True
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        with self._lock:
+            self._stats["requests"] += 1
+            self._tokens = min(self.burst, self._tokens + self.max_ratio)
+            delay = self._delay_s
+
+        primary = self._pool.submit(self._timed_get, url, kwargs, time.monotonic())
+        pending: set[Future] = {primary}
+        done, _ = wait(pending, timeout=min(delay, kwargs.get("timeout") or delay))
+        if not done and self._try_hedge():
+            pending.add(
+                self._pool.submit(self._timed_get, url, kwargs, time.monotonic())
+            )
+
+        # The first response wins; a transport error only counts once every
+        # attempt has failed.
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    res = future.result()
+                except requests.RequestException as e:
+                    error = error or e
+                    continue
+                if future is not primary:
+                    with self._lock:
+                        self._stats["hedgeWins"] += 1
+                return res
+        raise error
+
+
+hedger: RequestHedger | None = (
+    RequestHedger(
+        SPOTIFY_HEDGE_PERCENTILE,
+        SPOTIFY_HEDGE_MAX_RATIO,
+        max_workers=SPOTIFY_HEDGE_THREADS,
+    )
+    if SPOTIFY_HEDGE_PERCENTILE > 0
+    else None
+)
+
+
+def _http_get(url: str, *, hedge: bool = False, **kwargs) -> requests.Response:
+    if hedger is None or not hedge:
+        return requests.get(url, **kwargs)
+    return hedger.get(url, **kwargs)
+
+
+def _error_message(res: requests.Response) -> Optional[str]:
+    try:
+        payload = response_json(res)
+        return (
+            payload.get("error", {}).get("message")
+            if isinstance(payload, dict)
+            else None
+        )
+    except Exception:
+        return None
+
+
+def _response_error(res: requests.Response, path: str) -> HTTPException:
+    """Map a failed Spotify response to the HTTPException we surface."""
+    trace_id = res.headers.get("sp-trace-id")
+    if res.status_code == 401:
+        return HTTPException(status_code=401, detail=f"{path}:spotify_token_invalid")
+    if res.status_code == 403:
+        # Spotify 403 can be either missing scopes or the account not being added
+        # to the app's User Management list (when the Spotify app is in dev mode).
+        www_auth = (res.headers.get("www-authenticate") or "").lower()
+        message = _error_message(res)
+
+        lowered = (message or "").lower()
+        if "insufficient_scope" in www_auth:
+            return HTTPException(
+                status_code=403, detail=f"{path}:spotify_insufficient_scope"
+            )
+        if "invalid_token" in www_auth:
+            return HTTPException(
+                status_code=401, detail=f"{path}:spotify_token_invalid"
+            )
+        if "insufficient" in lowered and "scope" in lowered:
+            return HTTPException(
+                status_code=403, detail=f"{path}:spotify_insufficient_scope"
+            )
+        if "not registered" in lowered or "user not registered" in lowered:
+            return HTTPException(
+                status_code=403, detail=f"{path}:spotify_user_not_registered"
+            )
+
+        short = (message or res.text or res.reason)[:300]
+        extras: list[str] = []
+        if trace_id:
+            extras.append(f"sp-trace-id: {trace_id}")
+        if www_auth:
+            extras.append(f"www-authenticate: {www_auth[:300]}")
+        if extras:
+            short = f"{short} | " + " | ".join(extras)
+        return HTTPException(
+            status_code=403, detail=f"{path}:spotify_forbidden:{short}"
+        )
+    if res.status_code == 429:
+        return HTTPException(status_code=429, detail="spotify_rate_limited")
+
+    short = (_error_message(res) or res.text or res.reason)[:300]
+    if trace_id:
+        short = f"{short} | sp-trace-id: {trace_id}"
+    return HTTPException(
+        status_code=502, detail=f"spotify_error:{res.status_code}:{short}"
+    )
+
+
+def _retry_after_s(res: requests.Response) -> Optional[float]:
+    value = res.headers.get("retry-after") or res.headers.get("Retry-After")
+    try:
+        return min(float(value), 30.0) if value else None
+    except ValueError:
+        return None
+
+
+def spotify_get(
+    access_token: str,
+    path: str,
+    params: Optional[dict] = None,
+    *,
+    max_retries: int = SPOTIFY_MAX_RETRIES,
+    hedge: bool = False,
+):
+    """GET a Spotify Web API path, retrying transient failures.
+
+    429, 5xx, timeouts and connection errors are retried up to ``max_retries``
+    times with full-jitter exponential backoff (honouring Retry-After). No
+    attempt or sleep runs past the current deadline(): once the budget is
+    spent the last failure is raised, or 504 ``spotify_deadline_exceeded`` if
+    there was none. Other errors are raised immediately. ``hedge`` sends the
+    GET through the hedger, if hedging is on. Every attempt first waits for a
+    rate_limiter slot, if PIPER_SPOTIFY_MAX_RPS is set; one that would not
+    come within the budget counts as the budget being spent.
+    """
+    failure: Optional[HTTPException] = None
+    for attempt in range(max_retries + 1):
+        remaining = remaining_budget()
+        if remaining is not None and remaining <= 0:
+            break
+        if rate_limiter is not None:
+            if not rate_limiter.acquire(timeout=remaining):
+                break
+            remaining = remaining_budget()
+            if remaining is not None and remaining <= 0:
+                break
+
+        retry_after = None
+        try:
+            res = _http_get(
+                f"{SPOTIFY_API_BASE_URL}{path}",
+                hedge=hedge,
+                headers={"Authorization": f"Bearer {access_token}"},
+                params=params,
+                timeout=(
+                    SPOTIFY_TIMEOUT_S
+                    if remaining is None
+                    else min(SPOTIFY_TIMEOUT_S, remaining)
+                ),
+            )
+        except requests.Timeout:
+            failure = HTTPException(status_code=504, detail=f"{path}:spotify_timeout")
+        except requests.ConnectionError:
+            failure = HTTPException(
+                status_code=502, detail=f"{path}:spotify_unreachable"
+            )
+        else:
+            if res.ok:
+                return response_json(res)
+            failure = _response_error(res, path)
+            if res.status_code not in _RETRY_STATUSES:
+                raise failure
+            retry_after = _retry_after_s(res)
+
+        if attempt == max_retries:
+            break
+        delay = random.uniform(
+            0, min(SPOTIFY_BACKOFF_MAX_S, SPOTIFY_BACKOFF_BASE_S * 2**attempt)
+        )
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        remaining = remaining_budget()
+        if remaining is not None and delay >= remaining:
+            break
+        time.sleep(delay)
+
+    if failure is not None:
+        raise failure
+    raise HTTPException(status_code=504, detail=f"{path}:spotify_deadline_exceeded")
+
+
+def dedupe_preserve_order(values: list[str]) -> list[str]:
+    seen: set[str] = set()
+    out: list[str] = []
+    for v in values:
+        if not v:
+            continue
+        if v in seen:
+            continue
+        seen.add(v)
+        out.append(v)
+    return out
+
+
+# Spotify accepts a ``fields`` projection only on the playlist endpoints. Other
+# track lists come back whole (album, images, external IDs, ...), so they are
+# cut down to _slim_track as each page is parsed. Passing ``market`` where an
+# endpoint takes it also drops the ``available_markets`` lists of every track
+# and album, the bulk of a track object.
+PLAYLIST_TRACK_FIELDS = "id,name,artists(name)"
+
+
+def _slim_track(track) -> Optional[dict]:
+    """A track object reduced to its id, name and artist names; None without an id."""
+    if not isinstance(track, dict):
+        return None
+    tid = track.get("id")
+    if not isinstance(tid, str) or not tid:
+        return None
+    artists = track.get("artists")
+    return {
+        "id": tid,
+        "name": track.get("name"),
+        "artists": (
+            [
+                {"name": a.get("name")}
+                for a in artists
+                if isinstance(a, dict) and isinstance(a.get("name"), str)
+            ]
+            if isinstance(artists, list)
+            else []
+        ),
+    }
+
+
+def _slim_tracks(items) -> list[dict]:
+    if not isinstance(items, list):
+        return []
+    return [t for t in map(_slim_track, items) if t is not None]
+
+
+def spotify_get_top_tracks(
+    access_token: str, *, limit: int, time_range: str
+) -> list[dict]:
+    """Page through /me/top/tracks (50 per request) until ``limit`` tracks.
+
+    The endpoint takes neither ``fields`` nor ``market``; each page is slimmed
+    as it arrives.
+    """
+    tracks: list[dict] = []
+    offset = 0
+    while len(tracks) < limit:
+        page = spotify_get(
+            access_token,
+            "/me/top/tracks",
+            params={
+                "limit": min(50, limit - len(tracks)),
+                "offset": offset,
+                "time_range": time_range,
+            },
+        )
+
+        items = page.get("items")
+        if not isinstance(items, list) or len(items) == 0:
+            break
+        tracks.extend(_slim_tracks(items))
+
+        if not page.get("next"):
+            break
+        offset += len(items)
+
+    return tracks[:limit]
+
+
+def spotify_get_playlist_tracks(
+    access_token: str,
+    playlist_id: str,
+    *,
+    limit: int,
+    track_fields: str = PLAYLIST_TRACK_FIELDS,
+) -> list[dict]:
+    """Return playlist item.track dicts holding only ``track_fields``.
+
+    Callers that only need IDs pass ``track_fields="id"``.
+    """
+    target = max(0, min(200, int(limit)))
+    if target == 0:
+        return []
+
+    tracks: list[dict] = []
+    offset = 0
+    while len(tracks) < target:
+        page = spotify_get(
+            access_token,
+            f"/playlists/{playlist_id}/tracks",
+            params={
+                "limit": 50,
+                "offset": offset,
+                "fields": f"items(track({track_fields})),next",
+            },
+        )
+
+        items = page.get("items")
+        if not isinstance(items, list) or len(items) == 0:
+            break
+
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            track = item.get("track")
+            if not isinstance(track, dict):
+                continue
+            tid = track.get("id")
+            if isinstance(tid, str) and tid:
+                tracks.append(track)
+            if len(tracks) >= target:
+                break
+
+        if not page.get("next"):
+            break
+        offset += 50
+
+    return tracks[:target]
+
+
+def spotify_get_saved_tracks(access_token: str, *, limit: int) -> list[dict]:
+    """Return the user's Liked Songs as track dicts (id/name/artists).
+
+    /me/tracks ignores ``fields``; ``market=from_token`` drops the market lists
+    and the rest is slimmed per page.
+    """
+    target = max(0, min(200, int(limit)))
+    tracks: list[dict] = []
+    offset = 0
+    while len(tracks) < target:
+        page = spotify_get(
+            access_token,
+            "/me/tracks",
+            params={
+                "limit": 50,
+                "offset": offset,
+                "market": "from_token",
+            },
+        )
+
+        items = page.get("items")
+        if not isinstance(items, list) or len(items) == 0:
+            break
+        tracks.extend(
+            _slim_tracks(
+                [item.get("track") for item in items if isinstance(item, dict)]
+            )
+        )
+
+        if not page.get("next"):
+            break
+        offset += 50
+
+    return tracks[:target]
+
+
+def spotify_get_recommendations_tracks(
+    access_token: str,
+    *,
+    limit: int,
+    seed_genres: Optional[list[str]] = None,
+    market: str = "IN",
+) -> list[dict]:
+    target = max(0, min(100, int(limit)))
+    if target == 0:
+        return []
+
+    seeds = seed_genres or ["pop", "dance", "rock"]
+    seeds = [s for s in seeds if isinstance(s, str) and s.strip()][:5]
+    if not seeds:
+        seeds = ["pop"]
+
+    payload = spotify_get(
+        access_token,
+        "/recommendations",
+        params={
+            "limit": target,
+            "market": market,
+            "seed_genres": ",".join(seeds),
+        },
+    )
+    return _slim_tracks(payload.get("tracks") if isinstance(payload, dict) else None)
+
+
+def spotify_search_tracks(
+    access_token: str,
+    *,
+    limit: int,
+    market: str = "IN",
+    queries: Optional[list[str]] = None,
+) -> list[dict]:
+    target = max(0, min(50, int(limit)))
+    if target == 0:
+        return []
+
+    qs = queries or ["Top hits", "Bollywood", "Punjabi hits", "India top songs"]
+    out: list[dict] = []
+    for q in qs[:6]:
+        if len(out) >= target:
+            break
+        payload = spotify_get(
+            access_token,
+            "/search",
+            params={
+                "q": q,
+                "type": "track",
+                "limit": min(50, target - len(out)),
+                "market": market,
+            },
+        )
+        tracks = (
+            payload.get("tracks", {}).get("items")
+            if isinstance(payload, dict)
+            else None
+        )
+        out.extend(_slim_tracks(tracks))
+    return out[:target]
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker around one upstream endpoint.
+
+    Closed: calls go through, and ``failure_threshold`` consecutive failures
+    open the breaker. Open: ``allow()`` is False until ``cooldown_s`` has
+    passed. Then a single caller gets a probe (half-open). A successful probe
+    closes the breaker; a failed one re-opens it for another cool-down. A
+    probe that never reports back is replaced after another cool-down.
+    """
+
+    def __init__(self, failure_threshold: int = 5, cooldown_s: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown_s = cooldown_s
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_at: Optional[float] = None
+        self._short_circuited = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            now = time.monotonic()
+            probe_due = (
+                self._probe_at is None or now - self._probe_at >= self.cooldown_s
+            )
+            if now - self._opened_at >= self.cooldown_s and probe_due:
+                self._probe_at = now
+                return True
+            self._short_circuited += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probe_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._probe_at = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            if self._opened_at is None:
+                state = "closed"
+            elif self._probe_at is not None:
+                state = "half_open"
+            else:
+                state = "open"
+            return {
+                "state": state,
+                "consecutiveFailures": self._failures,
+                "shortCircuited": self._short_circuited,
+            }
+
+
+# /audio-features fails app-wide at times (403 for every user, rate limits,
+# outages); while it does, skip it and fall back to unranked candidates.
+audio_features_breaker = CircuitBreaker(
+    failure_threshold=int(
+        os.environ.get("PIPER_AUDIO_FEATURES_BREAKER_THRESHOLD", "5")
+    ),
+    cooldown_s=float(os.environ.get("PIPER_AUDIO_FEATURES_BREAKER_COOLDOWN_S", "60")),
+)
+
+
+def _is_audio_features_outage(e: HTTPException) -> bool:
+    """Whether a failed batch /audio-features call says the endpoint is down.
+
+    403, 429, 5xx, timeouts and connection errors count. A 401 is specific to
+    the caller's token, other 4xx to the request, and a spent deadline means
+    no request was sent.
+    """
+    if e.status_code in (403, 429):
+        return True
+    detail = str(e.detail)
+    if detail.endswith((":spotify_timeout", ":spotify_unreachable")):
+        return True
+    # Other statuses surface as 502 spotify_error:<status>:<message>.
+    prefix, _, rest = detail.partition(":")
+    status = rest.partition(":")[0]
+    return prefix == "spotify_error" and status.isdigit() and int(status) >= 500
+
+
+def _is_not_found(e: HTTPException) -> bool:
+    return str(e.detail).startswith("spotify_error:404:")
+
+
+def _count_audio_features_error(counts: dict[str, int], e: HTTPException):
+    if _is_not_found(e):
+        counts["not_found"] += 1
+    if e.status_code == 401:
+        counts["unauthorized"] += 1
+    elif e.status_code == 403:
+        counts["forbidden"] += 1
+    elif e.status_code == 429:
+        counts["rate_limited"] += 1
+    else:
+        counts["other_error"] += 1
+
+
+def spotify_iter_audio_features(
+    access_token: str,
+    track_ids: list[str],
+    counts: dict[str, int],
+    *,
+    max_per_track_attempts: int = 1,
+    group_size: int = 10,
+) -> Iterator[dict[str, dict]]:
+    """Fetch audio features with best-effort resiliency, yielding as they arrive.
+
+    Strategy:
+    - Batch fetch via /audio-features?ids=... (<=100 per request)
+    - Fill any missing IDs via per-track /audio-features/{id} with retry
+    - While audio_features_breaker is open, skip both (counts["circuit_open"]);
+      failures of the batch request are what open it
+
+    Yields one {track_id: features} dict per batch request and one per
+    ``group_size`` per-track results. ``counts`` is filled in place: requested,
+    batch_ok, per_track_ok, failed, and the errors seen (unauthorized,
+    forbidden, rate_limited, other_error); not_found counts the other_error
+    that were a 404, for tracks Spotify has no features for (a permanent
+    failure, unlike the rest); circuit_open is set when the breaker skipped
+    some or all of the tracks.
+    """
+    ids = [tid for tid in track_ids if isinstance(tid, str) and tid]
+    counts.update(
+        {
+            "requested": len(ids),
+            "batch_ok": 0,
+            "per_track_ok": 0,
+            "failed": 0,
+            "unauthorized": 0,
+            "forbidden": 0,
+            "rate_limited": 0,
+            "other_error": 0,
+            "not_found": 0,
+        }
+    )
+    if not ids:
+        return
+    if not audio_features_breaker.allow():
+        counts["circuit_open"] = 1
+        counts["failed"] = len(ids)
+        return
+
+    found: set[str] = set()
+    try:
+        for i in range(0, len(ids), 100):
+            payload = spotify_get(
+                access_token,
+                "/audio-features",
+                params={"ids": ",".join(ids[i : i + 100])},
+            )
+            audio_features_breaker.record_success()
+            audio_features = (
+                payload.get("audio_features") if isinstance(payload, dict) else None
+            )
+            if not isinstance(audio_features, list):
+                continue
+            chunk = {
+                f["id"]: f
+                for f in audio_features
+                if isinstance(f, dict) and isinstance(f.get("id"), str) and f["id"]
+            }
+            counts["batch_ok"] += len(chunk)
+            found.update(chunk)
+            if chunk:
+                yield chunk
+    except HTTPException as e:
+        # Only the batch endpoint feeds the breaker: a per-track 404 means
+        # Spotify has no features for that track, not that it is down.
+        if _is_audio_features_outage(e):
+            audio_features_breaker.record_failure()
+        _count_audio_features_error(counts, e)
+
+    missing = [tid for tid in ids if tid not in found]
+    if not missing or max_per_track_attempts <= 0:
+        return
+    group: dict[str, dict] = {}
+    for i, tid in enumerate(missing):
+        remaining = remaining_budget()
+        if remaining is not None and remaining <= 0:
+            # Out of budget: the rest would fail without a request.
+            counts["failed"] += len(missing) - i
+            break
+        if not audio_features_breaker.allow():
+            counts["circuit_open"] = 1
+            counts["failed"] += len(missing) - i
+            break
+        ok = False
+        for _ in range(max_per_track_attempts):
+            try:
+                f = spotify_get(access_token, f"/audio-features/{tid}", hedge=True)
+                audio_features_breaker.record_success()
+                if isinstance(f, dict) and isinstance(f.get("id"), str):
+                    group[f["id"]] = f
+                    counts["per_track_ok"] += 1
+                    ok = True
+                    break
+            except HTTPException as e:
+                _count_audio_features_error(counts, e)
+                break
+            except Exception:
+                counts["other_error"] += 1
+                break
+        if not ok:
+            counts["failed"] += 1
+        if len(group) >= group_size:
+            yield group
+            group = {}
+    if group:
+        yield group
+
+
+def top_track_ids(access_token: str) -> list[str]:
+    """The user's medium-term top track IDs (the recommendation candidates)."""
+    top = spotify_get(
+        access_token,
+        "/me/top/tracks",
+        params={"limit": 50, "time_range": "medium_term"},
+        hedge=True,
+    )
+
+    items = top.get("items")
+
+    if not isinstance(items, list) or len(items) == 0:
+        # New users often have no listening history/top tracks yet.
+        # Do NOT inject unrelated "popular" tracks into the model input; let the caller
+        # fill the playlist using a dedicated fallback path.
+        raise HTTPException(status_code=422, detail="no_top_tracks")
+
+    track_ids: List[str] = [
+        t.get("id")
+        for t in items
+        if isinstance(t, dict) and isinstance(t.get("id"), str)
+    ]
+    track_ids = dedupe_preserve_order(track_ids)
+    if not track_ids:
+        raise HTTPException(status_code=422, detail="no_track_ids")
+    return track_ids
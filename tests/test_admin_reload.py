@@ -0,0 +1,89 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv("PIPER_ADMIN_TOKEN", "s3cret")
+    monkeypatch.setattr(
+        app, "_reload_artifacts", lambda force=False: SimpleNamespace(version="v2")
+    )
+    # Not entered as a context manager: startup (model loading) doesn't run.
+    return TestClient(app.app)
+
+
+def test_reload_is_hidden_without_admin_token(client, monkeypatch):
+    monkeypatch.delenv("PIPER_ADMIN_TOKEN")
+    res = client.post("/admin/reload-model", json={})
+    assert res.status_code == 404
+
+
+@pytest.mark.parametrize("headers", [{}, {"X-Admin-Token": "wrong"}])
+def test_reload_rejects_bad_token(client, headers):
+    res = client.post("/admin/reload-model", json={}, headers=headers)
+    assert res.status_code == 403
+    assert res.json()["detail"] == "admin_token_invalid"
+
+
+def test_reload_with_token(client):
+    res = client.post(
+        "/admin/reload-model", json={}, headers={"X-Admin-Token": "s3cret"}
+    )
+    assert res.status_code == 200
+    assert res.json()["modelVersion"] == "v2"
+
+
+@pytest.fixture
+def registry(client, monkeypatch, tmp_path):
+    """A v1/v2 registry whose loads are counted, with v1 active."""
+    for version in ("v1", "v2"):
+        (tmp_path / version).mkdir()
+    loads: list[str] = []
+
+    def read_registry_artifacts(registry, version):
+        loads.append(version)
+        time.sleep(0.01)
+        return SimpleNamespace(version=version)
+
+    monkeypatch.setattr(app, "MODEL_REGISTRY", str(tmp_path))
+    monkeypatch.setattr(app, "_read_registry_artifacts", read_registry_artifacts)
+    monkeypatch.setattr(app, "artifacts", SimpleNamespace(version="v1"))
+    (tmp_path / "CURRENT").write_text("v1")
+    return SimpleNamespace(path=tmp_path, loads=loads)
+
+
+def _activate(client, version):
+    return client.post(
+        "/admin/reload-model",
+        json={"version": version},
+        headers={"X-Admin-Token": "s3cret"},
+    )
+
+
+def test_activating_a_version_loads_it_once(client, registry):
+    res = _activate(client, "v2")
+    assert res.json() == {"ok": True, "modelVersion": "v2", "previousVersion": "v1"}
+    assert registry.loads == ["v2"]
+    assert (registry.path / "CURRENT").read_text() == "v2"
+    assert app.artifacts.version == "v2"
+
+
+def test_unknown_version_leaves_current_alone(client, registry):
+    assert _activate(client, "v3").status_code == 404
+    assert (registry.path / "CURRENT").read_text() == "v1"
+    assert app.artifacts.version == "v1"
+
+
+def test_concurrent_activations_keep_current_and_model_in_sync(client, registry):
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        responses = list(
+            pool.map(lambda i: _activate(client, f"v{i % 2 + 1}"), range(16))
+        )
+    assert {res.status_code for res in responses} == {200}
+    assert (registry.path / "CURRENT").read_text() == app.artifacts.version
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+import batch_score
+
+
+@pytest.mark.parametrize("save", [np.savez, np.savez_compressed])
+def test_npz_is_read_in_chunks(tmp_path, save):
+    path = tmp_path / "features.npz"
+    ids = np.array([f"track{i:04d}" for i in range(1000)])
+    X = np.random.default_rng(0).random((1000, 5), dtype=np.float32)
+    save(path, features=X, track_ids=ids)
+
+    chunks = list(batch_score.iter_feature_chunks(str(path), batch_size=300))
+    assert [len(chunk_ids) for chunk_ids, _ in chunks] == [300, 300, 300, 100]
+    assert sum((chunk_ids for chunk_ids, _ in chunks), []) == ids.tolist()
+    np.testing.assert_array_equal(np.concatenate([c for _, c in chunks]), X)
+    assert all(c.dtype == np.float32 for _, c in chunks)
+
+
+def test_npz_without_features_is_rejected(tmp_path):
+    path = tmp_path / "other.npz"
+    np.savez(path, track_ids=np.array(["a"]))
+    with pytest.raises(SystemExit):
+        list(batch_score.iter_feature_chunks(str(path), batch_size=10))
@@ -0,0 +1,169 @@
+import pytest
+from fastapi import HTTPException
+
+from piper_core import spotify
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(spotify.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    breaker = spotify.CircuitBreaker(failure_threshold=3, cooldown_s=60)
+    monkeypatch.setattr(spotify, "audio_features_breaker", breaker)
+    return breaker
+
+
+def test_closed_until_threshold_consecutive_failures(clock):
+    breaker = spotify.CircuitBreaker(failure_threshold=3, cooldown_s=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.allow()
+    assert breaker.stats()["state"] == "closed"
+
+    breaker.record_failure()
+    assert breaker.stats()["state"] == "open"
+    assert not breaker.allow()
+    assert breaker.stats()["shortCircuited"] == 1
+
+
+def test_open_then_single_half_open_probe(clock):
+    breaker = spotify.CircuitBreaker(failure_threshold=1, cooldown_s=60)
+    breaker.record_failure()
+    clock.now += 59
+    assert not breaker.allow()
+
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.stats()["state"] == "half_open"
+    # Only one caller probes.
+    assert not breaker.allow()
+
+
+def test_successful_probe_closes(clock):
+    breaker = spotify.CircuitBreaker(failure_threshold=1, cooldown_s=60)
+    breaker.record_failure()
+    clock.now += 60
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.stats() == {
+        "state": "closed",
+        "consecutiveFailures": 0,
+        "shortCircuited": 0,
+    }
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens_for_another_cooldown(clock):
+    breaker = spotify.CircuitBreaker(failure_threshold=1, cooldown_s=60)
+    breaker.record_failure()
+    clock.now += 60
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.stats()["state"] == "open"
+    clock.now += 30
+    assert not breaker.allow()
+    clock.now += 30
+    assert breaker.allow()
+
+
+def test_lost_probe_is_replaced_after_cooldown(clock):
+    breaker = spotify.CircuitBreaker(failure_threshold=1, cooldown_s=60)
+    breaker.record_failure()
+    clock.now += 60
+    assert breaker.allow()
+    clock.now += 59
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+
+
+def _error(detail: str, status_code: int = 502) -> HTTPException:
+    return HTTPException(status_code=status_code, detail=detail)
+
+
+@pytest.mark.parametrize(
+    "error, outage",
+    [
+        (_error("/audio-features:spotify_forbidden:x", 403), True),
+        (_error("spotify_rate_limited", 429), True),
+        (_error("spotify_error:503:Service Unavailable"), True),
+        (_error("/audio-features:spotify_timeout", 504), True),
+        (_error("/audio-features:spotify_unreachable"), True),
+        (_error("/audio-features:spotify_token_invalid", 401), False),
+        (_error("spotify_error:404:Not found"), False),
+        (_error("/audio-features:spotify_deadline_exceeded", 504), False),
+    ],
+)
+def test_outage_classification(error, outage):
+    assert spotify._is_audio_features_outage(error) is outage
+
+
+def _drain(track_ids, **kwargs) -> dict[str, int]:
+    counts: dict[str, int] = {}
+    for _ in spotify.spotify_iter_audio_features("token", track_ids, counts, **kwargs):
+        pass
+    return counts
+
+
+def test_per_track_404s_do_not_open_breaker(monkeypatch, breaker):
+    def fake_get(access_token, path, params=None):
+        if path == "/audio-features":
+            # Spotify answers the batch with nulls for unknown tracks.
+            return {"audio_features": [None] * len(params["ids"].split(","))}
+        raise _error("spotify_error:404:analysis not found")
+
+    monkeypatch.setattr(spotify, "spotify_get", fake_get)
+    for _ in range(3):
+        counts = _drain([f"t{i}" for i in range(5)])
+        assert counts["failed"] == 5
+    assert breaker.stats()["state"] == "closed"
+    assert breaker.stats()["consecutiveFailures"] == 0
+
+
+def test_spent_deadline_does_not_open_breaker(monkeypatch, breaker):
+    def fake_get(access_token, path, params=None):
+        raise _error(f"{path}:spotify_deadline_exceeded", 504)
+
+    monkeypatch.setattr(spotify, "spotify_get", fake_get)
+    for _ in range(5):
+        _drain(["a", "b"], max_per_track_attempts=0)
+    assert breaker.stats()["state"] == "closed"
+
+
+def test_batch_outage_opens_breaker(monkeypatch, breaker):
+    calls = []
+
+    def fake_get(access_token, path, params=None):
+        calls.append(path)
+        raise _error(f"{path}:spotify_forbidden:Forbidden", 403)
+
+    monkeypatch.setattr(spotify, "spotify_get", fake_get)
+    for _ in range(2):
+        _drain(["a", "b"])
+        assert breaker.stats()["state"] == "closed"
+    # The third batch failure opens it, before the per-track fills.
+    counts = _drain(["a", "b"])
+    assert counts["forbidden"] == 1
+    assert breaker.stats()["state"] == "open"
+
+    calls.clear()
+    counts = _drain(["a", "b"])
+    assert calls == []
+    assert counts["circuit_open"] == 1
+    assert counts["failed"] == 2
@@ -0,0 +1,310 @@
+"""The shared endpoints of create_app, over a runtime with a fake model."""
+
+import json
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from piper_core import service
+from piper_core.cache import recommendations_cache
+from piper_core.model import FEATURE_COLUMNS
+
+TRACK_IDS = [f"t{i}" for i in range(10)]
+
+
+def mood_of(track_id: str) -> int:
+    # t0, t5 Happy; t1, t6 Calm; ...
+    return int(track_id[1:]) % 5
+
+
+class FakeRuntime(service.Runtime):
+    """Scores every track by its number, two batches per request."""
+
+    def __init__(self):
+        self.classified: list[str] = []
+        self.scored: list[str] = []
+
+    def current_artifacts(self):
+        return SimpleNamespace(version="v1")
+
+    def csv_path(self) -> str:
+        return ""
+
+    def iter_classify_tracks(self, access_token, track_ids, art, counts):
+        counts.update({"batch_ok": len(track_ids), "failed": 0})
+        self.classified += track_ids
+        half = len(track_ids) // 2
+        for ids in (track_ids[:half], track_ids[half:]):
+            yield ids, [mood_of(t) for t in ids]
+
+    def track_features(self, access_token, track_ids, art, counts):
+        counts.update({"batch_ok": len(track_ids), "failed": 0})
+        X = np.zeros((len(track_ids), len(FEATURE_COLUMNS)), dtype=np.float32)
+        return {}, list(track_ids), X
+
+    def score_tracks(self, track_ids, X, art):
+        self.scored += track_ids
+        return [mood_of(t) for t in track_ids]
+
+
+def fake_top_track_ids(access_token: str) -> list[str]:
+    if access_token == "revoked":
+        raise HTTPException(status_code=401, detail="/me/top/tracks:token_invalid")
+    if access_token == "new":
+        raise HTTPException(status_code=422, detail="no_top_tracks")
+    return TRACK_IDS
+
+
+@pytest.fixture
+def runtime(monkeypatch):
+    monkeypatch.setattr(service, "top_track_ids", fake_top_track_ids)
+    monkeypatch.setattr(recommendations_cache, "ttl_s", 60)
+    recommendations_cache.clear()
+    yield FakeRuntime()
+    recommendations_cache.clear()
+
+
+@pytest.fixture
+def client(runtime):
+    return TestClient(service.create_app(runtime))
+
+
+def _recommend(client, token="tok", headers=None, **body):
+    return client.post(
+        "/recommendations",
+        json={"mood": "Happy", "access_token": token, "limit": 4, **body},
+        headers=headers or {},
+    )
+
+
+def test_recommendations_rank_the_mood_first(client):
+    res = _recommend(client)
+    assert res.status_code == 200
+    assert res.headers["X-Model-Version"] == "v1"
+    assert res.json() == {"trackIds": ["t0", "t5", "t1", "t2"], "fallbackSource": None}
+
+
+def test_repeated_request_is_served_from_the_cache(client, runtime):
+    assert _recommend(client).headers["X-Cache"] == "MISS"
+    res = _recommend(client)
+    assert res.headers["X-Cache"] == "HIT"
+    assert res.json()["trackIds"] == ["t0", "t5", "t1", "t2"]
+    assert len(runtime.classified) == len(TRACK_IDS)
+
+    # Another mood, limit or user is another entry.
+    assert _recommend(client, limit=5).headers["X-Cache"] == "MISS"
+    assert _recommend(client, token="other").headers["X-Cache"] == "MISS"
+
+
+def test_no_cache_bypasses_but_refreshes(client, runtime):
+    _recommend(client)
+    res = _recommend(client, headers={"Cache-Control": "no-cache"})
+    assert res.headers["X-Cache"] == "BYPASS"
+    assert len(runtime.classified) == 2 * len(TRACK_IDS)
+    assert _recommend(client).headers["X-Cache"] == "HIT"
+
+
+def test_invalidate_drops_the_users_entries(client):
+    _recommend(client)
+    _recommend(client, mood="Sad")
+    _recommend(client, token="other")
+    res = client.post("/recommendations/cache/invalidate", json={"access_token": "tok"})
+    assert res.json() == {"ok": True, "invalidated": 2}
+    assert _recommend(client).headers["X-Cache"] == "MISS"
+    assert _recommend(client, token="other").headers["X-Cache"] == "HIT"
+
+
+def test_errors_are_not_cached(client):
+    assert _recommend(client, token="revoked").status_code == 401
+    assert _recommend(client, token="revoked").status_code == 401
+
+
+@pytest.mark.parametrize(
+    "counts, classified",
+    [
+        # Breaker open: nothing classified, the top tracks come back unranked.
+        ({"failed": 10, "circuit_open": 1}, 0),
+        # Audio features failed for some tracks, e.g. out of deadline.
+        ({"batch_ok": 6, "failed": 4, "not_found": 0}, 6),
+    ],
+)
+def test_degraded_answers_are_not_cached(client, runtime, counts, classified):
+    def iter_classify_tracks(access_token, track_ids, art, out):
+        out.update(counts)
+        ids = track_ids[:classified]
+        if ids:
+            yield ids, [mood_of(t) for t in ids]
+
+    runtime.iter_classify_tracks = iter_classify_tracks
+    assert _recommend(client).status_code == 200
+    assert _recommend(client).headers["X-Cache"] == "MISS"
+
+
+def test_missing_audio_features_alone_are_cached(client, runtime):
+    def iter_classify_tracks(access_token, track_ids, art, counts):
+        # Spotify has no features for t9 (404): permanent, not degraded.
+        counts.update({"batch_ok": 9, "failed": 1, "not_found": 1})
+        yield track_ids[:9], [mood_of(t) for t in track_ids[:9]]
+
+    runtime.iter_classify_tracks = iter_classify_tracks
+    _recommend(client)
+    assert _recommend(client).headers["X-Cache"] == "HIT"
+
+
+@pytest.fixture
+def fallback_sources(monkeypatch):
+    """Fallback source name -> tracks or an exception, and an optional hook.
+
+    Each entry can be replaced per test; ``before[name]`` runs before that
+    source answers.
+    """
+    sources = {
+        "liked_songs": [{"id": "t5"}, {"id": "t6"}],
+        "trending": [{"id": "t0"}, {"id": "t1"}, {"id": "t2"}],
+        "spotify_recommendations": [{"id": "t3"}],
+    }
+    before: dict = {}
+
+    def answer(name):
+        if name in before:
+            before[name]()
+        if isinstance(sources[name], Exception):
+            raise sources[name]
+        return sources[name]
+
+    monkeypatch.setattr(
+        service, "spotify_get_saved_tracks", lambda *a, **kw: answer("liked_songs")
+    )
+    monkeypatch.setattr(
+        service, "spotify_get_playlist_tracks", lambda *a, **kw: answer("trending")
+    )
+    monkeypatch.setattr(
+        service,
+        "spotify_get_recommendations_tracks",
+        lambda *a, **kw: answer("spotify_recommendations"),
+    )
+    return SimpleNamespace(sources=sources, before=before)
+
+
+def test_fallback_takes_the_first_source_in_priority_order(client, fallback_sources):
+    # Liked Songs answers last, but still wins over Trending.
+    trending_done = threading.Event()
+    fallback_sources.before["liked_songs"] = lambda: trending_done.wait(5)
+    fallback_sources.before["trending"] = trending_done.set
+
+    res = _recommend(client, token="new", fallback=True)
+    assert res.status_code == 200
+    assert res.json() == {"trackIds": ["t5", "t6"], "fallbackSource": "liked_songs"}
+
+
+def test_fallback_raises_auth_errors_from_a_higher_source(client, fallback_sources):
+    fallback_sources.sources["liked_songs"] = HTTPException(
+        status_code=401, detail="/me/tracks:spotify_token_invalid"
+    )
+    res = _recommend(client, token="new", fallback=True)
+    assert res.status_code == 401
+    assert res.json()["detail"] == "/me/tracks:spotify_token_invalid"
+
+
+def test_fallback_skips_other_errors_and_lower_sources(client, fallback_sources):
+    fallback_sources.sources["liked_songs"] = HTTPException(
+        status_code=503, detail="/me/tracks:spotify_unreachable"
+    )
+    # Behind the winner, even an auth error is ignored.
+    fallback_sources.sources["spotify_recommendations"] = HTTPException(
+        status_code=401, detail="/recommendations:spotify_token_invalid"
+    )
+    res = _recommend(client, token="new", fallback=True)
+    assert res.status_code == 200
+    assert res.json()["fallbackSource"] == "trending"
+    assert res.json()["trackIds"] == ["t0", "t1", "t2"]
+
+
+def test_fallback_with_every_source_empty_is_no_top_tracks(client, fallback_sources):
+    for name in fallback_sources.sources:
+        fallback_sources.sources[name] = []
+    res = _recommend(client, token="new", fallback=True)
+    assert res.status_code == 422
+    assert res.json()["detail"] == "no_top_tracks"
+
+
+def test_fallback_is_opt_in(client, fallback_sources):
+    assert _recommend(client, token="new").status_code == 422
+
+
+def _stream(client, fmt="ndjson", token="tok"):
+    return client.post(
+        f"/recommendations/stream?format={fmt}",
+        json={"mood": "Happy", "access_token": token, "limit": 4},
+    )
+
+
+def test_stream_emits_batches_then_the_ranked_list(client):
+    res = _stream(client)
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("application/x-ndjson")
+    events = [json.loads(line) for line in res.text.splitlines()]
+    assert [e["event"] for e in events] == ["tracks", "tracks", "done"]
+    assert events[0]["trackIds"] == ["t0"]
+    assert events[0]["moods"]["t1"] == "Calm"
+    assert events[1]["trackIds"] == ["t5"]
+    # Same list as /recommendations.
+    assert events[2]["trackIds"] == _recommend(client).json()["trackIds"]
+
+
+def test_stream_as_server_sent_events(client):
+    res = _stream(client, fmt="sse")
+    assert res.headers["content-type"].startswith("text/event-stream")
+    blocks = res.text.strip().split("\n\n")
+    assert [b.splitlines()[0] for b in blocks] == [
+        "event: tracks",
+        "event: tracks",
+        "event: done",
+    ]
+    done = json.loads(blocks[-1].splitlines()[1].removeprefix("data: "))
+    assert done["trackIds"] == ["t0", "t5", "t1", "t2"]
+
+
+def test_stream_reports_late_errors_as_an_event(client, runtime, monkeypatch):
+    def failing(access_token, track_ids, art, counts):
+        yield track_ids[:1], [0]
+        raise HTTPException(status_code=429, detail="spotify_rate_limited")
+
+    monkeypatch.setattr(runtime, "iter_classify_tracks", failing)
+    events = [json.loads(line) for line in _stream(client).text.splitlines()]
+    assert events[-1] == {
+        "event": "error",
+        "status": 429,
+        "detail": "spotify_rate_limited",
+    }
+
+
+def test_stream_errors_before_the_first_event_keep_their_status(client):
+    assert _stream(client, token="revoked").status_code == 401
+
+
+def test_batch_scores_shared_tracks_once(client, runtime):
+    entries = [
+        {"mood": "Happy", "access_token": "a", "limit": 4},
+        {"mood": "Calm", "access_token": "b", "limit": 2},
+        {"mood": "Happy", "access_token": "revoked", "limit": 4},
+    ]
+    res = client.post("/recommendations/batch", json={"requests": entries})
+    assert res.status_code == 200
+    results = res.json()["results"]
+    assert results[0]["trackIds"] == _recommend(client).json()["trackIds"]
+    assert results[1]["trackIds"] == ["t1", "t6"]
+    assert results[2]["trackIds"] == []
+    assert results[2]["error"]["status"] == 401
+    # Both users have the same top tracks: one inference pass, each track once.
+    assert sorted(runtime.scored) == sorted(TRACK_IDS)
+
+
+def test_batch_size_is_bounded(client):
+    entries = [{"mood": "Happy", "access_token": "a"}] * 101
+    res = client.post("/recommendations/batch", json={"requests": entries})
+    assert res.status_code == 422
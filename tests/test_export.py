@@ -0,0 +1,98 @@
+import csv
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from piper_core import export
+from piper_core.export import ExportTopTracksCsvRequest
+
+
+def track(tid: str, name: str | None = None) -> dict:
+    return {"id": tid, "name": name or f"Song {tid}", "artists": [{"name": "A"}]}
+
+
+def features(tid: str) -> dict:
+    return {
+        "id": tid,
+        "danceability": 0.5,
+        "energy": 0.5,
+        "valence": 0.5,
+        "tempo": 120.0,
+        "loudness": -5.0,
+    }
+
+
+@pytest.fixture
+def top_tracks(monkeypatch):
+    """Top tracks by time range; long_term answers first, short_term last."""
+    pages = {
+        "short_term": [track("s1"), track("x", "Short name"), track("both")],
+        "medium_term": [track("both", "Medium name"), track("m1")],
+        "long_term": [track("x", "Long name"), track("l1")],
+    }
+    answered = {name: threading.Event() for name in pages}
+    order = {"short_term": "medium_term", "medium_term": "long_term"}
+
+    def get_top_tracks(access_token, *, limit, time_range):
+        if time_range in order:
+            answered[order[time_range]].wait(5)
+        answered[time_range].set()
+        return pages[time_range]
+
+    monkeypatch.setattr(export, "spotify_get_top_tracks", get_top_tracks)
+    return pages
+
+
+def test_all_ranges_merge_in_range_order_first_seen_wins(top_tracks):
+    req = ExportTopTracksCsvRequest(access_token="tok", time_range="all")
+    catalog, ranges_by_id = export.fetch_export_tracks(req)
+
+    assert catalog.track_ids == ["s1", "x", "both", "m1", "l1"]
+    # Duplicates keep the metadata of the first range they appeared in.
+    assert catalog.names[catalog.row("x")] == "Short name"
+    assert catalog.names[catalog.row("both")] == "Song both"
+    assert ranges_by_id == {
+        "s1": ["short_term"],
+        "x": ["short_term", "long_term"],
+        "both": ["short_term", "medium_term"],
+        "m1": ["medium_term"],
+        "l1": ["long_term"],
+    }
+
+
+def test_single_range_has_no_tags(top_tracks):
+    req = ExportTopTracksCsvRequest(access_token="tok", time_range="long_term")
+    catalog, ranges_by_id = export.fetch_export_tracks(req)
+    assert catalog.track_ids == ["x", "l1"]
+    assert ranges_by_id is None
+
+
+def test_all_ranges_empty_is_no_top_tracks(monkeypatch):
+    monkeypatch.setattr(export, "spotify_get_top_tracks", lambda *a, **kw: [])
+    req = ExportTopTracksCsvRequest(access_token="tok", time_range="all")
+    with pytest.raises(HTTPException) as e:
+        export.fetch_export_tracks(req)
+    assert e.value.detail == "no_top_tracks"
+
+
+def test_csv_rows_are_tagged_with_their_ranges(top_tracks, monkeypatch, tmp_path):
+    def iter_audio_features(access_token, track_ids, counts, **kwargs):
+        counts.update({"batch_ok": len(track_ids), "failed": 0})
+        yield {tid: features(tid) for tid in track_ids}
+
+    monkeypatch.setattr(export, "spotify_iter_audio_features", iter_audio_features)
+    path = str(tmp_path / "top_tracks_features.csv")
+    req = ExportTopTracksCsvRequest(access_token="tok", time_range="all")
+    res = export.export_top_tracks_features(req, path)
+
+    assert res.rowsWritten == res.tracksFetched == 5
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    assert [(r["track_id"], r["track_name"], r["time_range"]) for r in rows] == [
+        ("s1", "Song s1", "short_term"),
+        ("x", "Short name", "short_term,long_term"),
+        ("both", "Song both", "short_term,medium_term"),
+        ("m1", "Song m1", "medium_term"),
+        ("l1", "Song l1", "long_term"),
+    ]
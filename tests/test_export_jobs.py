@@ -0,0 +1,153 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from fastapi import HTTPException
+
+import app
+from piper_core import jobs
+from piper_core.export import ExportTopTracksCsvRequest
+from piper_core.jobs import ExportJobs
+
+REQ = ExportTopTracksCsvRequest(access_token="tok")
+RESULT = {"rowsWritten": 2, "tracksFetched": 2, "failedAudioFeatures": 0}
+
+
+@pytest.fixture
+def export(monkeypatch):
+    """Stub for write_top_tracks_export; set ``release`` to let it finish."""
+    release = threading.Event()
+    release.set()
+
+    def fake_export(req, path, on_progress):
+        on_progress({"stage": "audio_features", "tracksFetched": 2})
+        release.wait(5)
+        with open(path, "w") as f:
+            f.write("track_id\na\nb\n")
+        return RESULT
+
+    monkeypatch.setattr(jobs, "write_top_tracks_export", fake_export)
+    return release
+
+
+def _wait(jobs_: ExportJobs, job_id: str, status: str):
+    for _ in range(500):
+        job = jobs_.get(job_id)
+        if job.status == status:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job never reached {status}: {job}")
+
+
+def _orphan(jobs_: ExportJobs, owner: str) -> str:
+    """A running job row left behind by ``owner``."""
+    job = jobs_.submit(REQ)
+    _wait(jobs_, job.jobId, "done")
+    with jobs_._lock, jobs_._conn:
+        jobs_._conn.execute(
+            "UPDATE export_jobs SET status = 'running', owner = ? WHERE job_id = ?",
+            (owner, job.jobId),
+        )
+    return job.jobId
+
+
+def _dead_pid() -> int:
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    return proc.pid
+
+
+def test_job_runs_to_completion(tmp_path, export):
+    jobs_ = ExportJobs(str(tmp_path))
+    job = _wait(jobs_, jobs_.submit(REQ).jobId, "done")
+    assert job.result == RESULT
+    response = jobs_.result(job.jobId)
+    assert response.headers["X-Rows-Written"] == "2"
+
+
+def test_failed_export_records_the_error(tmp_path, monkeypatch):
+    def failing(req, path, on_progress):
+        raise HTTPException(status_code=401, detail="spotify_token_invalid")
+
+    monkeypatch.setattr(jobs, "write_top_tracks_export", failing)
+    jobs_ = ExportJobs(str(tmp_path))
+    job = _wait(jobs_, jobs_.submit(REQ).jobId, "failed")
+    assert job.error == {"status": 401, "detail": "spotify_token_invalid"}
+    with pytest.raises(HTTPException) as e:
+        jobs_.result(job.jobId)
+    assert e.value.detail == "job_failed"
+
+
+def test_job_of_a_dead_process_is_interrupted(tmp_path, export):
+    jobs_ = ExportJobs(str(tmp_path))
+    job_id = _orphan(jobs_, f"{_dead_pid()}-00000000")
+    job = jobs_.get(job_id)
+    assert job.status == "failed"
+    assert job.error == {"status": 500, "detail": "job_interrupted"}
+    # Persisted, so other workers agree.
+    assert ExportJobs(str(tmp_path)).get(job_id).status == "failed"
+
+
+def test_job_of_an_earlier_process_with_our_pid_is_interrupted(tmp_path, export):
+    jobs_ = ExportJobs(str(tmp_path))
+    job_id = _orphan(jobs_, f"{os.getpid()}-00000000")
+    assert jobs_.get(job_id).error["detail"] == "job_interrupted"
+
+
+def test_job_of_a_live_process_keeps_running(tmp_path, export):
+    jobs_ = ExportJobs(str(tmp_path))
+    job_id = _orphan(jobs_, f"{os.getppid()}-00000000")
+    assert jobs_.get(job_id).status == "running"
+
+
+def test_queue_is_bounded(tmp_path, export):
+    export.clear()
+    jobs_ = ExportJobs(str(tmp_path), max_workers=1, max_pending=1)
+    jobs_.submit(REQ)
+    with pytest.raises(HTTPException) as e:
+        jobs_.submit(REQ)
+    assert e.value.status_code == 503
+    export.set()
+
+
+def test_expired_jobs_are_pruned(tmp_path, export):
+    jobs_ = ExportJobs(str(tmp_path), ttl_s=0)
+    job_id = _wait(jobs_, jobs_.submit(REQ).jobId, "done").jobId
+    assert os.path.exists(tmp_path / f"{job_id}.csv")
+    time.sleep(0.01)
+    jobs_.submit(REQ)
+    with pytest.raises(HTTPException) as e:
+        jobs_.get(job_id)
+    assert e.value.status_code == 404
+    assert not os.path.exists(tmp_path / f"{job_id}.csv")
+
+
+def test_job_endpoints(tmp_path, export, monkeypatch):
+    client = TestClient(app.app)
+    monkeypatch.setattr(app, "export_jobs", None)
+    res = client.post("/export/jobs", json={"access_token": "tok"})
+    assert res.status_code == 503
+
+    monkeypatch.setattr(app, "export_jobs", ExportJobs(str(tmp_path)))
+    assert (
+        client.post(
+            "/export/jobs", json={"access_token": "tok", "stream": True}
+        ).status_code
+        == 422
+    )
+    res = client.post("/export/jobs", json={"access_token": "tok"})
+    assert res.status_code == 202
+    job_id = res.json()["jobId"]
+    assert "tok" not in res.text
+    _wait(app.export_jobs, job_id, "done")
+
+    res = client.get(f"/export/jobs/{job_id}")
+    assert res.json()["result"] == RESULT
+    res = client.get(f"/export/jobs/{job_id}/result")
+    assert res.status_code == 200
+    assert res.text == "track_id\na\nb\n"
+    assert client.get("/export/jobs/unknown").status_code == 404
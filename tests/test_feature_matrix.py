@@ -0,0 +1,43 @@
+import numpy as np
+
+from piper_core.model import FEATURE_COLUMNS, feature_matrix
+
+
+def _features(value: float) -> dict:
+    return {column: value for column in FEATURE_COLUMNS}
+
+
+def test_rows_follow_track_id_order():
+    features = {"a": _features(0.1), "b": _features(0.2), "c": _features(0.3)}
+    X, ids = feature_matrix(["c", "a", "b"], features)
+    assert ids == ["c", "a", "b"]
+    assert X.dtype == np.float32 and X.shape == (3, len(FEATURE_COLUMNS))
+    np.testing.assert_allclose(X[:, 0], [0.3, 0.1, 0.2])
+
+
+def test_unusable_payloads_are_masked_out():
+    features = {
+        "ok1": _features(0.1),
+        "null": {**_features(0.2), "energy": None},
+        "text": {**_features(0.3), "tempo": "fast"},
+        "partial": {"danceability": 0.4},
+        "empty": {},
+        "ok2": _features(0.5),
+    }
+    track_ids = ["ok1", "null", "text", "partial", "empty", "absent", "ok2"]
+    X, ids = feature_matrix(track_ids, features)
+    assert ids == ["ok1", "ok2"]
+    np.testing.assert_allclose(X[:, 0], [0.1, 0.5])
+
+
+def test_numeric_strings_are_parsed():
+    features = {"a": {column: "0.5" for column in FEATURE_COLUMNS}}
+    X, ids = feature_matrix(["a"], features)
+    assert ids == ["a"]
+    np.testing.assert_allclose(X, 0.5)
+
+
+def test_empty_input():
+    X, ids = feature_matrix([], {})
+    assert ids == []
+    assert X.shape == (0, len(FEATURE_COLUMNS))
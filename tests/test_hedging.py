@@ -0,0 +1,62 @@
+import json
+import threading
+import time
+
+import requests
+
+from piper_core import spotify
+
+
+class _Response:
+    ok = True
+    status_code = 200
+    headers: dict = {}
+    # Both JSON backends: jsonio parses .content with orjson.
+    content = json.dumps({"items": []}).encode()
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def test_unhedged_get_bypasses_the_hedger(monkeypatch):
+    class Refusing:
+        def get(self, url, **kwargs):
+            raise AssertionError("went through the hedger")
+
+    monkeypatch.setattr(spotify, "hedger", Refusing())
+    monkeypatch.setattr(requests, "get", lambda url, **kwargs: _Response())
+    assert spotify.spotify_get("token", "/me/tracks") == {"items": []}
+
+
+def test_hedged_get_uses_the_hedger(monkeypatch):
+    calls = []
+
+    class Recording:
+        def get(self, url, **kwargs):
+            calls.append(url)
+            return _Response()
+
+    monkeypatch.setattr(spotify, "hedger", Recording())
+    spotify.spotify_get("token", "/audio-features/x", hedge=True)
+    assert calls == [f"{spotify.SPOTIFY_API_BASE_URL}/audio-features/x"]
+
+
+def test_latency_includes_time_queued_for_a_thread(monkeypatch):
+    def slow_get(url, **kwargs):
+        time.sleep(0.1)
+        return _Response()
+
+    monkeypatch.setattr(requests, "get", slow_get)
+    # One thread and a hedge delay that never fires: the second call queues
+    # behind the first.
+    hedger = spotify.RequestHedger(95, 0.1, max_workers=1, min_delay_s=10)
+    threads = [
+        threading.Thread(target=hedger.get, args=("https://x",)) for _ in range(2)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    latencies = sorted(hedger._latencies)
+    assert latencies[0] < 0.15
+    assert latencies[1] >= 0.19
@@ -0,0 +1,32 @@
+import time
+
+import app
+
+
+def test_touch_is_buffered_until_flush(tmp_path):
+    index = app.MoodIndex(str(tmp_path / "index.sqlite"))
+    index.touch(["a", "b"])
+    with index._lock:
+        rows = index._conn.execute("SELECT COUNT(*) FROM track_activity").fetchone()
+    assert rows == (0,)
+
+    assert index.flush_activity() == 2
+    assert index.flush_activity() == 0
+    assert sorted(index.active_track_ids(0)) == ["a", "b"]
+
+
+def test_reads_see_unflushed_activity(tmp_path):
+    index = app.MoodIndex(str(tmp_path / "index.sqlite"))
+    index.touch(["old"])
+    index.flush_activity()
+    index.touch(["new", "old"])
+    assert sorted(index.active_track_ids(0)) == ["new", "old"]
+    assert index.prune_activity(time.time() + 1) == 2
+
+
+def test_full_buffer_wakes_the_flusher(tmp_path):
+    index = app.MoodIndex(str(tmp_path / "index.sqlite"), activity_buffer_max=3)
+    index.touch(["a", "b"])
+    assert not index.wait_for_activity(0.01)
+    index.touch(["c"])
+    assert index.wait_for_activity(5)
@@ -0,0 +1,116 @@
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import requests
+
+import app
+from piper_core import spotify
+
+V1 = SimpleNamespace(version="v1")
+V2 = SimpleNamespace(version="v2")
+# The fake model predicts Happy (0) under v1 and Sad (1) under v2.
+MOOD_BY_VERSION = {"v1": 0, "v2": 1}
+
+
+def fake_predict_moods(X, art):
+    probabilities = np.zeros((len(X), 5), dtype=np.float32)
+    probabilities[:, MOOD_BY_VERSION[art.version]] = 1
+    return probabilities
+
+
+class _Response:
+    ok = True
+    status_code = 200
+    headers: dict = {}
+
+    def __init__(self, body):
+        self.content = json.dumps(body).encode()
+
+    def json(self):
+        return json.loads(self.content)
+
+
+@pytest.fixture
+def spotify_calls(monkeypatch, tmp_path):
+    """The ids of every /audio-features request; all tracks have features."""
+    calls: list[list[str]] = []
+
+    def fake_get(url, params=None, **kwargs):
+        ids = params["ids"].split(",")
+        calls.append(ids)
+        rows = [
+            {
+                "id": tid,
+                "danceability": 0.5,
+                "energy": 0.5,
+                "valence": 0.5,
+                "tempo": 120.0,
+                "loudness": -5.0,
+            }
+            for tid in ids
+        ]
+        return _Response({"audio_features": rows})
+
+    monkeypatch.setattr(requests, "get", fake_get)
+    monkeypatch.setattr(
+        spotify, "audio_features_breaker", spotify.CircuitBreaker(failure_threshold=5)
+    )
+    monkeypatch.setattr(app, "predict_moods", fake_predict_moods)
+    monkeypatch.setattr(app, "_inference_pool", None)
+    monkeypatch.setattr(app, "mood_index", app.MoodIndex(str(tmp_path / "i.sqlite")))
+    return calls
+
+
+def _index(track_ids, art):
+    X = np.full((len(track_ids), 5), 0.5, dtype=np.float32)
+    app.mood_index.store(track_ids, X, fake_predict_moods(X, art), art.version)
+
+
+def _classify(track_ids, art):
+    counts: dict[str, int] = {}
+    moods = {}
+    for ids, preds in app._iter_classify_tracks("tok", track_ids, art, counts):
+        moods.update(zip(ids, preds))
+    return moods, counts
+
+
+def test_current_entries_skip_the_audio_features_fetch(spotify_calls):
+    _index(["a", "b"], V1)
+    moods, counts = _classify(["a", "b", "c"], V1)
+    assert moods == {"a": 0, "b": 0, "c": 0}
+    assert counts["indexed"] == 2
+    # Only the unindexed track is fetched, then written to the index.
+    assert spotify_calls == [["c"]]
+    assert app.mood_index.lookup(["c"])["c"].model_version == "v1"
+
+    assert _classify(["a", "b", "c"], V1)[0] == moods
+    assert len(spotify_calls) == 1
+
+
+def test_stale_entries_are_rescored_and_written_back(spotify_calls):
+    _index(["a", "b"], V1)
+    moods, _ = _classify(["a", "b"], V2)
+    assert moods == {"a": 1, "b": 1}
+    assert spotify_calls == []
+    entries = app.mood_index.lookup(["a", "b"])
+    assert {e.model_version for e in entries.values()} == {"v2"}
+    assert {e.mood for e in entries.values()} == {1}
+
+
+def test_track_features_splits_known_stale_and_fetched(spotify_calls):
+    _index(["a"], V2)
+    _index(["b"], V1)
+    counts: dict[str, int] = {}
+    known, ids, X = app._track_features("tok", ["a", "b", "c"], V2, counts)
+    assert known == {"a": 1}
+    # Stale entries come with their stored features, ahead of the fetched.
+    assert ids == ["b", "c"]
+    assert X.shape == (2, 5)
+    assert spotify_calls == [["c"]]
+
+    # score_tracks writes the batch back under the current version.
+    assert app.runtime.score_tracks(ids, X, V2) == [1, 1]
+    entries = app.mood_index.lookup(["b", "c"])
+    assert {e.model_version for e in entries.values()} == {"v2"}
@@ -0,0 +1,149 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+from pydantic import ValidationError
+
+import app
+from piper_core import prefetch, service
+from piper_core.prefetch import Prefetcher, PrefetchRequest
+from piper_core.spotify import deadline
+
+ART = SimpleNamespace(version="v1")
+
+
+class FakeRuntime(service.Runtime):
+    def __init__(self):
+        self.release = threading.Event()
+        self.release.set()
+        self.started = threading.Event()
+        self.counts = {"failed": 0, "not_found": 0}
+        self.classified: list[list[str]] = []
+
+    def current_artifacts(self):
+        return ART
+
+    def csv_path(self) -> str:
+        return ""
+
+    def classify_tracks(self, access_token, track_ids, art):
+        self.classified.append(list(track_ids))
+        self.started.set()
+        self.release.wait(5)
+        # Every track but "missing" gets mood 0.
+        ids = [tid for tid in track_ids if tid != "missing"]
+        return ids, [0] * len(ids), dict(self.counts)
+
+
+@pytest.fixture
+def runtime(monkeypatch):
+    monkeypatch.setattr(prefetch, "top_track_ids", lambda token: ["a", "missing"])
+    return FakeRuntime()
+
+
+def _wait_done(prefetcher: Prefetcher, token: str):
+    for _ in range(500):
+        if prefetcher.start(token) == "stashed":
+            return
+        time.sleep(0.01)
+    raise AssertionError("prefetch never finished")
+
+
+def test_stashed_result_is_served(runtime):
+    prefetcher = Prefetcher(runtime)
+    assert prefetcher.start("tok") == "started"
+    _wait_done(prefetcher, "tok")
+    tracks = prefetcher.get("tok", ART)
+    assert tracks.moods == {"a": 0}
+    assert tracks.retry_ids == []
+    assert prefetcher.get("tok", SimpleNamespace(version="v2")) is None
+    prefetcher.close()
+
+
+def test_permanent_failures_are_stashed_without_retry(runtime):
+    runtime.counts = {"failed": 1, "not_found": 1}
+    prefetcher = Prefetcher(runtime)
+    prefetcher.start("tok")
+    _wait_done(prefetcher, "tok")
+    assert prefetcher.get("tok", ART).retry_ids == []
+    prefetcher.close()
+
+
+def test_transient_failures_are_retried_by_the_request(runtime):
+    runtime.counts = {"failed": 1, "not_found": 0, "rate_limited": 1}
+    prefetcher = Prefetcher(runtime)
+    prefetcher.start("tok")
+    _wait_done(prefetcher, "tok")
+    stashed = prefetcher.get("tok", ART)
+    assert stashed.retry_ids == ["missing"]
+
+    ordered_ids, preds, _ = service.classify_stashed(runtime, "tok", stashed, ART)
+    assert runtime.classified[-1] == ["missing"]
+    assert ordered_ids == ["a"] and preds == [0]
+    prefetcher.close()
+
+
+def test_queued_prefetch_is_not_waited_for(runtime):
+    runtime.release.clear()
+    prefetcher = Prefetcher(runtime, max_workers=1)
+    prefetcher.start("first")
+    assert runtime.started.wait(5)
+    assert prefetcher.start("second") == "started"
+
+    start = time.monotonic()
+    with deadline(1.0):
+        assert prefetcher.get("second", ART) is None
+    assert time.monotonic() - start < 0.1
+    runtime.release.set()
+    prefetcher.close()
+
+
+def test_running_prefetch_wait_is_capped(runtime):
+    runtime.release.clear()
+    prefetcher = Prefetcher(runtime, max_wait_fraction=0.25)
+    prefetcher.start("tok")
+    assert runtime.started.wait(5)
+
+    start = time.monotonic()
+    with deadline(0.4):
+        assert prefetcher.get("tok", ART) is None
+    assert time.monotonic() - start < 0.3
+    runtime.release.set()
+    prefetcher.close()
+
+
+def test_running_prefetch_that_finishes_in_time_is_used(runtime):
+    runtime.release.clear()
+    prefetcher = Prefetcher(runtime, max_wait_fraction=0.5)
+    prefetcher.start("tok")
+    assert runtime.started.wait(5)
+    threading.Timer(0.05, runtime.release.set).start()
+    with deadline(2.0):
+        tracks = prefetcher.get("tok", ART)
+    assert tracks is not None and tracks.moods == {"a": 0}
+    prefetcher.close()
+
+
+def test_request_needs_a_token():
+    with pytest.raises(ValidationError):
+        PrefetchRequest(access_token="")
+
+
+def test_prefetch_endpoint(runtime, monkeypatch):
+    client = TestClient(app.app)
+    monkeypatch.setattr(app, "prefetcher", None)
+    assert client.post("/prefetch", json={"access_token": "tok"}).status_code == 503
+
+    prefetcher = Prefetcher(runtime)
+    monkeypatch.setattr(app, "prefetcher", prefetcher)
+    assert client.post("/prefetch", json={"access_token": ""}).status_code == 422
+    res = client.post("/prefetch", json={"access_token": "tok"})
+    assert res.status_code == 202
+    assert res.json()["status"] in ("started", "in_flight", "stashed")
+    _wait_done(prefetcher, "tok")
+    assert client.post("/prefetch", json={"access_token": "tok"}).json() == {
+        "status": "stashed"
+    }
+    prefetcher.close()
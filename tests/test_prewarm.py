@@ -0,0 +1,31 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+import app
+import prewarm
+
+
+def test_main_rescores_active_tracks_with_the_current_model(monkeypatch, tmp_path):
+    path = str(tmp_path / "index.sqlite")
+    index = app.MoodIndex(path)
+    probabilities = np.eye(5, dtype=np.float32)[[0, 0]]
+    index.store(["a", "b"], np.zeros((2, 5), dtype=np.float32), probabilities, "v1")
+    index.touch(["a"])
+    index.flush_activity()
+
+    monkeypatch.delenv("PIPER_PREWARM_SPOTIFY_TOKEN", raising=False)
+    monkeypatch.setattr(
+        app, "load_current_artifacts", lambda: SimpleNamespace(version="v2")
+    )
+    monkeypatch.setattr(
+        prewarm,
+        "predict_moods",
+        lambda X, art: np.eye(5, dtype=np.float32)[[1] * len(X)],
+    )
+    assert prewarm.main(["--mood-index", path]) == 0
+
+    entries = app.MoodIndex(path).lookup(["a", "b"])
+    assert (entries["a"].model_version, entries["a"].mood) == ("v2", 1)
+    # Not requested recently: left for the service to re-score on demand.
+    assert entries["b"].model_version == "v1"
@@ -0,0 +1,73 @@
+import pytest
+
+from piper_core import cache
+from piper_core.cache import ResponseCache, user_key
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    return clock
+
+
+def test_hit_until_ttl(clock):
+    c = ResponseCache(ttl_s=10, max_entries=10)
+    c.put(("u", "Happy"), "v1", "response")
+    clock.now += 10
+    assert c.get(("u", "Happy"), "v1") == "response"
+    clock.now += 0.1
+    assert c.get(("u", "Happy"), "v1") is None
+    # Expired entries are dropped, not kept around.
+    clock.now -= 5
+    assert c.get(("u", "Happy"), "v1") is None
+
+
+def test_other_model_version_misses(clock):
+    c = ResponseCache(ttl_s=10, max_entries=10)
+    c.put(("u", "Happy"), "v1", "response")
+    assert c.get(("u", "Happy"), "v2") is None
+    assert c.get(("u", "Happy"), "v1") is None
+
+
+def test_least_recently_used_is_evicted(clock):
+    c = ResponseCache(ttl_s=10, max_entries=2)
+    c.put(("a",), "v1", 1)
+    c.put(("b",), "v1", 2)
+    assert c.get(("a",), "v1") == 1  # a is now the most recent
+    c.put(("c",), "v1", 3)
+    assert c.get(("b",), "v1") is None
+    assert c.get(("a",), "v1") == 1
+    assert c.get(("c",), "v1") == 3
+
+
+def test_invalidate_user(clock):
+    c = ResponseCache(ttl_s=10, max_entries=10)
+    c.put(("u1", "Happy"), "v1", 1)
+    c.put(("u1", "Sad"), "v1", 2)
+    c.put(("u2", "Happy"), "v1", 3)
+    assert c.invalidate_user("u1") == 2
+    assert c.get(("u1", "Happy"), "v1") is None
+    assert c.get(("u2", "Happy"), "v1") == 3
+
+
+@pytest.mark.parametrize("ttl_s, max_entries", [(0, 10), (10, 0)])
+def test_disabled_cache_stores_nothing(clock, ttl_s, max_entries):
+    c = ResponseCache(ttl_s=ttl_s, max_entries=max_entries)
+    assert not c.enabled
+    c.put(("u",), "v1", 1)
+    assert c.get(("u",), "v1") is None
+
+
+def test_user_key_hides_the_token():
+    key = user_key("secret-token")
+    assert "secret-token" not in key
+    assert key == user_key("secret-token") != user_key("other-token")
@@ -0,0 +1,23 @@
+import pytest
+
+from piper_core.service import Runtime
+
+
+def test_runtime_without_required_methods_fails_at_creation():
+    class Incomplete(Runtime):
+        def current_artifacts(self):
+            return None
+
+    with pytest.raises(TypeError, match="csv_path"):
+        Incomplete()
+
+
+def test_complete_runtime_can_be_created():
+    class Complete(Runtime):
+        def current_artifacts(self):
+            return None
+
+        def csv_path(self):
+            return "/tmp/x.csv"
+
+    assert Complete().csv_path() == "/tmp/x.csv"
@@ -0,0 +1,76 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    index = app.MoodIndex(str(tmp_path / "index.sqlite"))
+    monkeypatch.setattr(app, "artifacts", SimpleNamespace(version="v1"))
+    monkeypatch.setattr(app, "mood_index", index)
+    monkeypatch.setattr(app, "feature_neighbors", app.FeatureNeighbors(index))
+    monkeypatch.setattr(app, "top_track_ids", lambda token: ["a", "b"])
+    monkeypatch.setattr(
+        app.runtime,
+        "classify_tracks",
+        lambda token, track_ids, art: (track_ids, [0] * len(track_ids), {}),
+    )
+    return TestClient(app.app)
+
+
+def test_unindexed_candidates_are_a_503(client):
+    res = client.post(
+        "/recommendations/similar",
+        json={"mood": "Happy", "access_token": "tok", "limit": 5},
+    )
+    assert res.status_code == 503
+    assert res.json()["detail"] == "mood_index_incomplete"
+
+
+def test_indexed_candidates_are_searched(client, monkeypatch):
+    scaler = SimpleNamespace(transform=lambda X: np.asarray(X, dtype=np.float64))
+    art = SimpleNamespace(version="v1", scaler=scaler)
+    monkeypatch.setattr(app, "artifacts", art)
+    rng = np.random.default_rng(0)
+    probabilities = np.zeros((4, 5), dtype=np.float32)
+    probabilities[:, 0] = 1
+    app.mood_index.store(
+        ["a", "b", "c", "d"], rng.random((4, 5), dtype=np.float32), probabilities, "v1"
+    )
+    res = client.post(
+        "/recommendations/similar",
+        json={"mood": "Happy", "access_token": "tok", "limit": 5},
+    )
+    assert res.status_code == 200
+    assert sorted(res.json()["trackIds"]) == ["c", "d"]
+
+
+def test_entries_from_an_older_model_are_not_searched(client, monkeypatch):
+    scaler = SimpleNamespace(transform=lambda X: np.asarray(X, dtype=np.float64))
+    rng = np.random.default_rng(0)
+    happy = np.zeros((2, 5), dtype=np.float32)
+    happy[:, 0] = 1
+    body = {"mood": "Happy", "access_token": "tok", "limit": 5}
+
+    monkeypatch.setattr(app, "artifacts", SimpleNamespace(version="v1", scaler=scaler))
+    app.mood_index.store(["a", "b"], rng.random((2, 5), dtype=np.float32), happy, "v1")
+    app.mood_index.store(["c", "d"], rng.random((2, 5), dtype=np.float32), happy, "v1")
+    assert sorted(
+        client.post("/recommendations/similar", json=body).json()["trackIds"]
+    ) == [
+        "c",
+        "d",
+    ]
+
+    # v2 rolls out: the user's own tracks and "e" are re-scored, "c" and "d"
+    # still carry v1's Happy prediction.
+    monkeypatch.setattr(app, "artifacts", SimpleNamespace(version="v2", scaler=scaler))
+    app.mood_index.store(["a", "b"], rng.random((2, 5), dtype=np.float32), happy, "v2")
+    app.mood_index.store(["e"], rng.random((1, 5), dtype=np.float32), happy[:1], "v2")
+    res = client.post("/recommendations/similar", json=body)
+    assert res.status_code == 200
+    assert res.json()["trackIds"] == ["e"]
@@ -0,0 +1,164 @@
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+import requests
+from fastapi import HTTPException
+
+from piper_core import spotify
+from piper_core.spotify import deadline
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, body=None, headers=None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = headers or {}
+        self.text = self.reason = ""
+        # Both JSON backends: jsonio parses .content with orjson.
+        self.content = json.dumps(body if body is not None else {}).encode()
+
+    def json(self):
+        return json.loads(self.content)
+
+
+@pytest.fixture
+def spotify_responses(monkeypatch):
+    """Queue of responses (or exceptions) for requests.get; records calls."""
+    queue: list = []
+    calls: list[dict] = []
+    sleeps: list[float] = []
+
+    def fake_get(url, **kwargs):
+        calls.append(kwargs)
+        item = queue.pop(0)
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    monkeypatch.setattr(spotify, "hedger", None)
+    monkeypatch.setattr(spotify, "rate_limiter", None)
+    monkeypatch.setattr(requests, "get", fake_get)
+    monkeypatch.setattr(spotify.time, "sleep", sleeps.append)
+    return queue, calls, sleeps
+
+
+def test_transient_failures_are_retried(spotify_responses):
+    queue, calls, sleeps = spotify_responses
+    queue += [FakeResponse(503), requests.Timeout(), FakeResponse(200, {"ok": 1})]
+    assert spotify.spotify_get("tok", "/me/top/tracks") == {"ok": 1}
+    assert len(calls) == 3
+    assert len(sleeps) == 2
+    # Full jitter: each sleep is within the exponential cap of its attempt.
+    assert 0 <= sleeps[0] <= spotify.SPOTIFY_BACKOFF_BASE_S
+    assert 0 <= sleeps[1] <= spotify.SPOTIFY_BACKOFF_BASE_S * 2
+
+
+def test_retry_after_is_honoured(spotify_responses):
+    queue, _, sleeps = spotify_responses
+    queue += [
+        FakeResponse(429, headers={"Retry-After": "2"}),
+        FakeResponse(200, {}),
+    ]
+    spotify.spotify_get("tok", "/me/top/tracks")
+    assert sleeps == [2.0]
+
+
+def test_gives_up_after_max_retries(spotify_responses):
+    queue, calls, _ = spotify_responses
+    queue += [FakeResponse(502)] * 3
+    with pytest.raises(HTTPException) as e:
+        spotify.spotify_get("tok", "/me/top/tracks", max_retries=2)
+    assert e.value.status_code == 502
+    assert len(calls) == 3
+
+
+@pytest.mark.parametrize("status, code", [(400, 502), (401, 401), (404, 502)])
+def test_other_errors_are_not_retried(spotify_responses, status, code):
+    queue, calls, _ = spotify_responses
+    queue += [FakeResponse(status)]
+    with pytest.raises(HTTPException) as e:
+        spotify.spotify_get("tok", "/me/top/tracks")
+    assert e.value.status_code == code
+    assert len(calls) == 1
+
+
+def test_spent_deadline_sends_nothing(spotify_responses):
+    _, calls, _ = spotify_responses
+    with deadline(0.001):
+        end = time.monotonic() + 0.002
+        while time.monotonic() < end:
+            pass
+        with pytest.raises(HTTPException) as e:
+            spotify.spotify_get("tok", "/me/top/tracks")
+    assert e.value.status_code == 504
+    assert e.value.detail == "/me/top/tracks:spotify_deadline_exceeded"
+    assert calls == []
+
+
+def test_backoff_past_the_deadline_raises_the_last_failure(spotify_responses):
+    queue, calls, sleeps = spotify_responses
+    queue += [FakeResponse(429, headers={"Retry-After": "5"})]
+    with deadline(1.0):
+        with pytest.raises(HTTPException) as e:
+            spotify.spotify_get("tok", "/me/top/tracks")
+    assert e.value.status_code == 429
+    assert len(calls) == 1
+    assert sleeps == []
+
+
+def test_request_timeout_is_capped_by_the_deadline(spotify_responses):
+    queue, calls, _ = spotify_responses
+    queue += [FakeResponse(200, {})]
+    with deadline(1.5):
+        spotify.spotify_get("tok", "/me/top/tracks")
+    assert calls[0]["timeout"] <= 1.5
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake monotonic clock that sleep() advances."""
+    clock = SimpleNamespace(now=1000.0, sleeps=[])
+
+    def sleep(seconds):
+        clock.sleeps.append(seconds)
+        clock.now += seconds
+
+    monkeypatch.setattr(spotify.time, "monotonic", lambda: clock.now)
+    monkeypatch.setattr(spotify.time, "sleep", sleep)
+    return clock
+
+
+def test_rate_limiter_paces_requests_after_the_burst(clock):
+    limiter = spotify.RateLimiter(2)
+    assert limiter.acquire() and limiter.acquire()
+    assert clock.sleeps == []
+    assert limiter.acquire()
+    assert clock.sleeps == [0.5]
+    # The next slot is another 0.5 s away.
+    assert not limiter.acquire(timeout=0.1)
+    assert limiter.stats() == {"requests": 3, "delayed": 1, "denied": 1, "maxRps": 2}
+
+
+def test_rate_limit_past_the_deadline_sends_nothing(spotify_responses, monkeypatch):
+    _, calls, _ = spotify_responses
+    limiter = spotify.RateLimiter(1)
+    limiter.acquire()
+    monkeypatch.setattr(spotify, "rate_limiter", limiter)
+    with deadline(0.5):
+        with pytest.raises(HTTPException) as e:
+            spotify.spotify_get("tok", "/me/top/tracks")
+    assert e.value.detail == "/me/top/tracks:spotify_deadline_exceeded"
+    assert calls == []
+    assert limiter.stats()["denied"] == 1
+
+
+def test_hedge_needs_a_free_rate_limit_slot(monkeypatch, clock):
+    limiter = spotify.RateLimiter(1)
+    monkeypatch.setattr(spotify, "rate_limiter", limiter)
+    hedger = spotify.RequestHedger(95, 1.0)
+    assert hedger._try_hedge()
+    assert not hedger._try_hedge()
+    assert hedger.stats()["budgetDenied"] == 1
+    assert clock.sleeps == []